@@ -185,7 +185,8 @@ export default function PublicLoginPage() {
 
   const registerUser = async (userData: User): Promise<{ success: boolean; message?: string; user?: any }> => {
     try {
-      const response = await fetch('http://localhost:8000/api/register/', {
+      // One request creates the account, its emergency contacts and the initial location together
+      const response = await fetch('http://localhost:8000/api/onboard/', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -195,47 +196,25 @@ export default function PublicLoginPage() {
           password: userData.password,
           email: '', // Add email field if needed
           phone: userData.phone,
-          role: 'public'
+          role: 'public',
+          emergency_contacts: (userData.emergencyContacts || [])
+            .filter(c => c.name.trim() && c.phone.trim())
+            .map(contact => ({
+              name: contact.name,
+              phone: contact.phone,
+              relationship: contact.relationship
+            })),
+          location: userData.location && 'lat' in userData.location && 'lng' in userData.location ? {
+            latitude: userData.location.lat,
+            longitude: userData.location.lng,
+            address: userData.location.address || "Current Location"
+          } : null
         })
       })
 
       const data = await response.json()
       
       if (data.status === 'success') {
-        // Add emergency contacts after user registration
-        if (userData.emergencyContacts && userData.emergencyContacts.length > 0) {
-          for (const contact of userData.emergencyContacts.filter(c => c.name.trim() && c.phone.trim())) {
-            await fetch('http://localhost:8000/api/emergency-contacts/', {
-              method: 'POST',
-              headers: {
-                'Content-Type': 'application/json',
-              },
-              body: JSON.stringify({
-                username: userData.username,
-                name: contact.name,
-                phone: contact.phone,
-                relationship: contact.relationship
-              })
-            })
-          }
-        }
-
-        // Save location if available
-        if (userData.location && 'lat' in userData.location && 'lng' in userData.location) {
-          await fetch('http://localhost:8000/api/update-location/', {
-            method: 'POST',
-            headers: {
-              'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-              username: userData.username,
-              latitude: userData.location.lat,
-              longitude: userData.location.lng,
-              address: userData.location.address || "Current Location"
-            })
-          })
-        }
-
         return { success: true, user: data }
       } else {
         return { success: false, message: data.message || "Registration failed. Please try again." }
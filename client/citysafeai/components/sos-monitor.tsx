@@ -15,6 +15,8 @@ export default function SOSMonitor({ userLat, userLng, username, phone }: SOSMon
   const [sosTriggered, setSosTriggered] = useState(false)
   const checkIntervalRef = useRef<NodeJS.Timeout | null>(null)
   const sosTimeoutRef = useRef<NodeJS.Timeout | null>(null)
+  // One key per hotspot visit, so re-fired timers and retries map to the same SOS
+  const sosKeyRef = useRef<string | null>(null)
 
   const SOS_THRESHOLD_MINUTES = 5 // Trigger SOS after 5 minutes in hotspot
 
@@ -41,6 +43,7 @@ export default function SOSMonitor({ userLat, userLng, username, phone }: SOSMon
           setInHotspot(true)
           setHotspotStartTime(Date.now())
           setSosTriggered(false)
+          sosKeyRef.current = crypto.randomUUID()
           
           // Set SOS timer
           sosTimeoutRef.current = setTimeout(() => {
@@ -76,7 +79,8 @@ export default function SOSMonitor({ userLat, userLng, username, phone }: SOSMon
             username,
             phone: phone || localStorage.getItem('userPhone') || 'Not provided',
             location: `${userLat}, ${userLng}`,
-            duration_minutes: SOS_THRESHOLD_MINUTES
+            duration_minutes: SOS_THRESHOLD_MINUTES,
+            idempotency_key: sosKeyRef.current
           })
         })
 
@@ -0,0 +1,95 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ActivityCounter, UserActivity, UserProfile
+from .profiles import profile_cache
+from .rollups import increment_rollups, rollup_counts
+from .write_behind import buffer_from_settings, is_enabled
+
+# Activity types mirrored into denormalized UserProfile stats
+PROFILE_COUNTER_FIELDS = {
+    'report_submitted': 'reports_submitted',
+    'alert_received': 'alerts_received',
+}
+
+
+def _increment_counters(activities):
+    """Add the batch's per-(user, type) counts to ActivityCounter in one upsert
+
+    The increment happens in SQL, so concurrent flushes (the background flusher and
+    a request writing synchronously) cannot lose updates.
+    """
+    totals = defaultdict(lambda: [0, None])
+    for activity in activities:
+        total = totals[(activity.user_profile_id, activity.activity_type)]
+        total[0] += 1
+        if total[1] is None or activity.timestamp > total[1]:
+            total[1] = activity.timestamp
+
+    table = connection.ops.quote_name(ActivityCounter._meta.db_table)
+    sql = (
+        f'INSERT INTO {table} (user_profile_id, activity_type, count, last_at) VALUES (%s, %s, %s, %s) '
+        f'ON CONFLICT (user_profile_id, activity_type) DO UPDATE SET '
+        f'count = {table}.count + excluded.count, '
+        f'last_at = CASE WHEN excluded.last_at > {table}.last_at THEN excluded.last_at ELSE {table}.last_at END'
+    )
+    user_profile_field = ActivityCounter._meta.get_field('user_profile')
+    last_at_field = ActivityCounter._meta.get_field('last_at')
+    params = [
+        (
+            user_profile_field.get_db_prep_value(user_profile_id, connection),
+            activity_type,
+            count,
+            last_at_field.get_db_prep_value(last_at, connection),
+        )
+        for (user_profile_id, activity_type), (count, last_at) in totals.items()
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+    # Counts (and last_active, for logins) are part of the cached profile payload
+    profile_cache.invalidate({user_profile_id for user_profile_id, _ in totals})
+
+    per_profile = defaultdict(dict)
+    for (user_profile_id, activity_type), (count, _) in totals.items():
+        field = PROFILE_COUNTER_FIELDS.get(activity_type)
+        if field:
+            per_profile[user_profile_id][field] = F(field) + count
+    for user_profile_id, updates in per_profile.items():
+        UserProfile.objects.filter(id=user_profile_id).update(**updates)
+
+
+def save_activities(activities):
+    """Insert activity rows and bump their counters and rollups in one transaction"""
+    if not activities:
+        return
+    with transaction.atomic():
+        UserActivity.objects.bulk_create(activities)
+        _increment_counters(activities)
+        increment_rollups(rollup_counts(activities))
+
+
+activity_writer = buffer_from_settings('activity_writes', save_activities, 'ACTIVITY_LOG')
+
+
+def log_activity(user_profile, activity_type, description='', metadata=None) -> bool:
+    """Record an activity off the request path
+
+    The row is timestamped now and written by the next batched flush. Returns True
+    when queued, False when it was written synchronously (logging disabled or the
+    queue is full).
+    """
+    activity = UserActivity(
+        user_profile=user_profile,
+        activity_type=activity_type,
+        description=description,
+        metadata=metadata or {},
+        timestamp=timezone.now(),
+    )
+    if is_enabled('ACTIVITY_LOG') and activity_writer.submit(activity):
+        return True
+    save_activities([activity])
+    return False
+
@@ -0,0 +1,247 @@
+import math
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.utils import timezone
+
+from . import http_client
+from .geo import calculate_distance
+from .upstream import get_service
+
+# Grid cell size in degrees (~1.1 km at the equator)
+CELL_SIZE_DEG = 0.01
+
+# Officers whose last fix is older than this are not offered for dispatch
+MAX_POSITION_AGE_SECONDS = 15 * 60
+
+# Assumed average speed used when OSRM travel times are unavailable
+FALLBACK_SPEED_KMH = 30.0
+
+OSRM_TABLE_URL = "http://router.project-osrm.org/table/v1/driving/"
+
+
+@dataclass
+class OfficerPosition:
+    profile_id: str
+    username: str
+    police_id: Optional[str]
+    police_rank: Optional[str]
+    lat: float
+    lng: float
+    updated_at: float
+    available: bool = True
+
+
+class OfficerPositionIndex:
+    """In-memory grid index of the latest known police officer positions"""
+
+    def __init__(self, cell_size: float = CELL_SIZE_DEG, max_age_seconds: int = MAX_POSITION_AGE_SECONDS):
+        self.cell_size = cell_size
+        self.max_age_seconds = max_age_seconds
+        self._positions: Dict[str, OfficerPosition] = {}
+        self._cells: Dict[Tuple[int, int], Set[str]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Register an object with publish(position) and retract(profile_id), called on every change"""
+        self._listeners.append(listener)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_size), math.floor(lng / self.cell_size))
+
+    def update(self, profile_id, username, lat, lng, police_id=None, police_rank=None,
+               available=True, updated_at=None):
+        """Insert or move an officer in the index"""
+        profile_id = str(profile_id)
+        lat, lng = float(lat), float(lng)
+        position = OfficerPosition(
+            profile_id=profile_id,
+            username=username,
+            police_id=police_id,
+            police_rank=police_rank,
+            lat=lat,
+            lng=lng,
+            updated_at=updated_at if updated_at is not None else time.time(),
+            available=available,
+        )
+        cell = self._cell(lat, lng)
+
+        with self._lock:
+            previous = self._positions.get(profile_id)
+            if previous is not None:
+                # Never let a late or replayed fix move an officer backwards in time
+                if previous.updated_at > position.updated_at:
+                    return
+                old_cell = self._cell(previous.lat, previous.lng)
+                if old_cell != cell:
+                    self._discard_from_cell(old_cell, profile_id)
+            self._positions[profile_id] = position
+            self._cells.setdefault(cell, set()).add(profile_id)
+        for listener in self._listeners:
+            listener.publish(position)
+
+    def update_from_profile(self, user_profile, lat, lng, available=True, updated_at=None):
+        """Index a location write if it belongs to a police officer"""
+        if user_profile.role != 'police':
+            return
+        self.update(
+            user_profile.id,
+            user_profile.username,
+            lat,
+            lng,
+            police_id=user_profile.police_id,
+            police_rank=user_profile.police_rank,
+            available=available,
+            updated_at=updated_at,
+        )
+
+    def remove(self, profile_id):
+        profile_id = str(profile_id)
+        with self._lock:
+            previous = self._positions.pop(profile_id, None)
+            if previous is not None:
+                self._discard_from_cell(self._cell(previous.lat, previous.lng), profile_id)
+        if previous is not None:
+            for listener in self._listeners:
+                listener.retract(profile_id)
+
+    def _discard_from_cell(self, cell, profile_id):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(profile_id)
+            if not members:
+                del self._cells[cell]
+
+    def __len__(self):
+        return len(self._positions)
+
+    def nearest(self, lat: float, lng: float, k: int = 3, available_only: bool = True) -> List[Tuple[float, OfficerPosition]]:
+        """Return up to k (distance_km, position) pairs ordered by straight-line distance"""
+        if k <= 0:
+            return []
+        self.ensure_loaded()
+        now = time.time()
+        center = self._cell(lat, lng)
+        # Distance covered by one ring of cells, using the shorter longitude side
+        ring_km = self.cell_size * 111.32 * max(math.cos(math.radians(lat)), 0.01)
+
+        with self._lock:
+            if not self._positions:
+                return []
+            min_lat = min_lng = math.inf
+            max_lat = max_lng = -math.inf
+            for (ci, cj) in self._cells:
+                min_lat, max_lat = min(min_lat, ci), max(max_lat, ci)
+                min_lng, max_lng = min(min_lng, cj), max(max_lng, cj)
+            max_ring = int(max(
+                abs(center[0] - min_lat), abs(center[0] - max_lat),
+                abs(center[1] - min_lng), abs(center[1] - max_lng),
+            ))
+
+            found: List[Tuple[float, OfficerPosition]] = []
+            ring = 0
+            while ring <= max_ring:
+                for cell in self._ring_cells(center, ring):
+                    for profile_id in self._cells.get(cell, ()):
+                        position = self._positions[profile_id]
+                        if available_only and not position.available:
+                            continue
+                        if now - position.updated_at > self.max_age_seconds:
+                            continue
+                        found.append((calculate_distance(lat, lng, position.lat, position.lng), position))
+                # Everything outside this ring is at least ring * ring_km away
+                if len(found) >= k:
+                    found.sort(key=lambda item: item[0])
+                    if found[k - 1][0] <= ring * ring_km:
+                        break
+                ring += 1
+
+        found.sort(key=lambda item: item[0])
+        return found[:k]
+
+    @staticmethod
+    def _ring_cells(center, ring):
+        ci, cj = center
+        if ring == 0:
+            yield center
+            return
+        for dj in range(-ring, ring + 1):
+            yield (ci - ring, cj + dj)
+            yield (ci + ring, cj + dj)
+        for di in range(-ring + 1, ring):
+            yield (ci + di, cj - ring)
+            yield (ci + di, cj + ring)
+
+    def ensure_loaded(self):
+        """Warm the index from recent police locations on first use"""
+        if self._loaded:
+            return
+        from .models import UserLocation
+
+        cutoff = timezone.now() - timedelta(seconds=self.max_age_seconds)
+        rows = (UserLocation.objects
+                .filter(user_profile__role='police', timestamp__gte=cutoff)
+                .order_by('timestamp')
+                .values_list('user_profile_id', 'user_profile__username', 'user_profile__police_id',
+                             'user_profile__police_rank', 'latitude', 'longitude', 'timestamp'))
+        for profile_id, username, police_id, police_rank, lat, lng, timestamp in rows.iterator():
+            self.update(profile_id, username, lat, lng, police_id=police_id, police_rank=police_rank,
+                        updated_at=timestamp.timestamp())
+        self._loaded = True
+
+
+officer_index = OfficerPositionIndex()
+
+
+def get_travel_times(origin, destinations, max_timeout=3):
+    """Get driving durations in seconds from origin to each destination via the OSRM table service"""
+    if not destinations:
+        return []
+    points = [origin] + list(destinations)
+    coords = ";".join(f"{lng},{lat}" for lat, lng in points)
+    url = f"{OSRM_TABLE_URL}{coords}?sources=0&annotations=duration,distance"
+
+    def fetch(timeout):
+        response = http_client.get(url, timeout=min(timeout, max_timeout))
+        response.raise_for_status()
+        data = response.json()
+        durations = data['durations'][0][1:]
+        distances = data.get('distances', [[None] * len(points)])[0][1:]
+        return list(zip(durations, distances))
+
+    return get_service('osrm').call(fetch, fallback=lambda: None)
+
+
+def find_nearest_units(lat, lng, k=3, refine=True, candidate_factor=3):
+    """Find the k nearest available officers, refined by road travel time when possible"""
+    candidates = officer_index.nearest(lat, lng, k=k * candidate_factor if refine else k)
+    travel = get_travel_times((lat, lng), [(p.lat, p.lng) for _, p in candidates]) if refine and candidates else None
+
+    units = []
+    for i, (distance_km, position) in enumerate(candidates):
+        duration = None
+        road_km = None
+        if travel and travel[i][0] is not None:
+            duration = travel[i][0]
+            road_km = travel[i][1] / 1000 if travel[i][1] is not None else None
+        units.append({
+            'user_id': position.profile_id,
+            'username': position.username,
+            'police_id': position.police_id,
+            'police_rank': position.police_rank,
+            'latitude': position.lat,
+            'longitude': position.lng,
+            'distance_km': round(distance_km, 3),
+            'road_distance_km': round(road_km, 3) if road_km is not None else None,
+            'eta_seconds': round(duration if duration is not None else distance_km / FALLBACK_SPEED_KMH * 3600),
+            'eta_source': 'osrm' if duration is not None else 'straight_line',
+            'last_seen': datetime.fromtimestamp(position.updated_at, tz=dt_timezone.utc).isoformat(),
+        })
+
+    units.sort(key=lambda unit: unit['eta_seconds'])
+    return units[:k]
@@ -0,0 +1,96 @@
+import math
+
+EARTH_RADIUS_KM = 6371
+
+
+def calculate_distance(lat1, lng1, lat2, lng2):
+    """Calculate distance between two coordinates in kilometers"""
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+
+    a = (math.sin(dlat/2) * math.sin(dlat/2) +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
+         math.sin(dlng/2) * math.sin(dlng/2))
+
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    return EARTH_RADIUS_KM * c
+
+
+def parse_lat_lng(value):
+    """Parse a "lat, lng" string into a (lat, lng) float tuple, or None"""
+    if not value or not isinstance(value, str):
+        return None
+    parts = value.split(',')
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lng = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Precision stored for current positions (cells of roughly 5 m x 5 m)
+GEOHASH_PRECISION = 9
+KM_PER_DEGREE_LAT = 111.32
+
+
+def geohash_encode(lat, lng, precision=GEOHASH_PRECISION):
+    """Encode a coordinate as a geohash string of the given length"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        target, span = (lng, lng_range) if even else (lat, lat_range)
+        mid = (span[0] + span[1]) / 2
+        value <<= 1
+        if target >= mid:
+            value |= 1
+            span[0] = mid
+        else:
+            span[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def geohash_cell_degrees(precision):
+    """(height, width) in degrees of a geohash cell at the given precision"""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def bbox_around(lat, lng, radius_km):
+    """(min_lat, min_lng, max_lat, max_lng) of the box enclosing a circle"""
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    dlng = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+    return (max(lat - dlat, -90.0), max(lng - dlng, -180.0),
+            min(lat + dlat, 90.0), min(lng + dlng, 180.0))
+
+
+def geohash_cover(min_lat, min_lng, max_lat, max_lng, max_cells=16):
+    """Geohash prefixes whose cells together cover the bounding box
+
+    Uses the finest precision that needs at most ``max_cells`` cells, so each
+    prefix becomes one index range scan.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        cell_lat, cell_lng = geohash_cell_degrees(precision)
+        lat_cells = range(int((min_lat + 90) // cell_lat), int((max_lat + 90) // cell_lat) + 1)
+        lng_cells = range(int((min_lng + 180) // cell_lng), int((max_lng + 180) // cell_lng) + 1)
+        if len(lat_cells) * len(lng_cells) <= max_cells or precision == 1:
+            return sorted({
+                geohash_encode(min(-90 + (i + 0.5) * cell_lat, 90.0), min(-180 + (j + 0.5) * cell_lng, 180.0), precision)
+                for i in lat_cells for j in lng_cells
+            })
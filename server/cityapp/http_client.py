@@ -0,0 +1,101 @@
+import logging
+import threading
+from functools import partial
+from typing import Dict
+
+import requests
+from django.conf import settings
+from geopy.adapters import RequestsAdapter
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'CitySafeAI/1.0'
+
+# Default connections kept alive per host
+DEFAULT_POOL_MAXSIZE = 10
+
+# Per-host pool sizes, overridable through settings.OUTBOUND_HTTP_POOLS
+DEFAULT_HOST_POOLS = {
+    'http://router.project-osrm.org/': 16,
+    'https://api.telegram.org/': 8,
+    'https://nominatim.openstreetmap.org/': 4,
+}
+
+_adapters: Dict[str, HTTPAdapter] = {}
+_adapters_lock = threading.Lock()
+_local = threading.local()
+_http2_checked = False
+
+
+def _enable_http2():
+    """Switch urllib3 to HTTP/2 when enabled in settings and supported by the installed client"""
+    global _http2_checked
+    if _http2_checked:
+        return
+    _http2_checked = True
+    if not getattr(settings, 'OUTBOUND_HTTP2_ENABLED', False):
+        return
+    try:
+        import h2  # noqa: F401
+        from urllib3.http2 import inject_into_urllib3
+    except ImportError:
+        logger.warning('HTTP/2 requested but not supported by the installed urllib3/h2; using HTTP/1.1 keep-alive')
+        return
+    inject_into_urllib3()
+
+
+def _build_adapters():
+    _enable_http2()
+    pools = dict(DEFAULT_HOST_POOLS)
+    pools.update(getattr(settings, 'OUTBOUND_HTTP_POOLS', {}))
+    default_size = getattr(settings, 'OUTBOUND_HTTP_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE)
+
+    # Retries are left to the upstream circuit breakers, so adapters never retry on their own
+    adapters = {
+        'http://': HTTPAdapter(pool_connections=len(pools) + 10, pool_maxsize=default_size, max_retries=0),
+        'https://': HTTPAdapter(pool_connections=len(pools) + 10, pool_maxsize=default_size, max_retries=0),
+    }
+    for prefix, size in pools.items():
+        adapters[prefix] = HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=0)
+    return adapters
+
+
+def get_session() -> requests.Session:
+    """Return this thread's outbound session; connection pools are shared process-wide
+
+    ``requests.Session`` is not thread-safe, but its ``HTTPAdapter`` connection pools
+    are, so every thread gets its own session mounted on the same adapters.
+    """
+    session = getattr(_local, 'session', None)
+    if session is not None:
+        return session
+
+    if not _adapters:
+        with _adapters_lock:
+            if not _adapters:
+                _adapters.update(_build_adapters())
+
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    # requests matches the most specific mounted prefix, so per-host pools win over the defaults
+    for prefix, adapter in _adapters.items():
+        session.mount(prefix, adapter)
+    _local.session = session
+    return session
+
+
+def get(url, **kwargs):
+    return get_session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return get_session().post(url, **kwargs)
+
+
+def geocoder_adapter_factory():
+    """geopy adapter factory using a keep-alive pool sized for Nominatim"""
+    pools = dict(DEFAULT_HOST_POOLS)
+    pools.update(getattr(settings, 'OUTBOUND_HTTP_POOLS', {}))
+    size = pools.get('https://nominatim.openstreetmap.org/', DEFAULT_POOL_MAXSIZE)
+    return partial(RequestsAdapter, pool_connections=1, pool_maxsize=size, max_retries=0)
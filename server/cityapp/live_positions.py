@@ -0,0 +1,258 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from . import metrics
+from .dispatch import MAX_POSITION_AGE_SECONDS, officer_index
+
+DEFAULT_CONFIG = {
+    # Changes published within one tick are coalesced into a single frame
+    'TICK_MS': 1000,
+    # Frames kept for delta resumption; older subscribers get a full snapshot
+    'HISTORY_FRAMES': 120,
+    'KEEPALIVE_SECONDS': 15,
+    # Streams are closed after this long; EventSource reconnects with Last-Event-ID
+    'MAX_STREAM_SECONDS': 300,
+    # Under a sync server every open stream holds a worker thread for up to MAX_STREAM_SECONDS.
+    # Keep this well below the server's thread count; past it viewers get 503 and should long-poll.
+    'MAX_STREAMS': 20,
+}
+
+
+def live_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'LIVE_POSITIONS', {}))
+    return config
+
+
+def _record(position):
+    return {
+        'id': position.profile_id,
+        'lat': round(position.lat, 6),
+        'lng': round(position.lng, 6),
+        'available': position.available,
+        'ts': round(position.updated_at),
+        'username': position.username,
+        'police_id': position.police_id,
+        'police_rank': position.police_rank,
+    }
+
+
+# Fields that only change when an officer first appears; omitted from diffs afterwards
+STATIC_FIELDS = ('username', 'police_id', 'police_rank')
+
+
+class LivePositionFeed:
+    """Versioned, tick-coalesced view of the officer index for streaming dashboards
+
+    Every tick that saw changes becomes a numbered frame. A subscriber that has
+    acknowledged version ``v`` receives only the officers that changed after ``v``;
+    the serialized diff for each ``v`` is built once per frame and shared by every
+    subscriber at that version, so cost per viewer is a dict lookup.
+
+    Versions only mean something inside one process, so cursors handed to clients
+    are ``<epoch>:<version>``; a cursor from another process or an earlier run of
+    this one gets a full snapshot.
+    """
+
+    def __init__(self, tick_ms=1000, history_frames=120, max_age_seconds=MAX_POSITION_AGE_SECONDS,
+                 max_streams=20, autostart=True):
+        self.tick = tick_ms / 1000
+        self.max_age_seconds = max_age_seconds
+        self.max_streams = max_streams
+        self.autostart = autostart
+        self.epoch = f'{os.getpid():x}{time.time_ns():x}'
+        self.version = 0
+        self._pending: Dict[str, Optional[dict]] = {}
+        self._state: Dict[str, dict] = {}
+        self._first_seen: Dict[str, int] = {}
+        self._frames = deque(maxlen=history_frames)
+        self._payload_cache: Dict[int, str] = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.stats = {'frames': 0, 'snapshots': 0, 'diffs': 0, 'cache_hits': 0, 'subscribers': 0,
+                      'streams_rejected': 0}
+
+    # Listener interface used by OfficerPositionIndex
+
+    def publish(self, position):
+        with self._cond:
+            self._pending[position.profile_id] = _record(position)
+
+    def retract(self, profile_id):
+        with self._cond:
+            self._pending[str(profile_id)] = None
+
+    def _ensure_started(self):
+        if self._thread is not None or not self.autostart:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                # Warm once per process so the first snapshot is complete
+                officer_index.ensure_loaded()
+                self._thread = threading.Thread(target=self._run, name='live-positions-tick', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            self.advance()
+
+    def advance(self):
+        """Close the current tick: fold pending changes and expiries into a new frame"""
+        cutoff = time.time() - self.max_age_seconds
+        with self._cond:
+            pending, self._pending = self._pending, {}
+            for profile_id, record in self._state.items():
+                if profile_id not in pending and record['ts'] < cutoff:
+                    pending[profile_id] = None
+
+            changes = {}
+            for profile_id, record in pending.items():
+                current = self._state.get(profile_id)
+                if record is None:
+                    if current is not None:
+                        del self._state[profile_id]
+                        self._first_seen.pop(profile_id, None)
+                        changes[profile_id] = None
+                elif record != current:
+                    self._state[profile_id] = record
+                    changes[profile_id] = record
+            if not changes:
+                return self.version
+
+            self.version += 1
+            for profile_id, record in changes.items():
+                if record is not None and profile_id not in self._first_seen:
+                    self._first_seen[profile_id] = self.version
+            self._frames.append((self.version, changes))
+            self._payload_cache = {}
+            self.stats['frames'] += 1
+            self._cond.notify_all()
+            return self.version
+
+    def cursor(self, version: int) -> str:
+        return f'{self.epoch}:{version}'
+
+    def parse_cursor(self, value) -> int:
+        """Version acknowledged by a client cursor, or -1 (full snapshot) when it is not from this feed"""
+        epoch, _, version = str(value or '').rpartition(':')
+        if epoch != self.epoch:
+            return -1
+        try:
+            return int(version)
+        except ValueError:
+            return -1
+
+    def payload_since(self, since: int):
+        """(version, serialized frame) bringing a subscriber at ``since`` up to date, or (since, None)
+
+        ``since`` is the last version the subscriber acknowledged, or -1 for none.
+        """
+        self._ensure_started()
+        with self._cond:
+            if since == self.version:
+                return since, None
+            cached = self._payload_cache.get(since)
+            if cached is not None:
+                self.stats['cache_hits'] += 1
+                return self.version, cached
+
+            oldest = self._frames[0][0] if self._frames else self.version + 1
+            if since < 0 or since > self.version or since < oldest - 1:
+                payload = {
+                    'type': 'snapshot',
+                    'version': self.version,
+                    'cursor': self.cursor(self.version),
+                    'officers': list(self._state.values()),
+                }
+                self.stats['snapshots'] += 1
+            else:
+                merged = {}
+                for version, changes in self._frames:
+                    if version > since:
+                        merged.update(changes)
+                upserts = []
+                for profile_id, record in merged.items():
+                    if record is None:
+                        continue
+                    if self._first_seen.get(profile_id, 0) <= since:
+                        record = {k: v for k, v in record.items() if k not in STATIC_FIELDS}
+                    upserts.append(record)
+                payload = {
+                    'type': 'diff',
+                    'version': self.version,
+                    'cursor': self.cursor(self.version),
+                    'since': since,
+                    'upserts': upserts,
+                    'removed': [profile_id for profile_id, record in merged.items() if record is None],
+                }
+                self.stats['diffs'] += 1
+            serialized = json.dumps(payload, separators=(',', ':'))
+            self._payload_cache[since] = serialized
+            return self.version, serialized
+
+    def wait(self, since: int, timeout: float) -> bool:
+        """Block until a frame newer than ``since`` exists; False on timeout"""
+        self._ensure_started()
+        with self._cond:
+            return self._cond.wait_for(lambda: self.version != since, timeout=timeout)
+
+    def has_stream_capacity(self) -> bool:
+        with self._cond:
+            if self.stats['subscribers'] < self.max_streams:
+                return True
+            self.stats['streams_rejected'] += 1
+            return False
+
+    def stream(self, since: int, keepalive_seconds: float, max_seconds: float):
+        """Server-sent events: an initial frame, then one diff per new version
+
+        Streams beyond ``max_streams`` that slip past has_stream_capacity() end at once,
+        after telling EventSource to retry later.
+        """
+        self._ensure_started()
+        with self._cond:
+            full = self.stats['subscribers'] >= self.max_streams
+            if full:
+                self.stats['streams_rejected'] += 1
+            else:
+                self.stats['subscribers'] += 1
+        if full:
+            yield f'retry: {int(max(keepalive_seconds, self.tick) * 1000)}\n\n'
+            return
+        try:
+            # Let EventSource clients back off between stream rotations
+            yield f'retry: {int(self.tick * 1000)}\n\n'
+            ends_at = time.monotonic() + max_seconds
+            while time.monotonic() < ends_at:
+                version, payload = self.payload_since(since)
+                if payload is not None:
+                    # Writing the frame is the acknowledgement; the next diff is against it
+                    since = version
+                    yield f'id: {self.cursor(version)}\ndata: {payload}\n\n'
+                    continue
+                if not self.wait(since, min(keepalive_seconds, max(ends_at - time.monotonic(), 0))):
+                    yield ': keepalive\n\n'
+        finally:
+            with self._cond:
+                self.stats['subscribers'] -= 1
+
+    def snapshot(self):
+        with self._cond:
+            return {'epoch': self.epoch, 'version': self.version, 'officers': len(self._state),
+                    'max_streams': self.max_streams, **dict(self.stats)}
+
+
+_config = live_config()
+
+live_feed = LivePositionFeed(tick_ms=_config['TICK_MS'], history_frames=_config['HISTORY_FRAMES'],
+                             max_streams=_config['MAX_STREAMS'])
+officer_index.add_listener(live_feed)
+metrics.register('live_positions', live_feed.snapshot)
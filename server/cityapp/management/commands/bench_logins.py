@@ -0,0 +1,104 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from cityapp import metrics
+from cityapp.activity_log import activity_writer
+from cityapp.models import UserActivity, UserProfile
+
+BENCH_USERNAME_PREFIX = 'bench_login_'
+BENCH_PASSWORD = 'BenchLogin123'
+
+
+class Command(BaseCommand):
+    help = 'Measure /api/login/ throughput (logins per second) against temporary users, which are removed afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50,
+                            help='Temporary users to create (default: 50)')
+        parser.add_argument('--logins', type=int, default=200,
+                            help='Total logins to perform (default: 200)')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Concurrent login threads, like a shift change (default: 8)')
+
+    def handle(self, *args, **options):
+        usernames = [f'{BENCH_USERNAME_PREFIX}{i}' for i in range(options['users'])]
+        self.session_keys = []
+        self._cleanup()
+        for username in usernames:
+            user = User.objects.create_user(username=username, password=BENCH_PASSWORD)
+            UserProfile.objects.create(user=user, username=username, role='police')
+
+        try:
+            # Password hashing is deliberately slow and usually dominates; time it on its own
+            user = User.objects.get(username=usernames[0])
+            started = time.monotonic()
+            user.check_password(BENCH_PASSWORD)
+            hashing_ms = (time.monotonic() - started) * 1000
+
+            # One warm-up login, counting what the request costs in queries
+            with CaptureQueriesContext(connection) as queries:
+                self._login(usernames[0])
+            writes = [q for q in queries.captured_queries
+                      if q['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))]
+
+            latency = metrics.LatencyRecorder(window=options['logins'])
+            failures = 0
+
+            def run(i):
+                started = time.monotonic()
+                ok = self._login(usernames[i % len(usernames)])
+                latency.record(time.monotonic() - started)
+                return ok
+
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                for ok in pool.map(run, range(options['logins'])):
+                    failures += not ok
+            elapsed = time.monotonic() - started
+            # Joins the background flusher so no queued login activity outlives the users
+            activity_writer.stop()
+        finally:
+            self._cleanup()
+            connection.close()
+
+        stats = latency.snapshot()
+        self.stdout.write(f'Queries per login: {len(queries.captured_queries)} ({len(writes)} writes)')
+        self.stdout.write(f'Password check alone: {hashing_ms:.1f} ms')
+        self.stdout.write(
+            f'Latency: mean {stats["mean_ms"]} ms, p50 {stats["p50_ms"]} ms, '
+            f'p95 {stats["p95_ms"]} ms, max {stats["max_ms"]} ms'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{options["logins"]} logins ({failures} failed) with concurrency {options["concurrency"]} '
+            f'in {elapsed:.2f}s: {options["logins"] / elapsed:.1f} logins/s'
+        ))
+
+    def _login(self, username):
+        try:
+            client = Client(HTTP_HOST='localhost')
+            response = client.post('/api/login/', json.dumps({'username': username, 'password': BENCH_PASSWORD}),
+                                   content_type='application/json')
+            if settings.SESSION_COOKIE_NAME in client.cookies:
+                self.session_keys.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+            return response.status_code == 200
+        finally:
+            # Each worker thread has its own connection; release it before the thread is reused
+            connection.close()
+
+    def _cleanup(self):
+        activity_writer.flush()
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        for session_key in self.session_keys:
+            session_store(session_key).delete()
+        self.session_keys = []
+        UserActivity.objects.filter(user_profile__username__startswith=BENCH_USERNAME_PREFIX).delete()
+        User.objects.filter(username__startswith=BENCH_USERNAME_PREFIX).delete()
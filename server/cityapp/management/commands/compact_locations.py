@@ -0,0 +1,152 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from cityapp.models import UserLocation
+from cityapp.tracks import is_enabled as track_store_enabled, pack_day
+
+# Rough on-disk size of one UserLocation row, used when the database cannot report page usage
+ESTIMATED_ROW_BYTES = 160
+
+
+class Command(BaseCommand):
+    help = ('Pack finished days into per-user tracks, then downsample old UserLocation history into coarser '
+            'retention tiers (safe to run periodically, e.g. nightly from cron)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full-days', type=int, default=7,
+                            help='Keep every fix newer than this many days (default: 7)')
+        parser.add_argument('--minute-days', type=int, default=30,
+                            help='Keep one fix per minute until this many days old (default: 30)')
+        parser.add_argument('--coarse-minutes', type=int, default=10,
+                            help='Bucket size in minutes for fixes older than --minute-days (default: 10)')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Rows deleted per transaction (default: 500)')
+        parser.add_argument('--pause-ms', type=int, default=20,
+                            help='Sleep between delete chunks so writers can take the lock (default: 20)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be deleted without deleting anything')
+
+    def handle(self, *args, **options):
+        if options['minute_days'] < options['full_days']:
+            self.stderr.write('--minute-days must not be smaller than --full-days')
+            return
+
+        now = timezone.now()
+        full_cutoff = now - timedelta(days=options['full_days'])
+        minute_cutoff = now - timedelta(days=options['minute_days'])
+        tiers = [
+            # (newer_than, older_than, bucket_seconds)
+            (minute_cutoff, full_cutoff, 60),
+            (None, minute_cutoff, options['coarse_minutes'] * 60),
+        ]
+
+        # Pack every finished day that is still at full resolution before any of it is thinned out.
+        # Days are repacked on each run until they leave the window, which picks up late uploads.
+        packed = 0
+        if track_store_enabled() and not options['dry_run']:
+            day = full_cutoff.date()
+            while day < now.date():
+                packed += pack_day(day)
+                day += timedelta(days=1)
+
+        bytes_before = self._table_bytes()
+        user_ids = list(UserLocation.objects
+                        .filter(timestamp__lt=full_cutoff)
+                        .order_by('user_profile_id')
+                        .values_list('user_profile_id', flat=True)
+                        .distinct())
+
+        scanned = 0
+        deleted = 0
+        # Work one user at a time so memory stays bounded by a single user's history
+        for user_id in user_ids:
+            redundant = []
+            for newer_than, older_than, bucket_seconds in tiers:
+                ids, count = self._collect_redundant(user_id, newer_than, older_than, bucket_seconds)
+                redundant.extend(ids)
+                scanned += count
+            if options['dry_run']:
+                deleted += len(redundant)
+            else:
+                deleted += self._delete_in_chunks(redundant, options['chunk_size'], options['pause_ms'] / 1000)
+
+        if options['dry_run']:
+            self.stdout.write(
+                f'Dry run: {deleted} of {scanned} fixes older than {options["full_days"]} days '
+                f'would be removed (~{deleted * ESTIMATED_ROW_BYTES} bytes)'
+            )
+            return
+
+        bytes_after = self._table_bytes()
+        if bytes_before is not None and bytes_after is not None:
+            reclaimed = bytes_before - bytes_after
+            source = 'measured'
+        else:
+            reclaimed = deleted * ESTIMATED_ROW_BYTES
+            source = 'estimated'
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {deleted} of {scanned} fixes older than {options["full_days"]} days '
+            f'across {len(user_ids)} users; {reclaimed} bytes reclaimed ({source}); '
+            f'{packed} fixes packed into tracks'
+        ))
+
+    def _collect_redundant(self, user_id, newer_than, older_than, bucket_seconds):
+        """Return ids of every fix in the tier that is not the first in its time bucket
+
+        The last fix of the tier is kept as well, so the retained track still ends where it did.
+        """
+        queryset = UserLocation.objects.filter(user_profile_id=user_id, timestamp__lt=older_than)
+        if newer_than is not None:
+            queryset = queryset.filter(timestamp__gte=newer_than)
+
+        rows = (queryset
+                .order_by('timestamp')
+                .values_list('id', 'timestamp'))
+
+        redundant = []
+        scanned = 0
+        last_bucket = None
+        for location_id, timestamp in rows:
+            scanned += 1
+            bucket = int(timestamp.timestamp()) // bucket_seconds
+            if bucket == last_bucket:
+                redundant.append(location_id)
+            else:
+                last_bucket = bucket
+        if redundant and redundant[-1] == location_id:
+            redundant.pop()
+        return redundant, scanned
+
+    def _delete_in_chunks(self, ids, chunk_size, pause):
+        """Delete in short transactions so the SQLite write lock is never held for long"""
+        deleted = 0
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            with transaction.atomic():
+                count, _ = UserLocation.objects.filter(id__in=chunk).delete()
+            deleted += count
+            if pause:
+                time.sleep(pause)
+        return deleted
+
+    def _table_bytes(self):
+        """Bytes used by the location table and its indexes, when SQLite's dbstat is available"""
+        if connection.vendor != 'sqlite':
+            return None
+        table = UserLocation._meta.db_table
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT SUM(pgsize - unused) FROM dbstat "
+                    "WHERE name = %s OR name IN (SELECT name FROM sqlite_master WHERE tbl_name = %s AND type = 'index')",
+                    [table, table],
+                )
+                row = cursor.fetchone()
+        except Exception:
+            return None
+        return row[0] if row and row[0] is not None else None
@@ -0,0 +1,117 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from cityapp.models import Officer
+from cityapp.roster import bump_roster_version
+
+ROSTER_FIELDS = ('name', 'rank', 'district', 'is_active')
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'active'}
+
+
+def read_rows(handle, fmt):
+    """Yield one dict per roster record without loading the whole file"""
+    if fmt == 'csv':
+        yield from csv.DictReader(handle)
+        return
+    for line in handle:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def to_officer(row, now):
+    """Officer for one input record, or None when it lacks the required fields"""
+    if not isinstance(row, dict):
+        return None
+    police_id = str(row.get('police_id') or '').strip()
+    name = str(row.get('name') or '').strip()
+    rank = str(row.get('rank') or '').strip()
+    if not police_id or not name or not rank:
+        return None
+    is_active = row.get('is_active', True)
+    if isinstance(is_active, str):
+        is_active = is_active.strip().lower() in TRUE_VALUES if is_active.strip() else True
+    return Officer(
+        police_id=police_id,
+        name=name,
+        rank=rank,
+        district=str(row.get('district') or '').strip(),
+        is_active=bool(is_active),
+        updated_at=now,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Upsert officers into the roster from a CSV or NDJSON file (police_id, name, rank, district, is_active)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Roster file, or '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default=None,
+                            help='Input format (default: from the file extension, csv for stdin)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Officers upserted per transaction (default: 1000)')
+        parser.add_argument('--deactivate-missing', action='store_true',
+                            help='Deactivate active officers that are not in the file (treat it as the full roster)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        batch_size = options['batch_size']
+        started_at = timezone.now()
+
+        upserted = skipped = 0
+        batch = {}
+        handle = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            for line_number, row in enumerate(read_rows(handle, fmt), start=1):
+                officer = to_officer(row, started_at)
+                if officer is None:
+                    skipped += 1
+                    self.stderr.write(f'Skipping record {line_number}: police_id, name and rank are required')
+                    continue
+                # Later records for the same police ID win, as they would across batches
+                batch[officer.police_id] = officer
+                if len(batch) >= batch_size:
+                    upserted += self._upsert(batch.values())
+                    batch = {}
+            upserted += self._upsert(batch.values())
+        except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise CommandError(f'Could not read {path}: {e} ({upserted} officers already imported)')
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+            # Whatever made it in is visible to every process, even if the import stopped early
+            if upserted:
+                bump_roster_version()
+
+        deactivated = 0
+        if options['deactivate_missing']:
+            # Every officer in the file was written at started_at or later; anything older was not in it
+            deactivated = (Officer.objects.filter(is_active=True, updated_at__lt=started_at)
+                           .update(is_active=False, updated_at=timezone.now()))
+            if deactivated:
+                bump_roster_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Upserted {upserted} officers ({skipped} records skipped, {deactivated} deactivated)'
+        ))
+
+    @staticmethod
+    def _upsert(officers):
+        officers = list(officers)
+        if not officers:
+            return 0
+        with transaction.atomic():
+            Officer.objects.bulk_create(
+                officers,
+                update_conflicts=True,
+                unique_fields=['police_id'],
+                update_fields=[*ROSTER_FIELDS, 'updated_at'],
+            )
+        return len(officers)
@@ -0,0 +1,39 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from cityapp.sos_queue import sos_queue_config, sos_workers
+
+
+class Command(BaseCommand):
+    help = ('Deliver queued SOS alerts in a dedicated process (set SOS_QUEUE["RUN_IN_PROCESS"] = False '
+            'so web processes only enqueue)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker threads (default: SOS_QUEUE["WORKERS"])')
+        parser.add_argument('--once', action='store_true',
+                            help='Deliver everything currently due, then exit (e.g. from cron)')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            attempted = sos_workers.process_due()
+            self.stdout.write(self.style.SUCCESS(f'Attempted {attempted} SOS deliveries'))
+            return
+
+        sos_workers.workers = options['workers'] or sos_queue_config()['WORKERS']
+        stopping = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stopping.set())
+
+        sos_workers.start()
+        self.stdout.write(f'Delivering SOS alerts with {sos_workers.workers} workers; Ctrl-C to stop')
+        while not stopping.wait(60):
+            stats = sos_workers.snapshot()
+            self.stdout.write(
+                f"delivered {stats['delivered']}, retried {stats['retried']}, failed {stats['failed']}, "
+                f"queued {stats['queued']}"
+            )
+        sos_workers.stop()
+        self.stdout.write(self.style.SUCCESS('SOS workers stopped'))
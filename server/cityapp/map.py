@@ -7,10 +7,14 @@ import requests
 app = Flask(__name__)
 geolocator = Nominatim(user_agent="route_app")
 
+# Reuse keep-alive connections to OSRM across requests; this Flask prototype runs outside
+# Django, so it cannot use cityapp.http_client (the app's routing goes through routing.py)
+session = requests.Session()
+
 # Function to get route from OSRM
 def get_route_coords(start_lat, start_lon, end_lat, end_lon):
     url = f"http://router.project-osrm.org/route/v1/driving/{start_lon},{start_lat};{end_lon},{end_lat}?overview=full&geometries=geojson"
-    response = requests.get(url).json()
+    response = session.get(url, timeout=10).json()
     # Return the list of coordinates along the route
     return response['routes'][0]['geometry']['coordinates']
 
@@ -0,0 +1,57 @@
+import threading
+from collections import deque
+from typing import Callable, Dict
+
+_collectors: Dict[str, Callable[[], dict]] = {}
+_lock = threading.Lock()
+
+
+def register(name: str, collector: Callable[[], dict]):
+    """Register a callable returning a JSON-serialisable snapshot under name"""
+    with _lock:
+        _collectors[name] = collector
+
+
+def snapshot() -> Dict[str, dict]:
+    """Collect the current value of every registered metric source"""
+    with _lock:
+        collectors = dict(_collectors)
+    result = {}
+    for name, collector in collectors.items():
+        try:
+            result[name] = collector()
+        except Exception as e:
+            result[name] = {'error': str(e)}
+    return result
+
+
+class LatencyRecorder:
+    """Rolling window of durations with count, mean and percentiles in milliseconds"""
+
+    def __init__(self, window: int = 500):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self.count
+        if not samples:
+            return {'count': count, 'mean_ms': None, 'p50_ms': None, 'p95_ms': None, 'max_ms': None}
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 2)
+
+        return {
+            'count': count,
+            'mean_ms': round(sum(samples) / len(samples) * 1000, 2),
+            'p50_ms': pct(0.50),
+            'p95_ms': pct(0.95),
+            'max_ms': round(samples[-1] * 1000, 2),
+        }
@@ -0,0 +1,54 @@
+from django.conf import settings
+
+from .upstream import current_deadline, deadline_at, deadline_scope
+
+# Default time budget for all upstream calls made while serving one request
+DEFAULT_REQUEST_BUDGET_SECONDS = 8.0
+
+# Bounds for a client-supplied budget; tiny budgets would push every upstream call into its fallback
+MIN_CLIENT_BUDGET_SECONDS = 1.0
+MAX_CLIENT_BUDGET_SECONDS = 60.0
+
+
+class UpstreamDeadlineMiddleware:
+    """Propagate a per-request deadline to every upstream call made by the view
+
+    Clients may override the budget with an ``X-Request-Timeout-Ms`` header.
+    Streaming responses are generated after the view returns, so the deadline
+    captured with the response is re-entered while each chunk is produced.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        budget = getattr(settings, 'UPSTREAM_REQUEST_BUDGET_SECONDS', DEFAULT_REQUEST_BUDGET_SECONDS)
+        header = request.headers.get('X-Request-Timeout-Ms')
+        if header:
+            try:
+                budget = min(max(int(header) / 1000, MIN_CLIENT_BUDGET_SECONDS), MAX_CLIENT_BUDGET_SECONDS)
+            except ValueError:
+                pass
+
+        with deadline_scope(budget):
+            response = self.get_response(request)
+            deadline = current_deadline()
+        if getattr(response, 'streaming', False) and not response.is_async:
+            response.streaming_content = _within_deadline(response.streaming_content, deadline)
+        return response
+
+
+def _within_deadline(content, deadline):
+    """Yield from ``content`` with the request deadline in force while each chunk is produced
+
+    The scope is left before every yield, so the deadline never leaks into the server
+    code iterating the response.
+    """
+    iterator = iter(content)
+    while True:
+        with deadline_at(deadline):
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:21
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0002_auto_20250907_0905'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userlocation',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_current_positions(apps, schema_editor):
+    UserLocation = apps.get_model('cityapp', 'UserLocation')
+    CurrentPosition = apps.get_model('cityapp', 'CurrentPosition')
+
+    latest = {}
+    rows = UserLocation.objects.order_by('timestamp').values_list(
+        'user_profile_id', 'latitude', 'longitude', 'address', 'accuracy', 'timestamp'
+    )
+    for user_profile_id, latitude, longitude, address, accuracy, timestamp in rows.iterator():
+        latest[user_profile_id] = CurrentPosition(
+            user_profile_id=user_profile_id, latitude=latitude, longitude=longitude,
+            address=address, accuracy=accuracy, timestamp=timestamp,
+        )
+    CurrentPosition.objects.bulk_create(latest.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0003_userlocation_client_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentPosition',
+            fields=[
+                ('user_profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='current_position', serialize=False, to='cityapp.userprofile')),
+                ('latitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('longitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('address', models.CharField(blank=True, max_length=500, null=True)),
+                ('accuracy', models.FloatField(blank=True, help_text='Location accuracy in meters', null=True)),
+                ('timestamp', models.DateTimeField(db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Current Position',
+                'verbose_name_plural': 'Current Positions',
+            },
+        ),
+        migrations.RunPython(backfill_current_positions, migrations.RunPython.noop),
+    ]
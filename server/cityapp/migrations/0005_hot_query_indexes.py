@@ -0,0 +1,25 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0004_currentposition'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emergencycontact',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user_profile', '-created_at'], name='contact_profile_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['user_profile', '-timestamp'], name='activity_profile_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlocation',
+            index=models.Index(fields=['user_profile', '-timestamp'], name='location_profile_ts_idx'),
+        ),
+    ]
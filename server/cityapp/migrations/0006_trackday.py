@@ -0,0 +1,35 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('data', models.BinaryField(default=b'')),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('last_lat_e6', models.IntegerField(default=0)),
+                ('last_lng_e6', models.IntegerField(default=0)),
+                ('last_offset', models.IntegerField(default=0)),
+                ('last_accuracy_dm', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_days', to='cityapp.userprofile')),
+            ],
+            options={
+                'verbose_name': 'Track Day',
+                'verbose_name_plural': 'Track Days',
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('user_profile', 'day'), name='trackday_profile_day_uniq')],
+            },
+        ),
+    ]
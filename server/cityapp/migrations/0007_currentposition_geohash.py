@@ -0,0 +1,30 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:31
+
+from django.db import migrations, models
+
+from cityapp.geo import geohash_encode
+
+
+def backfill_geohashes(apps, schema_editor):
+    CurrentPosition = apps.get_model('cityapp', 'CurrentPosition')
+
+    positions = list(CurrentPosition.objects.all())
+    for position in positions:
+        position.geohash = geohash_encode(float(position.latitude), float(position.longitude))
+    CurrentPosition.objects.bulk_update(positions, ['geohash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0006_trackday'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currentposition',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=12),
+        ),
+        migrations.RunPython(backfill_geohashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0007_currentposition_geohash'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='useractivity',
+            name='activity_profile_ts_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='userlocation',
+            name='location_profile_ts_idx',
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['user_profile', '-timestamp', '-id'], name='activity_profile_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['user_profile', 'activity_type', '-timestamp', '-id'], name='activity_profile_type_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlocation',
+            index=models.Index(fields=['user_profile', '-timestamp', '-id'], name='location_profile_ts_idx'),
+        ),
+    ]
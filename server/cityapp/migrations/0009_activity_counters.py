@@ -0,0 +1,59 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def backfill_activity_counters(apps, schema_editor):
+    UserActivity = apps.get_model('cityapp', 'UserActivity')
+    ActivityCounter = apps.get_model('cityapp', 'ActivityCounter')
+    UserProfile = apps.get_model('cityapp', 'UserProfile')
+
+    rows = (UserActivity.objects
+            .order_by()
+            .values('user_profile_id', 'activity_type')
+            .annotate(count=Count('id'), last_at=Max('timestamp')))
+    ActivityCounter.objects.bulk_create([ActivityCounter(**row) for row in rows], batch_size=500)
+
+    # These profile stats were never maintained before; derive them from the counters
+    for activity_type, field in (('report_submitted', 'reports_submitted'), ('alert_received', 'alerts_received')):
+        for counter in ActivityCounter.objects.filter(activity_type=activity_type):
+            UserProfile.objects.filter(id=counter.user_profile_id).update(**{field: counter.count})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0008_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='useractivity',
+            name='activity_type',
+            field=models.CharField(choices=[('login', 'User Login'), ('logout', 'User Logout'), ('sos_sent', 'SOS Alert Sent'), ('location_updated', 'Location Updated'), ('report_submitted', 'Report Submitted'), ('contact_added', 'Emergency Contact Added'), ('contact_removed', 'Emergency Contact Removed'), ('alert_received', 'Safety Alert Received'), ('profile_updated', 'Profile Updated')], max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='useractivity',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='ActivityCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_type', models.CharField(choices=[('login', 'User Login'), ('logout', 'User Logout'), ('sos_sent', 'SOS Alert Sent'), ('location_updated', 'Location Updated'), ('report_submitted', 'Report Submitted'), ('contact_added', 'Emergency Contact Added'), ('contact_removed', 'Emergency Contact Removed'), ('alert_received', 'Safety Alert Received'), ('profile_updated', 'Profile Updated')], max_length=50)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('last_at', models.DateTimeField()),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_counters', to='cityapp.userprofile')),
+            ],
+            options={
+                'verbose_name': 'Activity Counter',
+                'verbose_name_plural': 'Activity Counters',
+                'constraints': [models.UniqueConstraint(fields=('user_profile', 'activity_type'), name='activitycounter_profile_type_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_activity_counters, migrations.RunPython.noop),
+    ]
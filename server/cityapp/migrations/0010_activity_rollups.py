@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0009_activity_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=5)),
+                ('bucket_start', models.DateTimeField()),
+                ('activity_type', models.CharField(choices=[('login', 'User Login'), ('logout', 'User Logout'), ('sos_sent', 'SOS Alert Sent'), ('location_updated', 'Location Updated'), ('report_submitted', 'Report Submitted'), ('contact_added', 'Emergency Contact Added'), ('contact_removed', 'Emergency Contact Removed'), ('alert_received', 'Safety Alert Received'), ('profile_updated', 'Profile Updated')], max_length=50)),
+                ('cell', models.CharField(blank=True, default='', max_length=12)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Activity Rollup',
+                'verbose_name_plural': 'Activity Rollups',
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'activity_type', 'cell', 'bucket_start'), name='activityrollup_bucket_uniq')],
+            },
+        ),
+    ]
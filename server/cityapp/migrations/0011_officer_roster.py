@@ -0,0 +1,72 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:48
+
+from django.db import migrations, models
+
+
+# The roster that used to be hard-coded as VALID_POLICE_IDS in views.py
+SEED_OFFICERS = [
+    ('TN001', 'Inspector Rajesh Kumar', 'Inspector'),
+    ('TN002', 'Sub-Inspector Priya Sharma', 'Sub-Inspector'),
+    ('TN003', 'Constable Murugan S', 'Constable'),
+    ('TN004', 'Inspector Kavitha R', 'Inspector'),
+    ('TN005', 'Head Constable Ravi Kumar', 'Head Constable'),
+    ('TN006', 'Sub-Inspector Arun M', 'Sub-Inspector'),
+    ('TN007', 'Constable Lakshmi P', 'Constable'),
+    ('TN008', 'Inspector Senthil Kumar', 'Inspector'),
+    ('TN009', 'Sub-Inspector Meera J', 'Sub-Inspector'),
+    ('TN010', 'Constable Karthik V', 'Constable'),
+]
+
+
+def seed_roster(apps, schema_editor):
+    Officer = apps.get_model('cityapp', 'Officer')
+    OfficerRosterVersion = apps.get_model('cityapp', 'OfficerRosterVersion')
+    Officer.objects.bulk_create([
+        Officer(police_id=police_id, name=name, rank=rank) for police_id, name, rank in SEED_OFFICERS
+    ], ignore_conflicts=True)
+    OfficerRosterVersion.objects.get_or_create(id=1, defaults={'version': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0010_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Officer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('police_id', models.CharField(max_length=50, unique=True)),
+                ('name', models.CharField(max_length=200)),
+                ('rank', models.CharField(max_length=100)),
+                ('district', models.CharField(blank=True, default='', max_length=100)),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Officer',
+                'verbose_name_plural': 'Officer Roster',
+                'ordering': ['police_id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OfficerRosterVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Officer Roster Version',
+                'verbose_name_plural': 'Officer Roster Version',
+            },
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='police_id',
+            field=models.CharField(blank=True, db_index=True, help_text='Police ID for police officers', max_length=50, null=True),
+        ),
+        migrations.RunPython(seed_roster, migrations.RunPython.noop),
+    ]
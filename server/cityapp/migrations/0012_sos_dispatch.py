@@ -0,0 +1,42 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:53
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0011_officer_roster'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SOSDispatch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('username', models.CharField(max_length=150)),
+                ('phone', models.CharField(max_length=20)),
+                ('location', models.CharField(max_length=500)),
+                ('duration_minutes', models.PositiveIntegerField(default=0)),
+                ('nearest_units', models.JSONField(blank=True, default=list)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('delivered', 'Delivered'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('delivered_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user_profile', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sos_dispatches', to='cityapp.userprofile')),
+            ],
+            options={
+                'verbose_name': 'SOS Dispatch',
+                'verbose_name_plural': 'SOS Dispatches',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='sosdispatch_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:55
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0012_sos_dispatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('sos', 'SOS Alert'), ('alert', 'Safety Alert')], max_length=10)),
+                ('transport', models.CharField(max_length=20)),
+                ('recipient', models.CharField(max_length=200)),
+                ('status', models.CharField(choices=[('sent', 'Sent'), ('failed', 'Failed')], max_length=10)),
+                ('error', models.TextField(blank=True, default='')),
+                ('provider_message_id', models.CharField(blank=True, default='', max_length=100)),
+                ('latency_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('contact', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deliveries', to='cityapp.emergencycontact')),
+                ('sos_dispatch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='cityapp.sosdispatch')),
+                ('user_profile', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notification_deliveries', to='cityapp.userprofile')),
+            ],
+            options={
+                'verbose_name': 'Notification Delivery',
+                'verbose_name_plural': 'Notification Deliveries',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user_profile', '-created_at'], name='delivery_profile_ts_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0013_notification_deliveries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sosdispatch',
+            name='area',
+            field=models.CharField(blank=True, default='', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='sosdispatch',
+            name='idempotency_key',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='sosdispatch',
+            name='kind',
+            field=models.CharField(choices=[('alert', 'SOS Alert'), ('update', 'SOS Update'), ('digest', 'Area Digest')], default='alert', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='sosdispatch',
+            name='last_repeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sosdispatch',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='cityapp.sosdispatch'),
+        ),
+        migrations.AddField(
+            model_name='sosdispatch',
+            name='repeat_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='sosdispatch',
+            index=models.Index(fields=['username', 'kind', '-created_at'], name='sosdispatch_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sosdispatch',
+            index=models.Index(fields=['area', 'kind', '-created_at'], name='sosdispatch_area_ts_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='sosdispatch',
+            constraint=models.UniqueConstraint(condition=models.Q(('idempotency_key', ''), _negated=True), fields=('username', 'idempotency_key'), name='sosdispatch_idempotency_uniq'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 23:18
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0014_sos_coalescing'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='trackday',
+            name='last_accuracy_dm',
+        ),
+        migrations.RemoveField(
+            model_name='trackday',
+            name='last_lat_e6',
+        ),
+        migrations.RemoveField(
+            model_name='trackday',
+            name='last_lng_e6',
+        ),
+        migrations.RemoveField(
+            model_name='trackday',
+            name='last_offset',
+        ),
+    ]
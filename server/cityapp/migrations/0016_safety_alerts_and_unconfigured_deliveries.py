@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0015_trackday_pack_on_compaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sosdispatch',
+            name='contact_numbers',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AlterField(
+            model_name='notificationdelivery',
+            name='status',
+            field=models.CharField(choices=[('sent', 'Sent'), ('failed', 'Failed'), ('unconfigured', 'Not Configured')], max_length=12),
+        ),
+        migrations.AlterField(
+            model_name='sosdispatch',
+            name='kind',
+            field=models.CharField(choices=[('alert', 'SOS Alert'), ('update', 'SOS Update'), ('digest', 'Area Digest'), ('safety', 'Safety Alert')], default='alert', max_length=10),
+        ),
+    ]
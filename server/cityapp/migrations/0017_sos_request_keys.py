@@ -0,0 +1,61 @@
+# Generated by Django 5.1.4 on 2026-10-18 23:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_idempotency_keys(apps, schema_editor):
+    SOSDispatch = apps.get_model('cityapp', 'SOSDispatch')
+    SOSRequestKey = apps.get_model('cityapp', 'SOSRequestKey')
+
+    SOSRequestKey.objects.bulk_create([
+        SOSRequestKey(username=username, key=key, dispatch_id=dispatch_id, created_at=created_at)
+        for dispatch_id, username, key, created_at in SOSDispatch.objects.exclude(idempotency_key='')
+        .values_list('id', 'username', 'idempotency_key', 'created_at')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cityapp', '0016_safety_alerts_and_unconfigured_deliveries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SOSRequestKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150)),
+                ('key', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'SOS Request Key',
+                'verbose_name_plural': 'SOS Request Keys',
+            },
+        ),
+        migrations.AddField(
+            model_name='sosrequestkey',
+            name='dispatch',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='request_keys', to='cityapp.sosdispatch'),
+        ),
+        migrations.AddConstraint(
+            model_name='sosrequestkey',
+            constraint=models.UniqueConstraint(fields=('username', 'key'), name='sosrequestkey_uniq'),
+        ),
+        migrations.RunPython(copy_idempotency_keys, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='sosdispatch',
+            name='sosdispatch_idempotency_uniq',
+        ),
+        migrations.RemoveField(
+            model_name='sosdispatch',
+            name='idempotency_key',
+        ),
+        migrations.AddConstraint(
+            model_name='sosdispatch',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'alert'), ('status__in', ['queued', 'sending'])), fields=('username',), name='sosdispatch_one_pending_alert'),
+        ),
+    ]
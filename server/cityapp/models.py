@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
 # Create your models here.
@@ -25,7 +26,7 @@ class UserProfile(models.Model):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='public')
     
     # Police-specific fields
-    police_id = models.CharField(max_length=50, blank=True, null=True, help_text="Police ID for police officers")
+    police_id = models.CharField(max_length=50, blank=True, null=True, db_index=True, help_text="Police ID for police officers")
     police_rank = models.CharField(max_length=100, blank=True, null=True, help_text="Police rank")
     
     # Profile information
@@ -82,6 +83,14 @@ class EmergencyContact(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Partial index: only active contacts are ever listed
+            models.Index(
+                fields=['user_profile', '-created_at'],
+                name='contact_profile_active_idx',
+                condition=models.Q(is_active=True),
+            ),
+        ]
         verbose_name = "Emergency Contact"
         verbose_name_plural = "Emergency Contacts"
     
@@ -98,10 +107,15 @@ class UserLocation(models.Model):
     address = models.CharField(max_length=500, blank=True, null=True)
     accuracy = models.FloatField(blank=True, null=True, help_text="Location accuracy in meters")
     
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Defaults to now, but batch ingest stores the client's fix time for offline-buffered fixes
+    timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # id breaks timestamp ties so keyset pages never need a sort
+            models.Index(fields=['user_profile', '-timestamp', '-id'], name='location_profile_ts_idx'),
+        ]
         verbose_name = "User Location"
         verbose_name_plural = "User Locations"
     
@@ -117,6 +131,8 @@ class UserActivity(models.Model):
         ('location_updated', 'Location Updated'),
         ('report_submitted', 'Report Submitted'),
         ('contact_added', 'Emergency Contact Added'),
+        ('contact_removed', 'Emergency Contact Removed'),
+        ('alert_received', 'Safety Alert Received'),
         ('profile_updated', 'Profile Updated'),
     ]
     
@@ -127,12 +143,281 @@ class UserActivity(models.Model):
     description = models.TextField(blank=True, null=True)
     metadata = models.JSONField(default=dict, blank=True, help_text="Additional activity data")
     
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the event happens, not when the batched insert runs
+    timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['user_profile', '-timestamp', '-id'], name='activity_profile_ts_idx'),
+            models.Index(fields=['user_profile', 'activity_type', '-timestamp', '-id'], name='activity_profile_type_ts_idx'),
+        ]
         verbose_name = "User Activity"
         verbose_name_plural = "User Activities"
     
     def __str__(self):
         return f"{self.user_profile.username} - {self.get_activity_type_display()}"
+
+class ActivityCounter(models.Model):
+    """Running count of one activity type for one user, maintained by cityapp/activity_log.py"""
+    user_profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='activity_counters')
+    activity_type = models.CharField(max_length=50, choices=UserActivity.ACTIVITY_TYPES)
+    count = models.PositiveIntegerField(default=0)
+    last_at = models.DateTimeField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_profile', 'activity_type'], name='activitycounter_profile_type_uniq'),
+        ]
+        verbose_name = "Activity Counter"
+        verbose_name_plural = "Activity Counters"
+    
+    def __str__(self):
+        return f"{self.user_profile.username} - {self.activity_type}: {self.count}"
+
+class ActivityRollup(models.Model):
+    """Activity counts per time bucket, type and optional geohash cell, maintained by cityapp/rollups.py"""
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hourly'),
+        ('day', 'Daily'),
+    ]
+    
+    granularity = models.CharField(max_length=5, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    activity_type = models.CharField(max_length=50, choices=UserActivity.ACTIVITY_TYPES)
+    # Geohash prefix of where the activity happened; '' is the total across all locations
+    cell = models.CharField(max_length=12, blank=True, default='')
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            # Doubles as the index for time-series reads: equality columns first, then the range
+            models.UniqueConstraint(
+                fields=['granularity', 'activity_type', 'cell', 'bucket_start'],
+                name='activityrollup_bucket_uniq',
+            ),
+        ]
+        verbose_name = "Activity Rollup"
+        verbose_name_plural = "Activity Rollups"
+    
+    def __str__(self):
+        return f"{self.activity_type} {self.granularity} {self.bucket_start:%Y-%m-%d %H:%M} {self.cell or '*'}: {self.count}"
+
+class Officer(models.Model):
+    """One entry of the police roster that registrations are validated against (see cityapp/roster.py)"""
+    # Unique, so roster lookups and import upserts are index seeks
+    police_id = models.CharField(max_length=50, unique=True)
+    name = models.CharField(max_length=200)
+    rank = models.CharField(max_length=100)
+    district = models.CharField(max_length=100, blank=True, default='')
+    
+    # Officers leaving the force are deactivated rather than deleted
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['police_id']
+        verbose_name = "Officer"
+        verbose_name_plural = "Officer Roster"
+    
+    def __str__(self):
+        return f"{self.police_id} - {self.rank} {self.name}"
+
+class OfficerRosterVersion(models.Model):
+    """Single-row counter bumped on every roster change; processes reload their cached roster when it moves"""
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Officer Roster Version"
+        verbose_name_plural = "Officer Roster Version"
+    
+    def __str__(self):
+        return f"Roster version {self.version}"
+
+class SOSDispatch(models.Model):
+    """An accepted SOS waiting for (or done with) delivery; the durable queue behind cityapp/sos_queue.py"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('delivered', 'Delivered'),
+        ('failed', 'Failed'),
+    ]
+    KIND_CHOICES = [
+        ('alert', 'SOS Alert'),
+        ('update', 'SOS Update'),
+        ('digest', 'Area Digest'),
+        # High-crime-area alert for the user's emergency contacts only
+        ('safety', 'Safety Alert'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user_profile = models.ForeignKey(
+        UserProfile, on_delete=models.SET_NULL, null=True, blank=True, related_name='sos_dispatches'
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='alert')
+    # For an update, the alert it updates; for an alert in digest mode, the digest that tells the police
+    parent = models.ForeignKey(
+        'self', on_delete=models.CASCADE, null=True, blank=True, related_name='children'
+    )
+    # Geohash cell of the location, used to spot many SOS from one area
+    area = models.CharField(max_length=12, blank=True, default='')
+    # Repeats folded into this alert inside the dedupe window
+    repeat_count = models.PositiveIntegerField(default=0)
+    last_repeat_at = models.DateTimeField(blank=True, null=True)
+    
+    # What the alert says, captured when the SOS was accepted
+    username = models.CharField(max_length=150)
+    phone = models.CharField(max_length=20)
+    location = models.CharField(max_length=500)
+    duration_minutes = models.PositiveIntegerField(default=0)
+    nearest_units = models.JSONField(default=list, blank=True)
+    # Numbers sent with a safety alert; only messaged when the user has no stored contacts
+    contact_numbers = models.JSONField(default=list, blank=True)
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # A worker owns a 'sending' row until this passes; after that another worker may retry it
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    delivered_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Workers claim the oldest due rows of a status
+            models.Index(fields=['status', 'next_attempt_at'], name='sosdispatch_due_idx'),
+            # Latest alert of a user (dedupe window) and recent alerts of an area (digest mode)
+            models.Index(fields=['username', 'kind', '-created_at'], name='sosdispatch_user_ts_idx'),
+            models.Index(fields=['area', 'kind', '-created_at'], name='sosdispatch_area_ts_idx'),
+        ]
+        constraints = [
+            # While a user's alert is undelivered, further SOS from any process fold into it
+            models.UniqueConstraint(
+                fields=['username'],
+                condition=models.Q(kind='alert', status__in=['queued', 'sending']),
+                name='sosdispatch_one_pending_alert',
+            ),
+        ]
+        verbose_name = "SOS Dispatch"
+        verbose_name_plural = "SOS Dispatches"
+    
+    def __str__(self):
+        return f"SOS {self.kind} from {self.username} ({self.status}, {self.attempts} attempts)"
+
+class SOSRequestKey(models.Model):
+    """Client-supplied idempotency key of one SOS request and the dispatch that answered it
+
+    Repeats folded into an existing alert have no row of their own, so keys live here;
+    a replayed key returns the same dispatch from any process.
+    """
+    username = models.CharField(max_length=150)
+    key = models.CharField(max_length=100)
+    dispatch = models.ForeignKey(SOSDispatch, on_delete=models.CASCADE, related_name='request_keys')
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['username', 'key'], name='sosrequestkey_uniq'),
+        ]
+        verbose_name = "SOS Request Key"
+        verbose_name_plural = "SOS Request Keys"
+    
+    def __str__(self):
+        return f"{self.username}:{self.key} -> {self.dispatch_id}"
+
+class NotificationDelivery(models.Model):
+    """Outcome of one message to one recipient through one transport (see cityapp/notifications.py)"""
+    KIND_CHOICES = [
+        ('sos', 'SOS Alert'),
+        ('alert', 'Safety Alert'),
+    ]
+    STATUS_CHOICES = [
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        # The transport has no endpoint configured; nothing was sent and nothing is retried
+        ('unconfigured', 'Not Configured'),
+    ]
+    
+    user_profile = models.ForeignKey(
+        UserProfile, on_delete=models.SET_NULL, null=True, blank=True, related_name='notification_deliveries'
+    )
+    sos_dispatch = models.ForeignKey(
+        SOSDispatch, on_delete=models.CASCADE, null=True, blank=True, related_name='deliveries'
+    )
+    contact = models.ForeignKey(
+        EmergencyContact, on_delete=models.SET_NULL, null=True, blank=True, related_name='deliveries'
+    )
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    transport = models.CharField(max_length=20)
+    # Phone number, chat id or URL the transport delivered to
+    recipient = models.CharField(max_length=200)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES)
+    error = models.TextField(blank=True, default='')
+    provider_message_id = models.CharField(max_length=100, blank=True, default='')
+    latency_ms = models.PositiveIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user_profile', '-created_at'], name='delivery_profile_ts_idx'),
+        ]
+        verbose_name = "Notification Delivery"
+        verbose_name_plural = "Notification Deliveries"
+    
+    def __str__(self):
+        return f"{self.kind} via {self.transport} to {self.recipient}: {self.status}"
+
+class CurrentPosition(models.Model):
+    """Latest known position per user, upserted on every location write"""
+    user_profile = models.OneToOneField(
+        UserProfile, on_delete=models.CASCADE, primary_key=True, related_name='current_position'
+    )
+    
+    latitude = models.DecimalField(max_digits=10, decimal_places=7)
+    longitude = models.DecimalField(max_digits=10, decimal_places=7)
+    address = models.CharField(max_length=500, blank=True, null=True)
+    accuracy = models.FloatField(blank=True, null=True, help_text="Location accuracy in meters")
+    
+    # Geohash of the position; "who is near here" is a few prefix range scans on this index
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True)
+    
+    # Time of the fix itself; indexed so "who is active now" is a range scan
+    timestamp = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Current Position"
+        verbose_name_plural = "Current Positions"
+    
+    def __str__(self):
+        return f"{self.user_profile.username} @ {self.latitude}, {self.longitude}"
+
+class TrackDay(models.Model):
+    """One user's fixes for one finished UTC day, packed into a single blob (see cityapp/tracks.py)"""
+    user_profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='track_days')
+    day = models.DateField()
+    
+    # Little-endian int32 quadruples, each a delta from the previous point:
+    # (latitude µdeg, longitude µdeg, seconds since midnight UTC, accuracy in decimetres or -1)
+    data = models.BinaryField(default=b'')
+    point_count = models.PositiveIntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['user_profile', 'day'], name='trackday_profile_day_uniq'),
+        ]
+        verbose_name = "Track Day"
+        verbose_name_plural = "Track Days"
+    
+    def __str__(self):
+        return f"{self.user_profile.username} - {self.day} ({self.point_count} points)"
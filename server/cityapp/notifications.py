@@ -0,0 +1,269 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from typing import Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import http_client, metrics
+from .models import EmergencyContact, NotificationDelivery
+from .upstream import get_service
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    # Transports every active emergency contact is messaged through. Contacts only have
+    # phone numbers; until the SMS gateway URL is set their deliveries are recorded as
+    # 'unconfigured', never as sent.
+    'CONTACT_TRANSPORTS': ['sms'],
+    # Transport for the police channel an SOS is posted to
+    'POLICE_TRANSPORT': 'telegram',
+    # Threads shared by all fan-outs; per-transport limits are MAX_CONCURRENCY below
+    'FANOUT_WORKERS': 32,
+    # Recipients whose send has not started this long into a fan-out are skipped and recorded
+    # as failed; sends already under way are waited for, each bounded by its transport's timeout
+    'FANOUT_TIMEOUT_SECONDS': 15,
+    'TRANSPORTS': {
+        # Pacing is done by cityapp/telegram_sender.py; these slots only bound waiting callers
+        'telegram': {'BACKEND': 'cityapp.notifications.TelegramNotifier', 'MAX_CONCURRENCY': 32,
+                     'MAX_QUEUE_SECONDS': 10},
+        'sms': {'BACKEND': 'cityapp.notifications.SMSGatewayNotifier', 'MAX_CONCURRENCY': 10,
+                'URL': '', 'API_KEY': '', 'SENDER': 'CitySafe'},
+        'webhook': {'BACKEND': 'cityapp.notifications.WebhookNotifier', 'MAX_CONCURRENCY': 10,
+                    'URL': '', 'SECRET': ''},
+        'local': {'BACKEND': 'cityapp.notifications.LocalNotifier', 'MAX_CONCURRENCY': 10},
+    },
+}
+
+
+def notifications_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'NOTIFICATIONS', {}))
+    transports = {name: dict(options) for name, options in DEFAULT_CONFIG['TRANSPORTS'].items()}
+    for name, options in getattr(settings, 'NOTIFICATIONS', {}).get('TRANSPORTS', {}).items():
+        transports.setdefault(name, {}).update(options)
+    config['TRANSPORTS'] = transports
+    return config
+
+
+class NotificationError(Exception):
+    """A transport could not deliver a message"""
+
+
+class NotifierNotConfigured(NotificationError):
+    """The transport has no endpoint configured, so nothing was sent"""
+
+
+class Recipient(NamedTuple):
+    transport: str
+    address: str
+    message: str
+    contact_id: Optional[str] = None
+
+
+class Notifier:
+    """One delivery transport; subclasses implement send()"""
+
+    def __init__(self, name, max_concurrency=4, **options):
+        self.name = name
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.options = options
+
+    def send(self, address, message, kind='') -> str:
+        """Deliver one message; return the provider's message id ('' if none) or raise NotificationError
+
+        ``kind`` is the NotificationDelivery kind ('sos' or 'alert'), for transports that prioritise.
+        """
+        raise NotImplementedError
+
+
+class TelegramNotifier(Notifier):
+    """Posts to a Telegram chat through the rate-limited sender; the address is a chat id
+
+    SOS messages jump the queue. Anything still queued after MAX_QUEUE_SECONDS is dropped
+    and reported as failed, so the caller's retry does not race a late send.
+    """
+
+    def send(self, address, message, kind=''):
+        from .telegram_sender import PRIORITY_INFO, PRIORITY_SOS, telegram_sender
+
+        max_wait = self.options.get('MAX_QUEUE_SECONDS', 10)
+        future = telegram_sender.send(address, message, PRIORITY_SOS if kind == 'sos' else PRIORITY_INFO, max_wait)
+        try:
+            # Once a request has started it is allowed to finish; allow for the Telegram timeout on top
+            return future.result(timeout=max_wait + get_service('telegram').timeout + 1)
+        except FutureTimeoutError:
+            raise NotificationError('Timed out waiting for Telegram')
+
+
+class SMSGatewayNotifier(Notifier):
+    """Sends SMS through an HTTP gateway taking {"to", "from", "message"} JSON"""
+
+    def send(self, address, message, kind=''):
+        url = self.options.get('URL')
+        if not url:
+            raise NotifierNotConfigured('SMS gateway URL is not configured')
+        headers = {'Authorization': f"Bearer {self.options['API_KEY']}"} if self.options.get('API_KEY') else {}
+        response = get_service('sms').call(lambda timeout: http_client.post(
+            url, json={'to': address, 'from': self.options.get('SENDER', ''), 'message': message},
+            headers=headers, timeout=timeout
+        ))
+        if response.status_code >= 300:
+            raise NotificationError(f'SMS gateway returned {response.status_code}: {response.text[:200]}')
+        try:
+            return str(response.json().get('id', ''))
+        except ValueError:
+            return ''
+
+
+class WebhookNotifier(Notifier):
+    """POSTs {"recipient", "message"} JSON to a configured URL, e.g. a paging or chat bridge"""
+
+    def send(self, address, message, kind=''):
+        url = self.options.get('URL')
+        if not url:
+            raise NotifierNotConfigured('Webhook URL is not configured')
+        headers = {'X-CitySafe-Secret': self.options['SECRET']} if self.options.get('SECRET') else {}
+        response = get_service('webhook').call(lambda timeout: http_client.post(
+            url, json={'recipient': address, 'message': message}, headers=headers, timeout=timeout
+        ))
+        if response.status_code >= 300:
+            raise NotificationError(f'Webhook returned {response.status_code}: {response.text[:200]}')
+        return ''
+
+
+class LocalNotifier(Notifier):
+    """Development/test transport: logs the message and keeps the latest ones in ``outbox``
+
+    Nothing leaves the process, so never list it in CONTACT_TRANSPORTS outside development.
+    """
+
+    def __init__(self, name, max_concurrency=10, **options):
+        super().__init__(name, max_concurrency, **options)
+        self.outbox = deque(maxlen=1000)
+        # Addresses that should fail, for exercising retries
+        self.failing = set()
+
+    def send(self, address, message, kind=''):
+        if address in self.failing:
+            raise NotificationError(f'{address} is unreachable')
+        self.outbox.append((address, message))
+        logger.warning('[%s] to %s: %s', self.name, address, message)
+        return ''
+
+
+class NotificationCenter:
+    """Sends messages to many recipients in parallel and records each outcome"""
+
+    def __init__(self, config):
+        self.config = config
+        self.notifiers: Dict[str, Notifier] = {}
+        for name, options in config['TRANSPORTS'].items():
+            options = dict(options)
+            backend = import_string(options.pop('BACKEND'))
+            self.notifiers[name] = backend(name, max_concurrency=options.pop('MAX_CONCURRENCY', 4), **options)
+        self._executor = ThreadPoolExecutor(max_workers=config['FANOUT_WORKERS'], thread_name_prefix='notify')
+        self._stats_lock = threading.Lock()
+        self.stats = {name: {'sent': 0, 'failed': 0, 'unconfigured': 0, 'in_flight': 0} for name in self.notifiers}
+        self._latency = {name: metrics.LatencyRecorder() for name in self.notifiers}
+
+    def contact_recipients(self, user_profile_id, message) -> List[Recipient]:
+        """One recipient per active contact and contact transport; a single query"""
+        contacts = (EmergencyContact.objects.filter(user_profile_id=user_profile_id, is_active=True)
+                    .values_list('id', 'phone'))
+        return [
+            Recipient(transport, phone, message, str(contact_id))
+            for contact_id, phone in contacts
+            for transport in self.config['CONTACT_TRANSPORTS']
+        ]
+
+    def police_recipient(self, message) -> Recipient:
+        from .telegram_service import TelegramService
+
+        return Recipient(self.config['POLICE_TRANSPORT'], TelegramService().chat_id, message)
+
+    def _send_one(self, recipient: Recipient, kind, expired: threading.Event):
+        notifier = self.notifiers.get(recipient.transport)
+        if notifier is None:
+            return recipient, 'failed', f'Unknown transport {recipient.transport}', '', 0
+        with notifier.slots:
+            if expired.is_set():
+                return recipient, 'failed', 'Timed out before sending', '', None
+            self._count(recipient.transport, 'in_flight', 1)
+            started = time.monotonic()
+            try:
+                message_id = notifier.send(recipient.address, recipient.message, kind)
+                status, error = 'sent', ''
+            except NotifierNotConfigured as e:
+                message_id, status, error = '', 'unconfigured', str(e)
+            except Exception as e:
+                message_id, status, error = '', 'failed', str(e)[:2000]
+            finally:
+                elapsed = time.monotonic() - started
+                self._count(recipient.transport, 'in_flight', -1)
+        self._count(recipient.transport, status, 1)
+        self._latency[recipient.transport].record(elapsed)
+        return recipient, status, error, message_id or '', round(elapsed * 1000)
+
+    def _count(self, transport, key, n):
+        with self._stats_lock:
+            self.stats[transport][key] += n
+
+    def fan_out(self, recipients, kind, user_profile_id=None, sos_dispatch=None) -> List[NotificationDelivery]:
+        """Send to every recipient concurrently and bulk-insert one NotificationDelivery per recipient
+
+        Sends that have not started by FANOUT_TIMEOUT_SECONDS are skipped and recorded as
+        failed. Sends already under way are waited for, so a delivery is never recorded as
+        failed (and retried) while its message may still go out.
+        """
+        if not recipients:
+            return []
+        expired = threading.Event()
+        futures = [self._executor.submit(self._send_one, recipient, kind, expired) for recipient in recipients]
+        _, pending = wait(futures, timeout=self.config['FANOUT_TIMEOUT_SECONDS'])
+        if pending:
+            expired.set()
+            for future in pending:
+                future.cancel()
+            wait(pending)
+        outcomes = [
+            (recipient, 'failed', 'Timed out before sending', '', None) if future.cancelled() else future.result()
+            for recipient, future in zip(recipients, futures)
+        ]
+
+        now = timezone.now()
+        deliveries = [
+            NotificationDelivery(
+                user_profile_id=user_profile_id,
+                sos_dispatch=sos_dispatch,
+                contact_id=recipient.contact_id,
+                kind=kind,
+                transport=recipient.transport,
+                recipient=recipient.address,
+                status=status,
+                error=error,
+                provider_message_id=message_id,
+                latency_ms=latency_ms,
+                created_at=now,
+            )
+            for recipient, status, error, message_id, latency_ms in outcomes
+        ]
+        NotificationDelivery.objects.bulk_create(deliveries)
+        return deliveries
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = {name: dict(values) for name, values in self.stats.items()}
+        for name, values in stats.items():
+            values['max_concurrency'] = self.notifiers[name].max_concurrency
+            values['latency'] = self._latency[name].snapshot()
+        return stats
+
+
+notification_center = NotificationCenter(notifications_config())
+metrics.register('notifications', notification_center.snapshot)
@@ -0,0 +1,178 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .activity_log import log_activity, save_activities
+from .dispatch import officer_index
+from .models import EmergencyContact, UserActivity, UserLocation, UserProfile
+from .positions import upsert_current_positions
+from .profiles import profile_cache
+from .roster import officer_roster
+from .trajectory import trajectory_filter, is_enabled as trajectory_filter_enabled
+
+# Most emergency contacts one request may create or update
+MAX_EMERGENCY_CONTACTS = 20
+
+ONBOARDING_ROLES = ('public', 'police')
+
+# Used when the sign-up form leaves the relationship empty
+DEFAULT_RELATIONSHIP = 'Emergency Contact'
+
+
+class RegistrationConflict(ValueError):
+    """The username or police ID is already taken"""
+
+
+def parse_contacts(items):
+    """Validated [{'name', 'phone', 'relationship'}] from request data; raises ValueError"""
+    if not isinstance(items, list):
+        raise ValueError('emergency_contacts must be a list')
+    if len(items) > MAX_EMERGENCY_CONTACTS:
+        raise ValueError(f'At most {MAX_EMERGENCY_CONTACTS} emergency contacts are allowed')
+    contacts = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f'Emergency contact {index} must be an object')
+        contact = {key: str(item.get(key) or '').strip() for key in ('name', 'phone', 'relationship')}
+        if not contact['name'] or not contact['phone']:
+            raise ValueError(f'Emergency contact {index} needs a name and phone')
+        contact['relationship'] = contact['relationship'] or DEFAULT_RELATIONSHIP
+        contacts.append(contact)
+    return contacts
+
+
+def registration_conflict(username, police_id=None):
+    """Message for the first clash with an existing account, or None; a single query"""
+    clashes = Q(username=username) | Q(profile__username=username)
+    if police_id:
+        clashes |= Q(profile__police_id=police_id)
+    for existing_username, profile_username, existing_police_id in (
+            User.objects.filter(clashes).values_list('username', 'profile__username', 'profile__police_id')[:2]):
+        if username in (existing_username, profile_username):
+            return 'Username already exists'
+        if police_id and existing_police_id == police_id:
+            return 'Police ID already registered'
+    return None
+
+
+def upsert_contacts(user_profile, contacts, replace=False):
+    """Create or update a user's active contacts, matched by phone number
+
+    Returns (contacts, created, updated, removed). ``replace`` deactivates active
+    contacts that are not in the list.
+    """
+    existing = {contact.phone: contact for contact in user_profile.emergency_contacts.filter(is_active=True)}
+    by_phone = {contact['phone']: contact for contact in contacts}
+    created, updated = [], []
+    for phone, contact in by_phone.items():
+        current = existing.get(phone)
+        if current is None:
+            created.append(EmergencyContact(user_profile=user_profile, **contact))
+        elif (current.name, current.relationship) != (contact['name'], contact['relationship']):
+            current.name = contact['name']
+            current.relationship = contact['relationship']
+            current.updated_at = timezone.now()
+            updated.append(current)
+
+    removed = 0
+    with transaction.atomic():
+        EmergencyContact.objects.bulk_create(created)
+        EmergencyContact.objects.bulk_update(updated, ['name', 'relationship', 'updated_at'])
+        if replace:
+            removed = (user_profile.emergency_contacts.filter(is_active=True)
+                       .exclude(phone__in=by_phone.keys()).update(is_active=False))
+    if created or updated or removed:
+        profile_cache.invalidate([user_profile.id])
+
+    saved = {contact.phone: contact for contact in [*existing.values(), *created]}
+    return [saved[phone] for phone in by_phone], created, updated, removed
+
+
+def onboard_user(username, password, email='', phone='', role='public', police_id='', contacts=(), location=None):
+    """Create the user, profile, emergency contacts and initial location together
+
+    Returns (user_profile, contacts, location). Raises ValueError for invalid input
+    and RegistrationConflict when the username or police ID is taken.
+    """
+    if role not in ONBOARDING_ROLES:
+        raise ValueError(f'role must be one of {", ".join(ONBOARDING_ROLES)}')
+    officer = None
+    if role == 'police':
+        if not police_id:
+            raise ValueError('Police ID is required for police registration')
+        officer = officer_roster.lookup(police_id)
+        if officer is None:
+            raise ValueError('Invalid Police ID. Contact your department.')
+    else:
+        police_id = None
+
+    conflict = registration_conflict(username, police_id)
+    if conflict:
+        raise RegistrationConflict(conflict)
+
+    # Hash before taking the write lock; it is by far the slowest step
+    password_hash = make_password(password)
+
+    try:
+        with transaction.atomic():
+            user = User(username=username, email=email, password=password_hash)
+            user.save()
+            user_profile = UserProfile.objects.create(
+                user=user,
+                username=username,
+                email=email,
+                phone=phone,
+                role=role,
+                police_id=police_id,
+                police_rank=officer['rank'] if officer else None,
+            )
+            saved_contacts = EmergencyContact.objects.bulk_create([
+                EmergencyContact(user_profile=user_profile, **contact) for contact in contacts
+            ])
+            initial_location = None
+            if location:
+                # Written here rather than through write-behind, so the account never exists without it
+                initial_location = UserLocation.objects.create(
+                    user_profile=user_profile,
+                    latitude=location['latitude'],
+                    longitude=location['longitude'],
+                    address=location.get('address', ''),
+                    accuracy=location.get('accuracy'),
+                )
+                upsert_current_positions([initial_location])
+                activity = UserActivity(
+                    user_profile=user_profile,
+                    activity_type='location_updated',
+                    description='Location updated',
+                    metadata={'latitude': float(initial_location.latitude),
+                              'longitude': float(initial_location.longitude)}
+                )
+                save_activities([activity])
+    except IntegrityError:
+        # Lost a race with a concurrent registration of the same username
+        raise RegistrationConflict('Username already exists')
+
+    # Queued writes run on other connections, so they only start once the rows above are committed
+    log_activity(
+        user_profile, 'login',
+        description='User registered successfully',
+        metadata={'role': role, 'police_id': police_id, 'onboarding': True}
+    )
+    if saved_contacts:
+        log_activity(
+            user_profile, 'contact_added',
+            description=f'{len(saved_contacts)} emergency contacts added',
+            metadata={'contact_ids': [str(contact.id) for contact in saved_contacts]}
+        )
+
+    if initial_location is not None:
+        latitude, longitude = location['latitude'], location['longitude']
+        if trajectory_filter_enabled():
+            # Seeds the filter; the first fix of a user is always kept
+            trajectory_filter.should_store(user_profile.id, role, latitude, longitude,
+                                           initial_location.timestamp.timestamp(), initial_location.accuracy)
+        officer_index.update_from_profile(user_profile, latitude, longitude)
+
+    return user_profile, saved_contacts, initial_location
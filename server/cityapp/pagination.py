@@ -0,0 +1,58 @@
+import base64
+import json
+import uuid
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, pk) -> str:
+    """Opaque cursor pointing just past the given (timestamp, id) row"""
+    raw = json.dumps([timestamp.isoformat(), str(pk)], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, pk = json.loads(raw)
+        parsed = parse_datetime(timestamp)
+        if parsed is None:
+            raise ValueError(timestamp)
+        return parsed, uuid.UUID(pk)
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE):
+    if value in (None, ''):
+        return default
+    return min(max(int(value), 1), MAX_PAGE_SIZE)
+
+
+def keyset_page(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """One newest-first page of a queryset ordered by (timestamp, id)
+
+    The ``timestamp <= cursor`` bound turns into an index range, so every page
+    costs the same no matter how deep it is; the OR only breaks ties on the
+    cursor's own timestamp. Returns (rows, next_cursor or None).
+    """
+    queryset = queryset.order_by('-timestamp', '-id')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(timestamp__lte=timestamp).filter(
+            Q(timestamp__lt=timestamp) | Q(id__lt=pk)
+        )
+
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(rows[-1].timestamp, rows[-1].id)
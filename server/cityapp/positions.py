@@ -0,0 +1,129 @@
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .geo import bbox_around, calculate_distance, geohash_cover, geohash_encode
+from .models import CurrentPosition
+
+# Users whose latest fix is older than this are not considered active
+DEFAULT_ACTIVE_MINUTES = 15
+
+
+def upsert_current_positions(locations):
+    """Upsert the newest of the given UserLocation objects into CurrentPosition, one row per user
+
+    Fixes older than the stored position (e.g. offline-buffered uploads) never move it backwards.
+    """
+    newest = {}
+    for location in locations:
+        current = newest.get(location.user_profile_id)
+        if current is None or location.timestamp >= current.timestamp:
+            newest[location.user_profile_id] = location
+    if not newest:
+        return 0
+
+    stored = dict(CurrentPosition.objects
+                  .filter(user_profile_id__in=newest.keys())
+                  .values_list('user_profile_id', 'timestamp'))
+    positions = [
+        CurrentPosition(
+            user_profile_id=user_profile_id,
+            latitude=location.latitude,
+            longitude=location.longitude,
+            address=location.address,
+            accuracy=location.accuracy,
+            geohash=geohash_encode(float(location.latitude), float(location.longitude)),
+            timestamp=location.timestamp,
+        )
+        for user_profile_id, location in newest.items()
+        if user_profile_id not in stored or location.timestamp >= stored[user_profile_id]
+    ]
+    from .profiles import profile_cache
+
+    profile_cache.invalidate([position.user_profile_id for position in positions])
+    CurrentPosition.objects.bulk_create(
+        positions,
+        update_conflicts=True,
+        unique_fields=['user_profile'],
+        update_fields=['latitude', 'longitude', 'address', 'accuracy', 'geohash', 'timestamp', 'updated_at'],
+    )
+    return len(positions)
+
+
+def latest_positions(role=None, active_minutes=DEFAULT_ACTIVE_MINUTES):
+    """Current positions of every user active within the window, as one indexed range scan"""
+    queryset = (CurrentPosition.objects
+                .filter(timestamp__gte=timezone.now() - timedelta(minutes=active_minutes))
+                .select_related('user_profile')
+                .order_by('-timestamp'))
+    if role:
+        queryset = queryset.filter(user_profile__role=role)
+    return queryset
+
+
+def _geohash_ranges(prefixes):
+    """One index range per prefix: every hash starting with it sorts in [prefix, prefix + '{')"""
+    condition = Q()
+    for prefix in prefixes:
+        # '{' sorts right after 'z', the last geohash character
+        condition |= Q(geohash__gte=prefix, geohash__lt=prefix + '{')
+    return condition
+
+
+def nearby_positions(lat=None, lng=None, radius_km=None, bbox=None, role=None,
+                     active_minutes=DEFAULT_ACTIVE_MINUTES):
+    """Users whose current position lies within radius_km of (lat, lng), or inside bbox
+
+    Candidates come from geohash prefix range scans covering the search box; the
+    exact distance filter runs in Python. Returns dicts sorted by distance (or by
+    recency for a bare bbox), with ``distance_km`` set when a centre is given.
+    """
+    if bbox is None:
+        bbox = bbox_around(lat, lng, radius_km)
+    min_lat, min_lng, max_lat, max_lng = bbox
+
+    queryset = (CurrentPosition.objects
+                .filter(_geohash_ranges(geohash_cover(*bbox)))
+                .filter(timestamp__gte=timezone.now() - timedelta(minutes=active_minutes)))
+    if role:
+        queryset = queryset.filter(user_profile__role=role)
+    rows = queryset.order_by('-timestamp').values(
+        'user_profile_id', 'user_profile__username', 'user_profile__role', 'user_profile__police_id',
+        'latitude', 'longitude', 'accuracy', 'timestamp',
+    )
+
+    matches = []
+    for row in rows:
+        row_lat, row_lng = float(row['latitude']), float(row['longitude'])
+        if not (min_lat <= row_lat <= max_lat and min_lng <= row_lng <= max_lng):
+            continue
+        distance = None
+        if lat is not None and lng is not None:
+            distance = calculate_distance(lat, lng, row_lat, row_lng)
+            if radius_km is not None and distance > radius_km:
+                continue
+        matches.append({
+            'user_id': str(row['user_profile_id']),
+            'username': row['user_profile__username'],
+            'role': row['user_profile__role'],
+            'police_id': row['user_profile__police_id'],
+            'latitude': row_lat,
+            'longitude': row_lng,
+            'accuracy': row['accuracy'],
+            'timestamp': row['timestamp'].isoformat(),
+            'distance_km': round(distance, 3) if distance is not None else None,
+        })
+    if lat is not None and lng is not None:
+        matches.sort(key=lambda match: match['distance_km'])
+    return matches
+
+
+def serialize_position(position):
+    return {
+        'latitude': float(position.latitude),
+        'longitude': float(position.longitude),
+        'address': position.address,
+        'accuracy': position.accuracy,
+        'timestamp': position.timestamp.isoformat()
+    }
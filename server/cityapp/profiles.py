@@ -0,0 +1,270 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch, Q
+
+from . import metrics
+from .models import CurrentPosition, EmergencyContact, UserProfile
+from .positions import serialize_position
+
+# Safety net only: every write that changes a payload invalidates it explicitly
+DEFAULT_PROFILE_CACHE_TIMEOUT = 300
+
+# How long an invalidated payload stays blocked, so a read that loaded the old row
+# before the write committed cannot put it back
+DEFAULT_PROFILE_CACHE_TOMBSTONE_TIMEOUT = 30
+
+# Stored in place of an invalidated payload; reads treat it as a miss
+_INVALIDATED = 'invalidated'
+
+_PAYLOAD_KEY = 'profile:v1:{}'
+_USERNAME_KEY = 'profile-username:v1:{}'
+
+
+# Payload sections that need their own prefetch query; skipped when not selected
+PREFETCHED_FIELDS = {
+    'emergency_contacts': Prefetch('emergency_contacts',
+                                   queryset=EmergencyContact.objects.filter(is_active=True),
+                                   to_attr='active_contacts'),
+    'activity_counts': 'activity_counters',
+}
+
+PROFILE_FIELDS = (
+    'id', 'username', 'email', 'phone', 'role', 'police_id', 'police_rank', 'avatar', 'bio',
+    'created_at', 'last_active', 'reports_submitted', 'alerts_received', 'safety_score',
+    'activity_counts', 'preferences', 'emergency_contacts', 'latest_location',
+)
+
+# Short names list views may ask for
+PROFILE_FIELD_ALIASES = {
+    'name': 'username',
+    'position': 'latest_location',
+}
+
+
+def parse_fields(value):
+    """Field selection from a list or comma-separated string; None/empty selects everything"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    fields = set()
+    for name in value:
+        name = PROFILE_FIELD_ALIASES.get(str(name).strip(), str(name).strip())
+        if name not in PROFILE_FIELDS:
+            raise ValueError(f'Unknown profile field: {name}')
+        fields.add(name)
+    return frozenset(fields)
+
+
+def profile_queryset(fields=None):
+    """Profiles with everything the (selected) payload needs: one joined query plus a prefetch per section"""
+    prefetches = [lookup for field, lookup in PREFETCHED_FIELDS.items() if fields is None or field in fields]
+    return UserProfile.objects.select_related('current_position').prefetch_related(*prefetches)
+
+
+def serialize_contact(contact):
+    return {
+        'id': str(contact.id),
+        'name': contact.name,
+        'phone': contact.phone,
+        'relationship': contact.relationship,
+        'added_date': contact.created_at.isoformat()
+    }
+
+
+def serialize_profile(user_profile, fields=None):
+    """Profile payload for a profile loaded through profile_queryset(fields)
+
+    ``fields`` limits the payload to those keys (plus ``id``); None means everything.
+    """
+    latest_location = None
+    try:
+        latest_location = serialize_position(user_profile.current_position)
+    except CurrentPosition.DoesNotExist:
+        pass
+
+    payload = {
+        'id': str(user_profile.id),
+        'username': user_profile.username,
+        'email': user_profile.email,
+        'phone': user_profile.phone,
+        'role': user_profile.role,
+        'police_id': user_profile.police_id,
+        'police_rank': user_profile.police_rank,
+        'avatar': user_profile.avatar,
+        'bio': user_profile.bio,
+        'created_at': user_profile.created_at.isoformat(),
+        'last_active': user_profile.last_active.isoformat(),
+        'reports_submitted': user_profile.reports_submitted,
+        'alerts_received': user_profile.alerts_received,
+        'safety_score': user_profile.safety_score,
+        'preferences': {
+            'notifications_enabled': user_profile.notifications_enabled,
+            'location_tracking_enabled': user_profile.location_tracking_enabled,
+            'emergency_alerts_enabled': user_profile.emergency_alerts_enabled
+        },
+        'latest_location': latest_location
+    }
+    if fields is None or 'activity_counts' in fields:
+        payload['activity_counts'] = {
+            counter.activity_type: counter.count for counter in user_profile.activity_counters.all()
+        }
+    if fields is None or 'emergency_contacts' in fields:
+        payload['emergency_contacts'] = [serialize_contact(contact) for contact in user_profile.active_contacts]
+    return select_fields(payload, fields)
+
+
+def select_fields(payload, fields):
+    if fields is None:
+        return payload
+    return {key: payload[key] for key in PROFILE_FIELDS if key == 'id' or key in fields}
+
+
+class ProfileCache:
+    """Per-user cache of serialized profile payloads with hit/miss accounting"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        self._hit_latency = metrics.LatencyRecorder()
+        self._miss_latency = metrics.LatencyRecorder()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    @staticmethod
+    def _timeout():
+        return getattr(settings, 'PROFILE_CACHE_TIMEOUT', DEFAULT_PROFILE_CACHE_TIMEOUT)
+
+    def get(self, username=None, user_id=None):
+        """Profile payload by username or id, or None when no such user exists"""
+        started = time.monotonic()
+        if user_id is not None:
+            try:
+                user_id = str(uuid.UUID(str(user_id)))
+            except ValueError:
+                return None
+        else:
+            user_id = cache.get(_USERNAME_KEY.format(username))
+        payload = cache.get(_PAYLOAD_KEY.format(user_id)) if user_id is not None else None
+        if isinstance(payload, dict):
+            self._count('hits')
+            self._hit_latency.record(time.monotonic() - started)
+            return payload
+
+        self._count('misses')
+        queryset = profile_queryset()
+        try:
+            user_profile = queryset.get(id=user_id) if user_id is not None else queryset.get(username=username)
+        except UserProfile.DoesNotExist:
+            return None
+        payload = serialize_profile(user_profile)
+        self.store([payload])
+        self._miss_latency.record(time.monotonic() - started)
+        return payload
+
+    def get_many(self, user_ids=(), usernames=(), fields=None):
+        """Payloads for many users with a fixed number of cache round trips and queries
+
+        Returns (payloads, not_found) with payloads in request order. Cached full
+        payloads are trimmed to ``fields``; misses are loaded in one query (plus a
+        prefetch per selected section) and only cached when fully serialized.
+        """
+        started = time.monotonic()
+        requested = []
+        for user_id in user_ids:
+            try:
+                requested.append(('id', str(uuid.UUID(str(user_id)))))
+            except ValueError:
+                requested.append(('invalid', str(user_id)))
+        requested.extend(('username', username) for username in usernames)
+
+        aliases = cache.get_many([_USERNAME_KEY.format(value) for kind, value in requested if kind == 'username'])
+        resolved = {}
+        for kind, value in requested:
+            if kind == 'id':
+                resolved[(kind, value)] = value
+            elif kind == 'username':
+                resolved[(kind, value)] = aliases.get(_USERNAME_KEY.format(value))
+
+        wanted_ids = {user_id for user_id in resolved.values() if user_id is not None}
+        cached = cache.get_many([_PAYLOAD_KEY.format(user_id) for user_id in wanted_ids])
+        by_id = {payload['id']: payload for payload in cached.values() if isinstance(payload, dict)}
+        hits = len(by_id)
+
+        missing_ids = wanted_ids - by_id.keys()
+        missing_usernames = [value for (kind, value), user_id in resolved.items()
+                             if kind == 'username' and user_id is None]
+        if missing_ids or missing_usernames:
+            # username is always loaded so username lookups resolve even when it is not selected
+            load_fields = None if fields is None else set(fields) | {'username'}
+            queryset = profile_queryset(load_fields).filter(Q(id__in=missing_ids) | Q(username__in=missing_usernames))
+            loaded = [serialize_profile(user_profile, load_fields) for user_profile in queryset]
+            if fields is None:
+                self.store(loaded)
+            by_id.update((payload['id'], payload) for payload in loaded)
+        by_username = {payload['username']: payload for payload in by_id.values()}
+        self._count('hits', hits)
+        self._count('misses', len(requested) - hits)
+
+        payloads, not_found, seen = [], [], set()
+        for kind, value in requested:
+            payload = None
+            if kind == 'id':
+                payload = by_id.get(value)
+            elif kind == 'username':
+                payload = by_username.get(value)
+            if payload is None:
+                not_found.append(value)
+            elif payload['id'] not in seen:
+                seen.add(payload['id'])
+                payloads.append(select_fields(payload, fields))
+        self._miss_latency.record(time.monotonic() - started)
+        return payloads, not_found
+
+    def store(self, payloads):
+        """Cache freshly loaded payloads unless an invalidation got there first
+
+        ``cache.add`` never replaces a tombstone, so a payload read before a
+        concurrent write committed is dropped instead of being cached as current.
+        """
+        aliases = {}
+        for payload in payloads:
+            cache.add(_PAYLOAD_KEY.format(payload['id']), payload, self._timeout())
+            # Usernames never change, so the alias outlives any payload version
+            aliases[_USERNAME_KEY.format(payload['username'])] = payload['id']
+        cache.set_many(aliases, self._timeout())
+
+    def invalidate(self, user_ids):
+        """Replace cached payloads with tombstones once the surrounding transaction (if any) commits"""
+        keys = [_PAYLOAD_KEY.format(user_id) for user_id in user_ids]
+        if not keys:
+            return
+
+        def drop():
+            timeout = getattr(settings, 'PROFILE_CACHE_TOMBSTONE_TIMEOUT', DEFAULT_PROFILE_CACHE_TOMBSTONE_TIMEOUT)
+            cache.set_many(dict.fromkeys(keys, _INVALIDATED), timeout)
+            self._count('invalidations', len(keys))
+
+        transaction.on_commit(drop)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        return {
+            **stats,
+            'hit_rate': round(stats['hits'] / lookups, 3) if lookups else None,
+            'hit_latency': self._hit_latency.snapshot(),
+            'miss_latency': self._miss_latency.snapshot(),
+        }
+
+
+profile_cache = ProfileCache()
+metrics.register('profile_cache', profile_cache.snapshot)
@@ -0,0 +1,97 @@
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import connection
+
+from .geo import geohash_encode, parse_lat_lng
+from .models import ActivityRollup
+
+# Geohash length of rollup cells (~5 km x 5 km, roughly a city district)
+ROLLUP_CELL_PRECISION = 5
+
+BUCKET_SIZES = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+
+
+def bucket_start(timestamp, granularity):
+    utc = timestamp.astimezone(dt_timezone.utc)
+    if granularity == 'hour':
+        return utc.replace(minute=0, second=0, microsecond=0)
+    return utc.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def activity_cell(activity):
+    """Geohash cell of an activity's location, or '' when it has none"""
+    metadata = activity.metadata or {}
+    try:
+        if metadata.get('latitude') is not None and metadata.get('longitude') is not None:
+            point = (float(metadata['latitude']), float(metadata['longitude']))
+        else:
+            point = parse_lat_lng(metadata.get('location'))
+    except (TypeError, ValueError):
+        return ''
+    return geohash_encode(point[0], point[1], ROLLUP_CELL_PRECISION) if point else ''
+
+
+def rollup_counts(activities) -> Counter:
+    """Count activities into (granularity, bucket_start, activity_type, cell) keys"""
+    counts = Counter()
+    for activity in activities:
+        cell = activity_cell(activity)
+        for granularity in BUCKET_SIZES:
+            key = (granularity, bucket_start(activity.timestamp, granularity), activity.activity_type)
+            counts[key + ('',)] += 1
+            if cell:
+                counts[key + (cell,)] += 1
+    return counts
+
+
+def increment_rollups(counts: Counter):
+    """Add counts to their rollup rows with one upsert; the increment happens in SQL"""
+    if not counts:
+        return
+    table = connection.ops.quote_name(ActivityRollup._meta.db_table)
+    sql = (
+        f'INSERT INTO {table} (granularity, bucket_start, activity_type, cell, count) VALUES (%s, %s, %s, %s, %s) '
+        f'ON CONFLICT (granularity, activity_type, cell, bucket_start) DO UPDATE SET '
+        f'count = {table}.count + excluded.count'
+    )
+    bucket_field = ActivityRollup._meta.get_field('bucket_start')
+    params = [
+        (granularity, bucket_field.get_db_prep_value(start, connection), activity_type, cell, count)
+        for (granularity, start, activity_type, cell), count in counts.items()
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def activity_series(activity_type, granularity, start, end, cell=''):
+    """Zero-filled [(bucket_start, count)] for one activity type and cell over [start, end)"""
+    step = BUCKET_SIZES[granularity]
+    start = bucket_start(start, granularity)
+    counts = dict(ActivityRollup.objects
+                  .filter(granularity=granularity, activity_type=activity_type, cell=cell,
+                          bucket_start__gte=start, bucket_start__lt=end)
+                  .values_list('bucket_start', 'count'))
+    series = []
+    current = start
+    while current < end:
+        series.append((current, counts.get(current, 0)))
+        current += step
+    return series
+
+
+def activity_by_cell(activity_type, granularity, start, end, cell_prefix=''):
+    """{cell: total} for one activity type over [start, end), optionally within a geohash prefix"""
+    queryset = (ActivityRollup.objects
+                .filter(granularity=granularity, activity_type=activity_type,
+                        bucket_start__gte=bucket_start(start, granularity), bucket_start__lt=end)
+                .exclude(cell=''))
+    if cell_prefix:
+        queryset = queryset.filter(cell__gte=cell_prefix, cell__lt=cell_prefix + '{')
+    totals = Counter()
+    for cell, count in queryset.values_list('cell', 'count'):
+        totals[cell] += count
+    return dict(totals)
@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db.models import F
+
+from . import metrics
+from .models import Officer, OfficerRosterVersion
+
+# Seconds between version checks; a roster import shows up in every process within this long
+DEFAULT_VERSION_CHECK_SECONDS = 30
+
+_VERSION_ROW_ID = 1
+
+
+def roster_version() -> int:
+    return OfficerRosterVersion.objects.filter(id=_VERSION_ROW_ID).values_list('version', flat=True).first() or 0
+
+
+def bump_roster_version():
+    """Record a roster change; call after any write to Officer rows"""
+    if not OfficerRosterVersion.objects.filter(id=_VERSION_ROW_ID).update(version=F('version') + 1):
+        OfficerRosterVersion.objects.get_or_create(id=_VERSION_ROW_ID, defaults={'version': 1})
+    officer_roster.invalidate()
+
+
+class OfficerRosterCache:
+    """In-process copy of the active roster keyed by police ID
+
+    Lookups are dict reads. At most once per check interval a lookup reads the
+    roster version row (one primary-key query) and reloads the whole roster only
+    when the version has moved.
+    """
+
+    def __init__(self, check_seconds=None):
+        self._check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._officers: Dict[str, dict] = {}
+        self._version = None
+        self._checked_at = None
+        self.stats = {'lookups': 0, 'version_checks': 0, 'reloads': 0}
+        self._reload_latency = metrics.LatencyRecorder()
+
+    def _interval(self):
+        if self._check_seconds is not None:
+            return self._check_seconds
+        return getattr(settings, 'OFFICER_ROSTER_VERSION_CHECK_SECONDS', DEFAULT_VERSION_CHECK_SECONDS)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self._interval():
+            return
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self._interval():
+                return
+            self.stats['version_checks'] += 1
+            version = roster_version()
+            if version != self._version:
+                started = time.monotonic()
+                self._officers = {
+                    police_id: {'name': name, 'rank': rank, 'district': district}
+                    for police_id, name, rank, district in Officer.objects.filter(is_active=True)
+                    .values_list('police_id', 'name', 'rank', 'district').iterator(chunk_size=5000)
+                }
+                self._version = version
+                self.stats['reloads'] += 1
+                self._reload_latency.record(time.monotonic() - started)
+            self._checked_at = time.monotonic()
+
+    def lookup(self, police_id) -> Optional[dict]:
+        """Roster entry (name, rank, district) for an active officer, or None"""
+        self._refresh()
+        self.stats['lookups'] += 1
+        if not police_id:
+            return None
+        return self._officers.get(str(police_id).strip())
+
+    def invalidate(self):
+        """Force a version check on the next lookup"""
+        with self._lock:
+            self._checked_at = None
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            'version': self._version,
+            'officers': len(self._officers),
+            'reload_latency': self._reload_latency.snapshot(),
+        }
+
+
+officer_roster = OfficerRosterCache()
+metrics.register('officer_roster', officer_roster.snapshot)
@@ -0,0 +1,214 @@
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from geopy.geocoders import Nominatim
+
+from . import http_client
+from .upstream import get_service, submit_with_context
+
+# Upper bound on pairs accepted in one batch request
+MAX_BATCH_PAIRS = 200
+
+# Worker threads shared by geocode and route lookups within one batch
+BATCH_MAX_WORKERS = 8
+
+# Nominatim's usage policy is strict, so geocodes get a smaller slice of the pool
+GEOCODE_MAX_CONCURRENCY = 2
+
+# Successful geocodes kept in memory, most recently used last
+GEOCODE_CACHE_SIZE = 2048
+
+# Initialize geocoder
+geolocator = Nominatim(user_agent="citysafe_route_app", adapter_factory=http_client.geocoder_adapter_factory())
+
+_geocode_cache = OrderedDict()
+_geocode_cache_lock = threading.Lock()
+
+
+def straight_line_route(start_lat, start_lon, end_lat, end_lon):
+    """Degraded route used when OSRM is unavailable: a direct [lon, lat] segment"""
+    return [[start_lon, start_lat], [end_lon, end_lat]]
+
+
+def get_route_coords(start_lat, start_lon, end_lat, end_lon):
+    """Get route coordinates from OSRM, falling back to a straight line when it is unavailable"""
+    url = f"http://router.project-osrm.org/route/v1/driving/{start_lon},{start_lat};{end_lon},{end_lat}?overview=full&geometries=geojson"
+
+    def fetch(timeout):
+        response = http_client.get(url, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+
+        if data.get('routes') and len(data['routes']) > 0:
+            return data['routes'][0]['geometry']['coordinates']
+        else:
+            return None
+
+    return get_service('osrm').call(
+        fetch,
+        fallback=lambda: straight_line_route(start_lat, start_lon, end_lat, end_lon)
+    )
+
+
+def geocode_place(place):
+    """Geocode a place name to (lat, lon) through Nominatim, served from cache when possible"""
+    key = ' '.join(place.split()).lower()
+    with _geocode_cache_lock:
+        cached = _geocode_cache.get(key)
+        if cached is not None:
+            _geocode_cache.move_to_end(key)
+            return cached
+
+    def fetch(timeout):
+        location = geolocator.geocode(place, timeout=timeout)
+        if not location:
+            return None
+        return (location.latitude, location.longitude)
+
+    result = get_service('nominatim').call(fetch, fallback=lambda: None)
+    if result is not None:
+        with _geocode_cache_lock:
+            _geocode_cache[key] = result
+            if len(_geocode_cache) > GEOCODE_CACHE_SIZE:
+                _geocode_cache.popitem(last=False)
+    return result
+
+
+def parse_endpoint(value):
+    """Normalise a batch endpoint into ('coords', (lat, lon)) or ('place', name)"""
+    if isinstance(value, dict):
+        lat = value.get('lat', value.get('latitude'))
+        lon = value.get('lon', value.get('lng', value.get('longitude')))
+        if lat is None or lon is None:
+            raise ValueError('Coordinate endpoints need lat and lon')
+        return 'coords', (round(float(lat), 6), round(float(lon), 6))
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        return 'coords', (round(float(value[0]), 6), round(float(value[1]), 6))
+    if isinstance(value, str) and value.strip():
+        # Normalise whitespace and case so trivially different spellings share one lookup
+        return 'place', ' '.join(value.split()).lower()
+    raise ValueError('Endpoint must be a place name or coordinates')
+
+
+class RouteBatchResolver:
+    """Resolve many source/destination pairs with shared, deduplicated upstream lookups"""
+
+    def __init__(self, pairs: List[dict], max_workers: int = BATCH_MAX_WORKERS,
+                 geocode_concurrency: int = GEOCODE_MAX_CONCURRENCY):
+        self.pairs = pairs
+        self.max_workers = max_workers
+        self._geocode_slots = threading.BoundedSemaphore(geocode_concurrency)
+        self.stats = {'pairs': len(pairs), 'geocode_lookups': 0, 'route_lookups': 0}
+
+    def _geocode(self, place: str) -> Optional[Tuple[float, float]]:
+        with self._geocode_slots:
+            return geocode_place(place)
+
+    @staticmethod
+    def _route(src: Tuple[float, float], dest: Tuple[float, float]):
+        return get_route_coords(src[0], src[1], dest[0], dest[1])
+
+    def results(self):
+        """Yield one result dict per pair, in completion order"""
+        parsed: Dict[int, Tuple] = {}
+        for index, pair in enumerate(self.pairs):
+            try:
+                parsed[index] = (parse_endpoint(pair.get('source')), parse_endpoint(pair.get('destination')))
+            except (AttributeError, TypeError, ValueError) as e:
+                yield self._error(index, f'Invalid pair: {e}')
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = {}
+        geocode_waiters: Dict[str, List[int]] = {}
+        route_waiters: Dict[Tuple, List[int]] = {}
+        # (route, error) of finished lookups, for pairs whose geocodes resolve to the same key later
+        routes: Dict[Tuple, Tuple] = {}
+        resolved: Dict[int, Dict[str, Tuple[float, float]]] = {}
+
+        def submit_route(index):
+            """Start or join the route lookup for a pair; returns its result if already known"""
+            src, dest = resolved[index]['source'], resolved[index]['destination']
+            key = (src, dest)
+            if key in routes:
+                return self._route_result(index, key, *routes[key])
+            if key not in route_waiters:
+                route_waiters[key] = []
+                futures[submit_with_context(executor, self._route, src, dest)] = ('route', key)
+                self.stats['route_lookups'] += 1
+            route_waiters[key].append(index)
+            return None
+
+        try:
+            for index, endpoints in parsed.items():
+                resolved[index] = {}
+                for role, (kind, value) in zip(('source', 'destination'), endpoints):
+                    if kind == 'coords':
+                        resolved[index][role] = value
+                        continue
+                    if value not in geocode_waiters:
+                        geocode_waiters[value] = []
+                        futures[submit_with_context(executor, self._geocode, value)] = ('geocode', value)
+                        self.stats['geocode_lookups'] += 1
+                    if index not in geocode_waiters[value]:
+                        geocode_waiters[value].append(index)
+                if len(resolved[index]) == 2:
+                    result = submit_route(index)
+                    if result is not None:
+                        yield result
+
+            while futures:
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, key = futures.pop(future)
+                    try:
+                        value = future.result()
+                        error = None
+                    except Exception as e:
+                        value, error = None, str(e)
+
+                    if kind == 'geocode':
+                        for index in geocode_waiters[key]:
+                            if index not in resolved:
+                                continue
+                            if value is None:
+                                del resolved[index]
+                                yield self._error(index, error or 'Could not find one of the locations.')
+                                continue
+                            for role, (endpoint_kind, endpoint) in zip(('source', 'destination'), parsed[index]):
+                                if endpoint_kind == 'place' and endpoint == key:
+                                    resolved[index][role] = value
+                            if len(resolved[index]) == 2:
+                                result = submit_route(index)
+                                if result is not None:
+                                    yield result
+                    else:
+                        routes[key] = (value, error)
+                        for index in route_waiters.pop(key):
+                            yield self._route_result(index, key, value, error)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _route_result(self, index, key, route, error):
+        if not route:
+            return self._error(index, error or 'Could not generate route coordinates.')
+        return {
+            'index': index,
+            'id': self.pairs[index].get('id'),
+            'status': 'success',
+            'source': {'lat': key[0][0], 'lon': key[0][1]},
+            'destination': {'lat': key[1][0], 'lon': key[1][1]},
+            'route_coordinates': route,
+        }
+
+    def _error(self, index, message):
+        pair = self.pairs[index] if isinstance(self.pairs[index], dict) else {}
+        return {'index': index, 'id': pair.get('id'), 'status': 'error', 'message': message}
+
+    def ndjson(self):
+        """Yield results encoded as newline-delimited JSON, followed by a summary line"""
+        for result in self.results():
+            yield json.dumps(result) + '\n'
+        yield json.dumps({'status': 'complete', 'stats': self.stats}) + '\n'
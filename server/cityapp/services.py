@@ -1,8 +1,25 @@
 import google.generativeai as genai
 import json
 import random
+import threading
 from typing import List, Dict
 
+from .upstream import get_service
+
+# A user within this distance of a high-risk hotspot is considered inside it
+HOTSPOT_RADIUS_KM = 0.5
+
+# Last successful Gemini result per (city, count), served when Gemini is unavailable
+_hotspot_cache: Dict[tuple, List[Dict]] = {}
+_hotspot_cache_lock = threading.Lock()
+
+
+def cached_hotspots(risk_level: str = 'high') -> List[Dict]:
+    """Hotspots from the most recent successful Gemini responses, without calling the API"""
+    with _hotspot_cache_lock:
+        cached = [coord for coords in _hotspot_cache.values() for coord in coords]
+    return [coord for coord in cached if coord.get('risk_level') == risk_level]
+
 class CrimePredictionService:
     def __init__(self, api_key: str):
         genai.configure(api_key=api_key)
@@ -31,16 +48,28 @@ class CrimePredictionService:
         Risk levels: "high", "medium", "low"
         """
         
+        cache_key = (city, count)
+        
+        def fetch(timeout):
+            response = self.model.generate_content(prompt, request_options={'timeout': timeout})
+            return response.text
+        
         try:
-            response = self.model.generate_content(prompt)
+            text = get_service('gemini').call(fetch)
             # Parse the JSON response
-            coordinates = json.loads(response.text.strip())
+            coordinates = json.loads(text.strip())
             # Filter out water zone coordinates
-            filtered_coords = self._filter_water_zones(coordinates)
-            return filtered_coords[:count]
+            filtered_coords = self._filter_water_zones(coordinates)[:count]
+            with _hotspot_cache_lock:
+                _hotspot_cache[cache_key] = filtered_coords
+            return filtered_coords
         
-        except Exception as e:
-            # Fallback: Generate random coordinates around Chennai if API fails
+        except Exception:
+            # Serve the last good hotspots, else generate random coordinates if API fails
+            with _hotspot_cache_lock:
+                cached = _hotspot_cache.get(cache_key)
+            if cached is not None:
+                return cached
             return self._generate_fallback_coordinates(city, count)
     
     def _generate_fallback_coordinates(self, city: str, count: int) -> List[Dict]:
@@ -0,0 +1,16 @@
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBSessionStore
+
+
+class SessionStore(CachedDBSessionStore):
+    """cached_db sessions that write a first login's session once instead of twice
+
+    login() always cycles the session key. With no existing key that inserts an
+    empty session row which the middleware then immediately updates with the
+    login data; skipping the rotation lets the middleware create the row once.
+    Existing sessions are still rotated, so fixation protection is unchanged.
+    """
+
+    def cycle_key(self):
+        if self.session_key is None:
+            return
+        super().cycle_key()
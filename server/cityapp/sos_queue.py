@@ -0,0 +1,461 @@
+import atexit
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import metrics
+from .geo import geohash_encode, parse_lat_lng
+from .models import SOSDispatch, SOSRequestKey
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    # Start worker threads inside the web process on the first SOS; turn off when
+    # `manage.py run_sos_workers` runs as its own process
+    'RUN_IN_PROCESS': True,
+    'WORKERS': 4,
+    'MAX_ATTEMPTS': 8,
+    # Retry n waits min(BASE * 2**(n-1), MAX) seconds, with +/-20% jitter
+    'BACKOFF_BASE_SECONDS': 2,
+    'BACKOFF_MAX_SECONDS': 300,
+    # A worker that dies mid-delivery loses its claim after this long
+    'LEASE_SECONDS': 60,
+    # Idle workers look for due retries this often even without a wake-up
+    'POLL_INTERVAL_MS': 1000,
+    # An SOS from a user whose last SOS (or repeat) is this recent is folded into it
+    'DEDUPE_WINDOW_SECONDS': 300,
+    # Folded repeats go out as at most one update message per alert this often
+    'UPDATE_INTERVAL_SECONDS': 60,
+    # DIGEST_THRESHOLD alerts from one geohash cell within DIGEST_WINDOW_SECONDS switch that
+    # cell to digest mode: officers get one summary per DIGEST_DELAY_SECONDS instead of one
+    # message per SOS (emergency contacts are still messaged individually)
+    'DIGEST_THRESHOLD': 5,
+    'DIGEST_WINDOW_SECONDS': 120,
+    'DIGEST_DELAY_SECONDS': 30,
+    # Cells of roughly 5 km x 5 km
+    'DIGEST_PRECISION': 5,
+}
+
+
+def sos_queue_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'SOS_QUEUE', {}))
+    return config
+
+
+class DeliveryError(Exception):
+    """A delivery attempt failed and should be retried"""
+
+
+def contact_sos_message(dispatch):
+    """Text sent to the user's emergency contacts"""
+    if dispatch.kind == 'update':
+        return (f"UPDATE: {dispatch.username} is still asking for help. "
+                f"Latest location: {dispatch.location}. Phone: {dispatch.phone}.")
+    return (f"EMERGENCY: {dispatch.username} has triggered an SOS alert and may need help. "
+            f"Location: {dispatch.location}. Phone: {dispatch.phone}. Police have been notified.")
+
+
+def safety_alert_message(dispatch):
+    """Text sent to emergency contacts when the user lingers in a high-crime area"""
+    return (f"SAFETY ALERT: {dispatch.username} has been in a high-crime area for over 5 minutes. "
+            f"Location: {dispatch.location}")
+
+
+def refine_units(dispatch):
+    """Replace the straight-line units picked at submission with road-ETA ones, keeping them on failure"""
+    from .dispatch import find_nearest_units
+
+    coords = parse_lat_lng(dispatch.location)
+    if not coords or not dispatch.nearest_units:
+        return
+    if all(unit.get('eta_source') != 'straight_line' for unit in dispatch.nearest_units):
+        return
+    try:
+        units = find_nearest_units(coords[0], coords[1], k=len(dispatch.nearest_units))
+    except Exception as e:
+        logger.warning('SOS %s: keeping straight-line units: %s', dispatch.id, e)
+        return
+    if units:
+        dispatch.nearest_units = units
+        SOSDispatch.objects.filter(id=dispatch.id).update(nearest_units=units)
+
+
+def deliver_sos(dispatch, center=None):
+    """Send one SOS to the police channel and every emergency contact in parallel
+
+    Safety alerts go to the emergency contacts only. Recipients that already got this
+    dispatch on an earlier attempt are skipped. Raises DeliveryError when any recipient
+    failed, so only those are retried.
+    """
+    from .notifications import Recipient, notification_center
+    from .telegram_service import TelegramService
+
+    center = center or notification_center
+    telegram = TelegramService()
+    recipients = []
+    if dispatch.kind == 'safety':
+        message = safety_alert_message(dispatch)
+        if dispatch.user_profile_id:
+            recipients = center.contact_recipients(dispatch.user_profile_id, message)
+        if not recipients:
+            recipients = [
+                Recipient(transport, phone, message)
+                for phone in dispatch.contact_numbers
+                for transport in center.config['CONTACT_TRANSPORTS']
+            ]
+    elif dispatch.kind == 'digest':
+        alerts = list(dispatch.children.order_by('created_at'))
+        if alerts:
+            recipients.append(center.police_recipient(telegram.build_sos_digest_message(dispatch.area, alerts)))
+    elif dispatch.kind == 'update':
+        alert = dispatch.parent
+        # In digest mode officers follow the area digest rather than per-user updates
+        if not alert.parent_id:
+            recipients.append(center.police_recipient(telegram.build_sos_update_message(alert, dispatch)))
+    elif not dispatch.parent_id:
+        if dispatch.attempts <= 1:
+            refine_units(dispatch)
+        recipients.append(center.police_recipient(telegram.build_sos_message(
+            dispatch.username, dispatch.phone, dispatch.location, dispatch.duration_minutes,
+            dispatch.nearest_units, created_at=dispatch.created_at
+        )))
+    if dispatch.user_profile_id and dispatch.kind not in ('digest', 'safety'):
+        recipients += center.contact_recipients(dispatch.user_profile_id, contact_sos_message(dispatch))
+
+    delivered = set(dispatch.deliveries.filter(status='sent').values_list('transport', 'recipient'))
+    pending = [recipient for recipient in recipients if (recipient.transport, recipient.address) not in delivered]
+    deliveries = center.fan_out(
+        pending, 'alert' if dispatch.kind == 'safety' else 'sos',
+        user_profile_id=dispatch.user_profile_id, sos_dispatch=dispatch
+    )
+    failed = [delivery for delivery in deliveries if delivery.status == 'failed']
+    if failed:
+        raise DeliveryError(f'{len(failed)} of {len(pending)} recipients failed: '
+                            + '; '.join(f'{d.transport} {d.recipient}: {d.error}' for d in failed[:3]))
+
+
+def backoff_seconds(attempt, base, maximum):
+    delay = min(base * 2 ** max(attempt - 1, 0), maximum)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def serialize_dispatch(dispatch):
+    return {
+        'sos_id': str(dispatch.id),
+        'kind': dispatch.kind,
+        'status': dispatch.status,
+        'repeat_count': dispatch.repeat_count,
+        'attempts': dispatch.attempts,
+        'created_at': dispatch.created_at.isoformat(),
+        'next_attempt_at': dispatch.next_attempt_at.isoformat() if dispatch.status == 'queued' else None,
+        'delivered_at': dispatch.delivered_at.isoformat() if dispatch.delivered_at else None,
+        'last_error': dispatch.last_error or None,
+    }
+
+
+class SOSWorkerPool:
+    """Threads that claim due SOSDispatch rows and deliver them with retries
+
+    Rows are claimed with a conditional UPDATE, so any number of pools (in web
+    processes or `run_sos_workers`) can share the table without double-sending.
+    A claim is a lease: if its worker dies, the row becomes due again once the
+    lease expires.
+    """
+
+    def __init__(self, send: Callable[[SOSDispatch], None] = deliver_sos, workers=4, max_attempts=8,
+                 backoff_base_seconds=2, backoff_max_seconds=300, lease_seconds=60, poll_interval_ms=1000):
+        self.send = send
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base_seconds
+        self.backoff_max = backoff_max_seconds
+        self.lease = timedelta(seconds=lease_seconds)
+        self.poll_interval = poll_interval_ms / 1000
+        self._wake = threading.Condition()
+        self._pending_wakeups = 0
+        self._stop = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'claimed': 0, 'delivered': 0, 'retried': 0, 'failed': 0}
+        self._delivery_latency = metrics.LatencyRecorder()
+        self._queue_latency = metrics.LatencyRecorder()
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def start(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'sos-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def notify(self):
+        """Wake one idle worker; called right after an SOS is queued"""
+        with self._wake:
+            self._pending_wakeups += 1
+            self._wake.notify()
+
+    def claim(self) -> Optional[SOSDispatch]:
+        """Take ownership of the oldest due dispatch, or None when nothing is due"""
+        now = timezone.now()
+        due = Q(status='queued', next_attempt_at__lte=now) | Q(status='sending', lease_expires_at__lt=now)
+        for dispatch_id in SOSDispatch.objects.filter(due).order_by('next_attempt_at').values_list('id', flat=True)[:5]:
+            claimed = SOSDispatch.objects.filter(due, id=dispatch_id).update(
+                status='sending', attempts=F('attempts') + 1, lease_expires_at=now + self.lease, updated_at=now
+            )
+            if claimed:
+                self._count('claimed')
+                return SOSDispatch.objects.get(id=dispatch_id)
+            # Another worker got it first; try the next one
+        return None
+
+    def process(self, dispatch):
+        """Attempt one delivery and record the outcome on the row"""
+        if dispatch.attempts == 1:
+            self._queue_latency.record((timezone.now() - dispatch.created_at).total_seconds())
+        started = time.monotonic()
+        try:
+            self.send(dispatch)
+        except Exception as e:
+            now = timezone.now()
+            if dispatch.attempts >= self.max_attempts:
+                SOSDispatch.objects.filter(id=dispatch.id).update(
+                    status='failed', lease_expires_at=None, last_error=str(e)[:2000], updated_at=now
+                )
+                self._count('failed')
+                logger.error('SOS %s: giving up after %s attempts: %s', dispatch.id, dispatch.attempts, e)
+            else:
+                delay = backoff_seconds(dispatch.attempts, self.backoff_base, self.backoff_max)
+                SOSDispatch.objects.filter(id=dispatch.id).update(
+                    status='queued', lease_expires_at=None, last_error=str(e)[:2000],
+                    next_attempt_at=now + timedelta(seconds=delay), updated_at=now
+                )
+                self._count('retried')
+            return False
+        now = timezone.now()
+        SOSDispatch.objects.filter(id=dispatch.id).update(
+            status='delivered', lease_expires_at=None, delivered_at=now, last_error='', updated_at=now
+        )
+        self._count('delivered')
+        self._delivery_latency.record(time.monotonic() - started)
+        return True
+
+    def process_due(self, limit=None):
+        """Deliver due dispatches in the calling thread until none are due; returns how many were attempted"""
+        attempted = 0
+        while limit is None or attempted < limit:
+            dispatch = self.claim()
+            if dispatch is None:
+                break
+            self.process(dispatch)
+            attempted += 1
+        return attempted
+
+    def _run(self):
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                if self.process_due(limit=1):
+                    continue
+            except Exception as e:
+                # Keep the worker alive through database hiccups; the row stays due
+                logger.exception('SOS worker error: %s', e)
+            with self._wake:
+                if self._pending_wakeups == 0 and not self._stop.is_set():
+                    self._wake.wait(self.poll_interval)
+                self._pending_wakeups = max(self._pending_wakeups - 1, 0)
+        connection.close()
+
+    def snapshot(self):
+        counts = dict(SOSDispatch.objects.filter(status__in=['queued', 'sending'])
+                      .order_by().values_list('status').annotate(n=Count('id')))
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {
+            **stats,
+            'workers': len(self._threads),
+            'queued': counts.get('queued', 0),
+            'sending': counts.get('sending', 0),
+            'queue_latency': self._queue_latency.snapshot(),
+            'delivery_latency': self._delivery_latency.snapshot(),
+        }
+
+
+def pool_from_settings(send=deliver_sos):
+    config = sos_queue_config()
+    return SOSWorkerPool(
+        send=send,
+        workers=config['WORKERS'],
+        max_attempts=config['MAX_ATTEMPTS'],
+        backoff_base_seconds=config['BACKOFF_BASE_SECONDS'],
+        backoff_max_seconds=config['BACKOFF_MAX_SECONDS'],
+        lease_seconds=config['LEASE_SECONDS'],
+        poll_interval_ms=config['POLL_INTERVAL_MS'],
+    )
+
+
+sos_workers = pool_from_settings()
+metrics.register('sos_queue', sos_workers.snapshot)
+
+
+def enqueue_sos(username, phone, location, duration_minutes=0, nearest_units=None, user_profile=None,
+                idempotency_key='', **fields):
+    """Durably accept an SOS (one INSERT, two with a key) and wake a worker to deliver it
+
+    ``fields`` sets other SOSDispatch columns (kind, parent, area, next_attempt_at, ...).
+    """
+    with transaction.atomic():
+        dispatch = SOSDispatch.objects.create(
+            user_profile=user_profile,
+            username=username,
+            phone=phone,
+            location=location,
+            duration_minutes=duration_minutes,
+            nearest_units=nearest_units or [],
+            **fields
+        )
+        if idempotency_key:
+            SOSRequestKey.objects.create(username=username, key=idempotency_key, dispatch=dispatch)
+    if sos_queue_config()['RUN_IN_PROCESS']:
+        sos_workers.start()
+        # Inside a caller's transaction the row is only visible to workers once it commits
+        transaction.on_commit(sos_workers.notify)
+    return dispatch
+
+
+class SOSSubmission(NamedTuple):
+    dispatch: SOSDispatch
+    # 'queued' for a new alert, 'coalesced' when folded into the user's active alert,
+    # 'duplicate' for a replayed idempotency key
+    outcome: str
+
+
+def submit_sos(username, phone, location, duration_minutes=0, locate_units=None, user_profile=None,
+               idempotency_key=''):
+    """Accept an SOS request, folding repeats and retries into the alert they repeat
+
+    ``locate_units`` returns the nearest units for a new alert; it is not called for
+    duplicates and repeats, which reuse the original alert's units. Keys and the
+    one-undelivered-alert-per-user rule are unique constraints, so this holds across
+    processes.
+    """
+    try:
+        return _submit_sos(username, phone, location, duration_minutes, locate_units, user_profile, idempotency_key)
+    except IntegrityError:
+        # A concurrent request won: it used the same key, or raised this user's alert first.
+        # Its rows are committed now, so a second pass returns or folds into them.
+        return _submit_sos(username, phone, location, duration_minutes, locate_units, user_profile, idempotency_key)
+
+
+def _submit_sos(username, phone, location, duration_minutes, locate_units, user_profile, idempotency_key):
+    config = sos_queue_config()
+    now = timezone.now()
+
+    if idempotency_key:
+        existing = SOSDispatch.objects.filter(
+            request_keys__username=username, request_keys__key=idempotency_key
+        ).first()
+        if existing:
+            return SOSSubmission(existing, 'duplicate')
+
+    latest = (SOSDispatch.objects.filter(username=username, kind='alert').exclude(status='failed')
+              .order_by('-created_at').first())
+    window = timedelta(seconds=config['DEDUPE_WINDOW_SECONDS'])
+    # An undelivered alert always absorbs repeats; only one per user may exist (see SOSDispatch.Meta)
+    if latest and (latest.status in ('queued', 'sending')
+                   or (latest.last_repeat_at or latest.created_at) >= now - window):
+        with transaction.atomic():
+            if idempotency_key:
+                SOSRequestKey.objects.create(username=username, key=idempotency_key, dispatch=latest)
+            coalesce_repeat(latest, location, duration_minutes, now, config)
+        return SOSSubmission(latest, 'coalesced')
+
+    coords = parse_lat_lng(location)
+    area = geohash_encode(coords[0], coords[1], precision=config['DIGEST_PRECISION']) if coords else ''
+    with transaction.atomic():
+        dispatch = enqueue_sos(
+            username, phone, location,
+            duration_minutes=duration_minutes,
+            nearest_units=locate_units() if locate_units else None,
+            user_profile=user_profile,
+            idempotency_key=idempotency_key,
+            area=area,
+            parent=area_digest(area, location, now, config) if area else None,
+        )
+    return SOSSubmission(dispatch, 'queued')
+
+
+def coalesce_repeat(alert, location, duration_minutes, now, config):
+    """Fold a repeated SOS into ``alert``: refresh it if unsent, else into at most one update per interval"""
+    SOSDispatch.objects.filter(id=alert.id).update(
+        repeat_count=F('repeat_count') + 1, last_repeat_at=now, updated_at=now
+    )
+    latest = {'location': location, 'duration_minutes': duration_minutes, 'updated_at': now}
+    # Not picked up by a worker yet: the single alert goes out with the latest details
+    if SOSDispatch.objects.filter(id=alert.id, status='queued', attempts=0).update(**latest):
+        return
+    if SOSDispatch.objects.filter(parent=alert, kind='update', status='queued', attempts=0).update(
+            repeat_count=F('repeat_count') + 1, **latest):
+        return
+    last_sent = (alert.children.filter(kind='update').order_by('-created_at')
+                 .values_list('created_at', flat=True).first() or alert.created_at)
+    enqueue_sos(
+        alert.username, alert.phone, location,
+        duration_minutes=duration_minutes,
+        nearest_units=alert.nearest_units,
+        user_profile=alert.user_profile,
+        kind='update',
+        parent=alert,
+        repeat_count=1,
+        next_attempt_at=max(now, last_sent + timedelta(seconds=config['UPDATE_INTERVAL_SECONDS'])),
+    )
+
+
+def area_digest(area, location, now, config):
+    """The open digest a new alert from ``area`` should join, or None when it goes out on its own
+
+    Below DIGEST_THRESHOLD recent alerts every SOS is sent individually. The alert that
+    reaches the threshold is sent right away too and opens a digest; alerts after it
+    join that digest until it is sent DIGEST_DELAY_SECONDS later.
+    """
+    recent = SOSDispatch.objects.filter(
+        area=area, kind='alert', created_at__gte=now - timedelta(seconds=config['DIGEST_WINDOW_SECONDS'])
+    ).count()
+    if recent + 1 < config['DIGEST_THRESHOLD']:
+        return None
+    # Only join a digest that is not about to be claimed, so no alert misses it
+    digest = (SOSDispatch.objects.filter(area=area, kind='digest', status='queued', attempts=0,
+                                         next_attempt_at__gt=now + timedelta(seconds=1))
+              .order_by('-created_at').first())
+    if digest is None:
+        enqueue_sos(
+            '', '', location, kind='digest', area=area,
+            next_attempt_at=now + timedelta(seconds=config['DIGEST_DELAY_SECONDS']),
+        )
+    return digest
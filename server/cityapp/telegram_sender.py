@@ -0,0 +1,332 @@
+import atexit
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from django.conf import settings
+
+from . import metrics
+
+DEFAULT_CONFIG = {
+    # Telegram allows about 30 messages per second per bot across all chats; rate plus
+    # burst is what can go out in any one second...
+    'GLOBAL_RATE_PER_SECOND': 25,
+    'GLOBAL_BURST': 5,
+    # ...and about one per second in a single chat, with short bursts tolerated
+    'CHAT_RATE_PER_SECOND': 1,
+    'CHAT_BURST': 3,
+    # Concurrent sendMessage calls; each chat still has at most one in flight
+    'SEND_WORKERS': 4,
+    # Times a message is put back after a 429 before it fails
+    'MAX_RETRIES': 5,
+    # Queued informational messages to one chat are merged up to this size (Telegram's cap is 4096)
+    'MERGE_MAX_CHARS': 4000,
+}
+
+# Lower goes first
+PRIORITY_SOS = 0
+PRIORITY_INFO = 10
+
+MERGE_SEPARATOR = '\n\n— — —\n\n'
+
+
+def sender_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'TELEGRAM_SENDER', {}))
+    return config
+
+
+class TelegramSendError(Exception):
+    """Telegram rejected a message, or it could not be sent in time"""
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``capacity``; not thread-safe on its own"""
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class OutgoingMessage:
+    __slots__ = ('chat_id', 'text', 'priority', 'seq', 'enqueued_at', 'deadline', 'future', 'attempts')
+
+    def __init__(self, chat_id, text, priority, seq, enqueued_at, deadline):
+        self.chat_id = chat_id
+        self.text = text
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = enqueued_at
+        self.deadline = deadline
+        self.future = Future()
+        self.attempts = 0
+
+
+def post_message(chat_id, text):
+    from .telegram_service import TelegramService
+
+    return TelegramService().post_message(chat_id, text)
+
+
+class TelegramSender:
+    """Priority queue in front of the Telegram Bot API that stays inside its rate limits
+
+    A dispatcher thread hands the most urgent message whose chat is ready to a small
+    send pool. A message needs a token from the global bucket and from its chat's
+    bucket, and each chat has at most one request in flight, so messages to a chat
+    keep their order. A 429 pauses the chat for ``retry_after`` and puts the message
+    back. Informational messages queued for the same chat go out as one merged message.
+    """
+
+    def __init__(self, post: Callable[[str, str], object] = post_message, global_rate_per_second=25,
+                 global_burst=5, chat_rate_per_second=1, chat_burst=3, send_workers=4, max_retries=5,
+                 merge_max_chars=4000, autostart=True):
+        self.post = post
+        self.chat_rate = chat_rate_per_second
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.merge_max_chars = merge_max_chars
+        self.autostart = autostart
+        self._global = TokenBucket(global_rate_per_second, global_burst)
+        self._chat_buckets = {}
+        self._chat_paused_until = {}
+        self._in_flight_chats = set()
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=send_workers, thread_name_prefix='telegram')
+        self.stats = {'queued': 0, 'sent': 0, 'requests': 0, 'merged': 0, 'rate_limited': 0, 'failed': 0,
+                      'expired': 0}
+        self._sent_at = deque(maxlen=10000)
+        self._queue_latency = metrics.LatencyRecorder()
+        self._send_latency = metrics.LatencyRecorder()
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='telegram-dispatcher', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=timeout)
+
+    def send(self, chat_id, text, priority=PRIORITY_INFO, max_wait: Optional[float] = None) -> Future:
+        """Queue a message; the future resolves to Telegram's message id or a TelegramSendError
+
+        A message still queued ``max_wait`` seconds from now is dropped rather than sent late.
+        """
+        now = time.monotonic()
+        message = OutgoingMessage(str(chat_id), text, priority, next(self._seq), now,
+                                  now + max_wait if max_wait is not None else None)
+        with self._cond:
+            heapq.heappush(self._heap, (priority, message.seq, message))
+            self.stats['queued'] += 1
+            self._cond.notify()
+        if self.autostart:
+            self.start()
+        return message.future
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _chat_wait(self, chat_id, now) -> Optional[float]:
+        """Seconds until the chat may be sent to, or None while it has a request in flight"""
+        if chat_id in self._in_flight_chats:
+            return None
+        return max(self._chat_paused_until.get(chat_id, 0) - now, self._chat_bucket(chat_id).wait_time(now), 0)
+
+    def _next_batch(self, now):
+        """Pop the next sendable batch, or return ([], seconds to wait); caller holds the lock"""
+        global_wait = self._global.wait_time(now)
+        if global_wait > 0:
+            return [], global_wait
+        chosen, waiting, soonest = None, [], None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            message = entry[2]
+            if message.deadline is not None and now > message.deadline:
+                self._fail([message], TelegramSendError('Not sent in time; dropped from the Telegram queue'), 'expired')
+                continue
+            chat_wait = self._chat_wait(message.chat_id, now)
+            if chat_wait == 0:
+                chosen = message
+                break
+            waiting.append(entry)
+            # Wake up when the chat is ready, or in time to drop the message once it expires
+            for wait in (chat_wait, message.deadline - now + 0.001 if message.deadline is not None else None):
+                if wait is not None:
+                    soonest = wait if soonest is None else min(soonest, wait)
+        for entry in waiting:
+            heapq.heappush(self._heap, entry)
+        if chosen is None:
+            return [], soonest
+
+        batch = [chosen]
+        if chosen.priority >= PRIORITY_INFO:
+            size = len(chosen.text)
+            kept = []
+            for entry in sorted(self._heap):
+                message = entry[2]
+                if (message.chat_id == chosen.chat_id and message.priority >= PRIORITY_INFO
+                        and (message.deadline is None or now <= message.deadline)
+                        and size + len(MERGE_SEPARATOR) + len(message.text) <= self.merge_max_chars):
+                    batch.append(message)
+                    size += len(MERGE_SEPARATOR) + len(message.text)
+                else:
+                    kept.append(entry)
+            if len(batch) > 1:
+                self._heap = kept
+                heapq.heapify(self._heap)
+
+        self._global.take(now)
+        self._chat_bucket(chosen.chat_id).take(now)
+        self._in_flight_chats.add(chosen.chat_id)
+        return batch, 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._cond:
+                batch, wait = self._next_batch(time.monotonic())
+                if not batch:
+                    self._cond.wait(wait if wait is not None else 1.0)
+                    continue
+            # Futures of first attempts leave the pending state here; they can no longer be cancelled
+            chat_id = batch[0].chat_id
+            batch = [message for message in batch if message.attempts or message.future.set_running_or_notify_cancel()]
+            if not batch:
+                self._release(chat_id)
+                continue
+            self._executor.submit(self._send, batch)
+
+    def _release(self, chat_id):
+        with self._cond:
+            self._in_flight_chats.discard(chat_id)
+            self._cond.notify()
+
+    def _send(self, batch):
+        chat_id = batch[0].chat_id
+        started = time.monotonic()
+        for message in batch:
+            if message.attempts == 0:
+                self._queue_latency.record(started - message.enqueued_at)
+            message.attempts += 1
+        text = MERGE_SEPARATOR.join(message.text for message in batch)
+        try:
+            response = self.post(chat_id, text)
+        except Exception as e:
+            self._fail(batch, TelegramSendError(f'Telegram error: {e}'))
+            self._release(chat_id)
+            return
+        self._send_latency.record(time.monotonic() - started)
+
+        if response.status_code == 429:
+            retry_after = self._retry_after(response)
+            with self._cond:
+                self.stats['rate_limited'] += 1
+                self._chat_paused_until[chat_id] = time.monotonic() + retry_after
+                retryable = [message for message in batch if message.attempts <= self.max_retries]
+                for message in retryable:
+                    heapq.heappush(self._heap, (message.priority, message.seq, message))
+            self._fail([message for message in batch if message not in retryable],
+                       TelegramSendError(f'Still rate limited after {self.max_retries} retries'))
+        elif response.status_code != 200:
+            self._fail(batch, TelegramSendError(f'Telegram returned {response.status_code}: {response.text[:200]}'))
+        else:
+            try:
+                message_id = str(response.json().get('result', {}).get('message_id', ''))
+            except ValueError:
+                message_id = ''
+            now = time.monotonic()
+            with self._cond:
+                self.stats['sent'] += len(batch)
+                self.stats['requests'] += 1
+                self.stats['merged'] += len(batch) - 1
+                self._sent_at.extend([now] * len(batch))
+            for message in batch:
+                message.future.set_result(message_id)
+        self._release(chat_id)
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.json().get('parameters', {}).get('retry_after', 1))
+        except (ValueError, TypeError, AttributeError):
+            return 1.0
+
+    def _fail(self, messages, error, stat='failed'):
+        if not messages:
+            return
+        with self._cond:
+            self.stats[stat] += len(messages)
+        for message in messages:
+            if message.attempts == 0 and not message.future.set_running_or_notify_cancel():
+                continue
+            message.future.set_exception(error)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._cond:
+            stats = dict(self.stats)
+            depth = {'sos': 0, 'info': 0}
+            for priority, _, _ in self._heap:
+                depth['sos' if priority < PRIORITY_INFO else 'info'] += 1
+            sent_last_minute = sum(1 for at in self._sent_at if now - at <= 60)
+            paused = [chat for chat, until in self._chat_paused_until.items() if until > now]
+        return {
+            **stats,
+            'queue_depth': depth,
+            'throughput_per_minute': sent_last_minute,
+            'paused_chats': len(paused),
+            'queue_latency': self._queue_latency.snapshot(),
+            'send_latency': self._send_latency.snapshot(),
+        }
+
+
+def sender_from_settings(post=post_message):
+    config = sender_config()
+    return TelegramSender(
+        post=post,
+        global_rate_per_second=config['GLOBAL_RATE_PER_SECOND'],
+        global_burst=config['GLOBAL_BURST'],
+        chat_rate_per_second=config['CHAT_RATE_PER_SECOND'],
+        chat_burst=config['CHAT_BURST'],
+        send_workers=config['SEND_WORKERS'],
+        max_retries=config['MAX_RETRIES'],
+        merge_max_chars=config['MERGE_MAX_CHARS'],
+    )
+
+
+telegram_sender = sender_from_settings()
+metrics.register('telegram_sender', telegram_sender.snapshot)
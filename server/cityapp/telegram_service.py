@@ -1,6 +1,5 @@
-import requests
-import os
-from django.conf import settings
+from . import http_client
+from .upstream import get_service
 
 class TelegramService:
     def __init__(self):
@@ -8,8 +7,18 @@ class TelegramService:
         self.chat_id = '5527167310'
         self.base_url = f'https://api.telegram.org/bot{self.bot_token}'
     
-    def send_sos_alert(self, username, phone, location, duration_minutes):
-        """Send SOS alert via Telegram"""
+    def post_message(self, chat_id, text):
+        """One sendMessage call; send through telegram_sender.telegram_sender to respect rate limits"""
+        url = f'{self.base_url}/sendMessage'
+        payload = {
+            'chat_id': chat_id,
+            'text': text,
+            'parse_mode': 'HTML'
+        }
+        return get_service('telegram').call(lambda timeout: self._post(url, payload, timeout))
+    
+    def build_sos_message(self, username, phone, location, duration_minutes, nearest_units=None, created_at=None):
+        """Text of the SOS alert posted to the police chat"""
         message = f"""🚨 EMERGENCY SOS ALERT 🚨
 
 User: {username}
@@ -20,26 +29,53 @@ Duration in hotspot: {duration_minutes} minutes
 User has been in a high-crime area for an extended period.
 Immediate assistance may be required.
 
-Time: {self._get_current_time()}"""
+Time: {self._get_current_time(created_at)}"""
         
-        try:
-            url = f'{self.base_url}/sendMessage'
-            payload = {
-                'chat_id': self.chat_id,
-                'text': message,
-                'parse_mode': 'HTML'
-            }
-            
-            response = requests.post(url, json=payload, timeout=10)
-            
-            if response.status_code == 200:
-                return {'status': 'success', 'message': 'SOS alert sent successfully'}
-            else:
-                return {'status': 'error', 'message': f'Failed to send alert: {response.text}'}
-                
-        except Exception as e:
-            return {'status': 'error', 'message': f'Telegram error: {str(e)}'}
+        if nearest_units:
+            message += "\n\nNearest units:"
+            for unit in nearest_units:
+                eta_minutes = max(1, round(unit['eta_seconds'] / 60))
+                message += (f"\n- {unit['police_rank'] or 'Officer'} {unit['username']} "
+                            f"({unit['police_id'] or 'N/A'}): {unit['distance_km']} km, ~{eta_minutes} min")
+        return message
+    
+    def build_sos_update_message(self, alert, update):
+        """Text of the follow-up posted when a user keeps triggering SOS after the first alert"""
+        return f"""🔁 SOS UPDATE 🔁
+
+User: {alert.username}
+Phone: {alert.phone}
+Latest location: {update.location}
+First alert: {self._get_current_time(alert.created_at)}
+Repeated SOS since then: {alert.repeat_count}
+
+The user is still requesting help."""
+    
+    def build_sos_digest_message(self, area, alerts, limit=25):
+        """Text of one summary for many SOS alerts raised in the same area"""
+        message = f"""🚨 MULTIPLE SOS ALERTS IN ONE AREA 🚨
+
+{len(alerts)} users raised SOS near {alerts[0].location} (area {area}).
+"""
+        for alert in alerts[:limit]:
+            repeats = f", repeated {alert.repeat_count}x" if alert.repeat_count else ""
+            message += (f"\n- {alert.username} ({alert.phone}) at {alert.location}, "
+                        f"{self._get_current_time(alert.created_at)}{repeats}")
+        if len(alerts) > limit:
+            message += f"\n...and {len(alerts) - limit} more"
+        return message
+    
+    @staticmethod
+    def _post(url, payload, timeout):
+        response = http_client.post(url, json=payload, timeout=timeout)
+        # Only server-side failures count against the Telegram circuit breaker
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
     
-    def _get_current_time(self):
+    def _get_current_time(self, at=None):
         from datetime import datetime
+        if at is not None:
+            from django.utils import timezone
+            return timezone.localtime(at).strftime('%Y-%m-%d %H:%M:%S')
         return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
\ No newline at end of file
@@ -1,3 +1,1457 @@
-from django.test import TestCase
+import functools
+import io
+import json
+import math
+import threading
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from unittest import mock
+from uuid import UUID
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import http_client
+from .activity_log import save_activities
+from .dispatch import OfficerPosition, OfficerPositionIndex, officer_index
+from .geo import geohash_encode, parse_lat_lng
+from .live_positions import LivePositionFeed
+from .models import (ActivityCounter, ActivityRollup, CurrentPosition, EmergencyContact, NotificationDelivery,
+                     SOSDispatch, TrackDay, UserActivity, UserLocation, UserProfile)
+from .notifications import LocalNotifier, NotificationCenter, notifications_config
+from .pagination import encode_cursor, keyset_page
+from .rollups import ROLLUP_CELL_PRECISION, bucket_start
+from .roster import officer_roster
+from .routing import RouteBatchResolver
+from .sos_queue import SOSWorkerPool, deliver_sos, enqueue_sos
+from .telegram_sender import PRIORITY_SOS, TelegramSender
+from .tracks import day_points, decode_day, decode_points, encode_points, pack_day
+from .trajectory import TrajectoryFilter
+from .upstream import (CircuitBreaker, CircuitOpenError, DeadlineExceeded, UpstreamService, deadline_scope,
+                       remaining_budget, submit_with_context)
+from .write_behind import WriteBehindBuffer
+
+# Seed sizes for the query-plan checks; large enough that SQLite's planner prefers indexes
+SEED_USERS = 50
+SEED_ROWS_PER_USER = 200
+
+
+def explain(queryset):
+    """Return SQLite's EXPLAIN QUERY PLAN output for a queryset as one string"""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+
+@override_settings(LOCATION_WRITE_BEHIND={'ENABLED': False}, ACTIVITY_LOG={'ENABLED': False})
+class HotQueryPlanTests(TestCase):
+    """Guards the indexes behind the hot per-user queries in views.py"""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(SEED_USERS)])
+        cls.profiles = UserProfile.objects.bulk_create([
+            UserProfile(user=user, username=user.username, role='police' if i % 5 == 0 else 'public')
+            for i, user in enumerate(users)
+        ])
+
+        locations, activities, contacts = [], [], []
+        for profile in cls.profiles:
+            for j in range(SEED_ROWS_PER_USER):
+                timestamp = now - timedelta(seconds=10 * j)
+                locations.append(UserLocation(
+                    user_profile=profile, latitude=13 + j / 10000, longitude=80, timestamp=timestamp
+                ))
+                activities.append(UserActivity(
+                    user_profile=profile, activity_type='location_updated', description='Location updated'
+                ))
+            for j in range(5):
+                contacts.append(EmergencyContact(
+                    user_profile=profile, name=f'Contact {j}', phone=f'+91{j:010d}',
+                    relationship='Family', is_active=j % 2 == 0
+                ))
+        UserLocation.objects.bulk_create(locations, batch_size=1000)
+        UserActivity.objects.bulk_create(activities, batch_size=1000)
+        EmergencyContact.objects.bulk_create(contacts)
+        CurrentPosition.objects.bulk_create([
+            CurrentPosition(
+                user_profile=profile, latitude=13 + i / 1000, longitude=80,
+                geohash=geohash_encode(13 + i / 1000, 80), timestamp=now
+            )
+            for i, profile in enumerate(cls.profiles)
+        ])
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plan assertions are written against SQLite')
+        self.profile = self.profiles[7]
+        cache.clear()
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = explain(queryset)
+        self.assertIn(index_name, plan, plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, plan)
+
+    def test_latest_locations_use_composite_index(self):
+        self.assertUsesIndex(self.profile.locations.all()[:50], 'location_profile_ts_idx')
+
+    def test_activities_use_composite_index(self):
+        self.assertUsesIndex(self.profile.activities.all()[:50], 'activity_profile_ts_idx')
+
+    def test_active_contacts_use_composite_index(self):
+        self.assertUsesIndex(self.profile.emergency_contacts.filter(is_active=True), 'contact_profile_active_idx')
+
+    def test_latest_positions_use_timestamp_index(self):
+        recent = CurrentPosition.objects.filter(timestamp__gte=timezone.now() - timedelta(minutes=15))
+        plan = explain(recent.order_by('-timestamp'))
+        self.assertIn('SEARCH cityapp_currentposition USING INDEX', plan, plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, plan)
+
+    def test_keyset_pages_use_composite_index(self):
+        location = self.profile.locations.order_by('-timestamp', '-id')[100]
+        cursor = encode_cursor(location.timestamp, location.id)
+        queryset = self.profile.locations.all().order_by('-timestamp', '-id')
+        queryset = queryset.filter(timestamp__lte=location.timestamp).filter(
+            models.Q(timestamp__lt=location.timestamp) | models.Q(id__lt=location.id)
+        )
+        self.assertUsesIndex(queryset[:51], 'location_profile_ts_idx')
+        rows, _ = keyset_page(self.profile.locations.all(), cursor, 50)
+        self.assertEqual(rows[0], self.profile.locations.order_by('-timestamp', '-id')[101])
+
+    def test_activity_type_filter_uses_composite_index(self):
+        queryset = self.profile.activities.filter(activity_type='login').order_by('-timestamp', '-id')
+        self.assertUsesIndex(queryset[:51], 'activity_profile_type_ts_idx')
+
+    def test_activity_cursor_walk_returns_every_row_once(self):
+        seen = []
+        cursor = None
+        while True:
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/user-activities/', {
+                    'username': self.profile.username, 'page_size': 30, 'cursor': cursor or ''
+                })
+            body = response.json()
+            seen.extend(activity['id'] for activity in body['activities'])
+            cursor = body['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), SEED_ROWS_PER_USER)
+        self.assertEqual(len(set(seen)), SEED_ROWS_PER_USER)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/location-history/', {'username': self.profile.username, 'cursor': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_user_profile_query_count(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/user-profile/', {'username': self.profile.username})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['user']['emergency_contacts']), 3)
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/user-profile/', {'user_id': str(self.profile.id)})
+        self.assertEqual(cached.json(), response.json())
+
+    def test_user_profile_cache_invalidated_on_contact_write(self):
+        self.client.get('/api/user-profile/', {'username': self.profile.username})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/emergency-contacts/', {
+                'username': self.profile.username, 'name': 'New', 'phone': '+910000000099', 'relationship': 'Friend'
+            }, content_type='application/json')
+        response = self.client.get('/api/user-profile/', {'username': self.profile.username})
+        self.assertEqual(len(response.json()['user']['emergency_contacts']), 4)
+
+    def test_read_racing_an_invalidation_does_not_cache_the_old_payload(self):
+        from cityapp import profiles
+        serialize = profiles.serialize_profile
+
+        def write_during_read(user_profile, fields=None):
+            # The miss has loaded the row; a write commits before the payload is stored
+            payload = serialize(user_profile, fields)
+            with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+                UserProfile.objects.filter(id=self.profile.id).update(bio='updated')
+                profiles.profile_cache.invalidate([self.profile.id])
+            return payload
+
+        with mock.patch.object(profiles, 'serialize_profile', side_effect=write_during_read):
+            stale = self.client.get('/api/user-profile/', {'username': self.profile.username}).json()
+        self.assertNotEqual(stale['user']['bio'], 'updated')
+        for params in ({'username': self.profile.username}, {'user_id': str(self.profile.id)}):
+            self.assertEqual(self.client.get('/api/user-profile/', params).json()['user']['bio'], 'updated')
+        response = self.client.post('/api/user-profiles/bulk/', {'ids': [str(self.profile.id)]},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['users'][0]['bio'], 'updated')
+
+    def test_bulk_user_profiles_query_count_is_fixed(self):
+        profiles = self.profiles[:40]
+        with self.assertNumQueries(3):
+            response = self.client.post('/api/user-profiles/bulk/', {
+                'ids': [str(profile.id) for profile in profiles[:20]],
+                'usernames': [profile.username for profile in profiles[20:]] + ['nobody'],
+            }, content_type='application/json')
+        body = response.json()
+        self.assertEqual([user['username'] for user in body['users']], [profile.username for profile in profiles])
+        self.assertEqual(body['not_found'], ['nobody'])
+        with self.assertNumQueries(0):
+            cached = self.client.post('/api/user-profiles/bulk/', {
+                'usernames': [profile.username for profile in profiles]
+            }, content_type='application/json')
+        self.assertEqual(cached.json()['users'], body['users'])
+
+    def test_bulk_user_profiles_field_selection_skips_prefetches(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/user-profiles/bulk/', {
+                'usernames': ','.join(profile.username for profile in self.profiles[:10]),
+                'fields': 'role,position',
+            })
+        users = response.json()['users']
+        self.assertEqual(set(users[0]), {'id', 'role', 'latest_location'})
+        self.assertIsNotNone(users[0]['latest_location'])
+        response = self.client.get('/api/user-profiles/bulk/', {'usernames': 'user1', 'fields': 'password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_login_writes_only_what_changed(self):
+        user = self.profile.user
+        user.set_password('Login12345')
+        user.save(update_fields=['password'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/login/', {'username': user.username, 'password': 'Login12345'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        writes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        # The session row is written once, with its data, rather than created empty and then updated
+        self.assertEqual(len([sql for sql in writes if 'django_session' in sql]), 1)
+        profile_update, = [sql for sql in writes if 'cityapp_userprofile' in sql]
+        self.assertIn('"last_active"', profile_update)
+        self.assertNotIn('"safety_score"', profile_update)
+
+    def test_user_activities_query_count(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/user-activities/', {'username': self.profile.username, 'limit': 20})
+        self.assertEqual(len(response.json()['activities']), 20)
+
+    def test_emergency_contacts_query_count(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/emergency-contacts/', {'username': self.profile.username})
+        self.assertEqual(len(response.json()['contacts']), 3)
+
+    def test_latest_positions_query_count(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/latest-positions/', {'role': 'police'})
+        self.assertEqual(response.json()['count'], SEED_USERS // 5)
+
+    def test_nearby_users_query_count(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/nearby-users/', {'lat': 13.01, 'lng': 80, 'radius_km': 1})
+        users = response.json()['users']
+        self.assertEqual(len(users), 17)
+        self.assertEqual(users[0]['username'], 'user10')
+
+
+class OfficerRosterTests(TestCase):
+    """Roster validation is served from the in-process copy and follows imports"""
+
+    def setUp(self):
+        officer_roster.invalidate()
+
+    def validate(self, police_id):
+        return self.client.post('/api/validate-police-id/', {'police_id': police_id},
+                                content_type='application/json').json()
+
+    def test_seeded_roster_is_validated_without_queries(self):
+        self.assertTrue(self.validate('TN001')['valid'])
+        with self.assertNumQueries(0):
+            body = self.validate('TN003')
+        self.assertEqual(body['officer']['rank'], 'Constable')
+        with self.assertNumQueries(0):
+            self.assertFalse(self.validate('TN999')['valid'])
+
+    def test_import_upserts_and_deactivates(self):
+        self.assertTrue(self.validate('TN002')['valid'])
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as roster_file:
+            roster_file.write('{"police_id": "CH100", "name": "Asha N", "rank": "Inspector", "district": "Chennai"}\n')
+            roster_file.write('{"police_id": "TN001", "name": "Rajesh Kumar", "rank": "Deputy Superintendent"}\n')
+            roster_file.write('{"police_id": "", "name": "No ID", "rank": "Constable"}\n')
+            roster_file.flush()
+            call_command('import_officer_roster', roster_file.name, '--deactivate-missing',
+                         stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(self.validate('CH100')['officer']['district'], 'Chennai')
+        self.assertEqual(self.validate('TN001')['officer']['rank'], 'Deputy Superintendent')
+        self.assertFalse(self.validate('TN002')['valid'])
+
+
+@override_settings(LOCATION_WRITE_BEHIND={'ENABLED': False}, ACTIVITY_LOG={'ENABLED': False})
+class OnboardingTests(TestCase):
+    """Onboarding writes everything in one request with a query count independent of the contact count"""
+
+    def onboard(self, username, contacts=0, **extra):
+        return self.client.post('/api/onboard/', {
+            'username': username,
+            'password': 'Onboard12345',
+            'phone': '+910000000001',
+            'emergency_contacts': [
+                {'name': f'Contact {i}', 'phone': f'+9199999999{i:02d}', 'relationship': 'Family'}
+                for i in range(contacts)
+            ],
+            'location': {'latitude': 13.0827, 'longitude': 80.2707, 'address': 'Chennai'},
+            **extra,
+        }, content_type='application/json')
+
+    def test_onboarding_query_count_does_not_grow_with_contacts(self):
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.onboard('alice', contacts=1).status_code, 200)
+        with CaptureQueriesContext(connection) as many:
+            response = self.onboard('bob', contacts=10)
+        self.assertEqual(len(many), len(few))
+        body = response.json()
+        self.assertEqual(len(body['emergency_contacts']), 10)
+        profile = UserProfile.objects.get(username='bob')
+        self.assertEqual(profile.emergency_contacts.count(), 10)
+        self.assertEqual(profile.current_position.address, 'Chennai')
+        self.assertTrue(self.client.login(username='bob', password='Onboard12345'))
+
+    def test_onboarding_conflicts_are_rejected_without_writes(self):
+        self.onboard('carol', role='police', police_id='TN004')
+        for username, police_id, message in [('carol', 'TN005', 'Username already exists'),
+                                             ('dave', 'TN004', 'Police ID already registered')]:
+            response = self.onboard(username, contacts=2, role='police', police_id=police_id)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['message'], message)
+        self.assertFalse(User.objects.filter(username='dave').exists())
+        self.assertEqual(EmergencyContact.objects.count(), 0)
+
+    @override_settings(LOCATION_WRITE_BEHIND={'ENABLED': True})
+    def test_initial_location_is_committed_with_the_account(self):
+        response = self.onboard('frank')
+
+        location = UserLocation.objects.get(user_profile__username='frank')
+        self.assertEqual(response.json()['location']['id'], str(location.id))
+        activity = UserActivity.objects.get(user_profile__username='frank', activity_type='location_updated')
+        self.assertEqual(activity.metadata, {'latitude': 13.0827, 'longitude': 80.2707})
+
+    def test_bulk_contact_upsert(self):
+        self.onboard('erin', contacts=3)
+        response = self.client.post('/api/emergency-contacts/', {
+            'username': 'erin',
+            'replace': True,
+            'contacts': [
+                {'name': 'Renamed', 'phone': '+919999999900', 'relationship': 'Friend'},
+                {'name': 'Contact 1', 'phone': '+919999999901', 'relationship': 'Family'},
+                {'name': 'New', 'phone': '+919999999999'},
+            ],
+        }, content_type='application/json')
+        body = response.json()
+        self.assertEqual((body['created'], body['updated'], body['removed']), (1, 1, 1))
+        self.assertEqual([contact['name'] for contact in body['contacts']], ['Renamed', 'Contact 1', 'New'])
+        self.assertEqual(body['contacts'][2]['relationship'], 'Emergency Contact')
+        profile = UserProfile.objects.get(username='erin')
+        self.assertEqual(profile.emergency_contacts.filter(is_active=True).count(), 3)
+
+
+@override_settings(SOS_QUEUE={'RUN_IN_PROCESS': False}, ACTIVITY_LOG={'ENABLED': False})
+class SOSQueueTests(TestCase):
+    """SOS requests are persisted immediately and delivered by workers with retries"""
+
+    def send_sos(self):
+        return self.client.post('/api/send-sos/', {
+            'username': 'walker', 'phone': '+910000000002', 'location': '13.0827, 80.2707'
+        }, content_type='application/json').json()
+
+    def status(self, sos_id):
+        return self.client.get('/api/sos-status/', {'sos_id': sos_id}).json()['sos']
+
+    def test_sos_is_queued_and_retried_until_delivered(self):
+        body = self.send_sos()
+        self.assertEqual((body['status'], body['delivery_status']), ('success', 'queued'))
+
+        outcomes = [RuntimeError('telegram down'), RuntimeError('telegram down'), None]
+
+        def send(dispatch):
+            outcome = outcomes.pop(0)
+            if outcome:
+                raise outcome
+
+        pool = SOSWorkerPool(send=send, backoff_base_seconds=10)
+        self.assertEqual(pool.process_due(), 1)
+        status = self.status(body['sos_id'])
+        self.assertEqual((status['status'], status['attempts'], status['last_error']), ('queued', 1, 'telegram down'))
+        # Backing off: nothing is due until the retry time passes
+        self.assertEqual(pool.process_due(), 0)
+        for _ in range(2):
+            SOSDispatch.objects.update(next_attempt_at=timezone.now())
+            pool.process_due()
+        status = self.status(body['sos_id'])
+        self.assertEqual((status['status'], status['attempts']), ('delivered', 3))
+
+    def test_sos_fails_after_max_attempts_and_expired_leases_are_reclaimed(self):
+        sos_id = self.send_sos()['sos_id']
+        SOSDispatch.objects.update(status='sending', lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        def send(dispatch):
+            raise RuntimeError('unreachable')
+
+        pool = SOSWorkerPool(send=send, max_attempts=1)
+        self.assertEqual(pool.process_due(), 1)
+        self.assertEqual(self.status(sos_id)['status'], 'failed')
+        self.assertEqual(self.client.get('/api/sos-status/', {'sos_id': 'nope'}).status_code, 400)
+
+
+class SlowNotifier(LocalNotifier):
+    """Local transport with provider-like latency"""
+
+    def send(self, address, message, kind=''):
+        time.sleep(0.2)
+        return super().send(address, message, kind)
+
+
+@override_settings(
+    NOTIFICATIONS={
+        'CONTACT_TRANSPORTS': ['local'],
+        'POLICE_TRANSPORT': 'local',
+        'TRANSPORTS': {'local': {'BACKEND': 'cityapp.tests.SlowNotifier', 'MAX_CONCURRENCY': 20}},
+    },
+    SOS_QUEUE={'RUN_IN_PROCESS': False},
+    ACTIVITY_LOG={'ENABLED': False},
+)
+class NotificationFanOutTests(TestCase):
+    """Alerts reach every emergency contact in parallel and each outcome is recorded"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='walker')
+        cls.profile = UserProfile.objects.create(user=user, username='walker', role='public')
+        EmergencyContact.objects.bulk_create([
+            EmergencyContact(user_profile=cls.profile, name=f'Contact {i}', phone=f'+91900000{i:04d}',
+                             relationship='Friend')
+            for i in range(10)
+        ])
+        EmergencyContact.objects.create(user_profile=cls.profile, name='Old', phone='+910000000000',
+                                        relationship='Friend', is_active=False)
+
+    def setUp(self):
+        self.center = NotificationCenter(notifications_config())
+
+    def test_contacts_are_loaded_in_one_query_and_sent_in_parallel(self):
+        with self.assertNumQueries(1):
+            recipients = self.center.contact_recipients(self.profile.id, 'help')
+        self.assertEqual(len(recipients), 10)
+
+        started = time.monotonic()
+        deliveries = self.center.fan_out(recipients, 'alert', user_profile_id=self.profile.id)
+        # Ten 200 ms sends one after another would take two seconds
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual({delivery.status for delivery in deliveries}, {'sent'})
+        self.assertEqual(NotificationDelivery.objects.filter(user_profile=self.profile, kind='alert').count(), 10)
+        self.assertEqual(self.center.snapshot()['local']['sent'], 10)
+
+    def test_sos_retry_only_resends_to_failed_recipients(self):
+        dispatch = enqueue_sos('walker', '+910000000002', '13.0827, 80.2707', user_profile=self.profile)
+        notifier = self.center.notifiers['local']
+        notifier.failing.add('+919000000003')
+        pool = SOSWorkerPool(send=functools.partial(deliver_sos, center=self.center), backoff_base_seconds=10)
+
+        pool.process_due()
+        dispatch.refresh_from_db()
+        self.assertEqual(dispatch.status, 'queued')
+        self.assertIn('+919000000003', dispatch.last_error)
+        self.assertEqual(len(notifier.outbox), 10)
+
+        notifier.failing.clear()
+        SOSDispatch.objects.update(next_attempt_at=timezone.now())
+        pool.process_due()
+        dispatch.refresh_from_db()
+        self.assertEqual(dispatch.status, 'delivered')
+        self.assertEqual(notifier.outbox[-1][0], '+919000000003')
+        self.assertEqual(len(notifier.outbox), 11)
+        self.assertEqual(dispatch.deliveries.filter(status='sent').count(), 11)
+
+    def test_fan_out_timeout_skips_unstarted_sends_but_waits_for_running_ones(self):
+        config = notifications_config()
+        config['FANOUT_TIMEOUT_SECONDS'] = 0.05
+        config['TRANSPORTS']['local']['MAX_CONCURRENCY'] = 1
+        center = NotificationCenter(config)
+
+        deliveries = center.fan_out(center.contact_recipients(self.profile.id, 'help')[:3], 'alert')
+
+        # The first send was under way at the timeout and went out, so it must not be retried
+        self.assertEqual([delivery.status for delivery in deliveries], ['sent', 'failed', 'failed'])
+        self.assertEqual(deliveries[1].error, 'Timed out before sending')
+        self.assertEqual(len(center.notifiers['local'].outbox), 1)
+
+    @override_settings(NOTIFICATIONS={'POLICE_TRANSPORT': 'local'})
+    def test_contacts_without_an_sms_gateway_are_recorded_as_unconfigured(self):
+        center = NotificationCenter(notifications_config())
+        dispatch = enqueue_sos('walker', '+910000000002', '13.0827, 80.2707', user_profile=self.profile)
+
+        deliver_sos(dispatch, center=center)
+
+        statuses = Counter(dispatch.deliveries.values_list('status', flat=True))
+        self.assertEqual(statuses, {'sent': 1, 'unconfigured': 10})
+        self.assertEqual(len(center.notifiers['local'].outbox), 1)
+
+    def test_safety_alert_is_queued_and_sent_to_contacts_only(self):
+        response = self.client.post('/api/send-alert/', {
+            'username': 'walker', 'location': '13.0827, 80.2707', 'contacts': ['+919999999999']
+        }, content_type='application/json').json()
+
+        self.assertEqual((response['status'], response['delivery_status']), ('success', 'queued'))
+        self.assertEqual(NotificationDelivery.objects.count(), 0)
+        dispatch = SOSDispatch.objects.get(id=response['alert_id'])
+        self.assertEqual(dispatch.kind, 'safety')
+
+        SOSWorkerPool(send=functools.partial(deliver_sos, center=self.center)).process_due()
+        addresses = {address for address, _ in self.center.notifiers['local'].outbox}
+        # Stored contacts win over the numbers the client sent; the police channel is not involved
+        self.assertEqual(len(addresses), 10)
+        self.assertNotIn('+919999999999', addresses)
+        self.assertEqual(set(dispatch.deliveries.values_list('kind', 'status')), {('alert', 'sent')})
+
+
+@override_settings(
+    NOTIFICATIONS={'CONTACT_TRANSPORTS': ['local'], 'POLICE_TRANSPORT': 'local'},
+    SOS_QUEUE={'RUN_IN_PROCESS': False, 'DIGEST_THRESHOLD': 3},
+    ACTIVITY_LOG={'ENABLED': False},
+)
+class SOSCoalescingTests(TestCase):
+    """Retries, repeats and area-wide storms do not turn into one police message per request"""
+
+    def send_sos(self, username='walker', location='13.0827, 80.2707', **extra):
+        return self.client.post('/api/send-sos/', {
+            'username': username, 'phone': '+910000000002', 'location': location, **extra
+        }, content_type='application/json').json()
+
+    def test_idempotency_key_returns_the_original_sos(self):
+        first = self.send_sos(idempotency_key='tap-1')
+        retry = self.send_sos(idempotency_key='tap-1')
+        self.assertEqual((first['outcome'], retry['outcome']), ('queued', 'duplicate'))
+        self.assertEqual(retry['sos_id'], first['sos_id'])
+        self.assertEqual(SOSDispatch.objects.count(), 1)
+
+    def test_keys_of_repeats_are_kept_in_the_database(self):
+        first = self.send_sos(idempotency_key='tap-1')
+        repeat = self.send_sos(idempotency_key='tap-2')
+        # Another process would not share this cache; the key must still be recognised
+        cache.clear()
+        replay = self.send_sos(idempotency_key='tap-2')
+
+        self.assertEqual([first['outcome'], repeat['outcome'], replay['outcome']], ['queued', 'coalesced', 'duplicate'])
+        self.assertEqual(SOSDispatch.objects.get(id=first['sos_id']).repeat_count, 1)
+        # A second undelivered alert for the same user is refused by the database itself
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            enqueue_sos('walker', '+910000000002', '13.0827, 80.2707')
+
+    def test_undelivered_alert_absorbs_repeats_after_the_dedupe_window(self):
+        sos_id = self.send_sos()['sos_id']
+        SOSDispatch.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(self.send_sos()['outcome'], 'coalesced')
+        self.assertEqual(SOSDispatch.objects.get().id, UUID(sos_id))
+
+    def test_repeats_refresh_the_alert_then_coalesce_into_one_update(self):
+        sos_id = self.send_sos()['sos_id']
+        self.assertEqual(self.send_sos(location='13.0830, 80.2710')['outcome'], 'coalesced')
+        alert = SOSDispatch.objects.get(id=sos_id)
+        # Not sent yet, so the one alert simply carries the latest location
+        self.assertEqual((alert.location, alert.repeat_count), ('13.0830, 80.2710', 1))
+
+        SOSWorkerPool(send=lambda dispatch: None).process_due()
+        for location in ('13.0840, 80.2720', '13.0850, 80.2730'):
+            self.assertEqual(self.send_sos(location=location)['sos_id'], sos_id)
+        update = SOSDispatch.objects.get(kind='update')
+        self.assertEqual((update.parent_id, update.location, update.repeat_count), (alert.id, '13.0850, 80.2730', 2))
+        # Held back until the update interval since the alert has passed
+        self.assertGreater(update.next_attempt_at, alert.created_at + timedelta(seconds=59))
+        self.assertEqual(SOSDispatch.objects.count(), 2)
+
+    def test_many_alerts_from_one_area_share_a_digest(self):
+        for i in range(5):
+            self.send_sos(username=f'walker{i}', location=f'13.08{i}, 80.27{i}')
+        alerts = SOSDispatch.objects.filter(kind='alert').order_by('created_at')
+        digest = SOSDispatch.objects.get(kind='digest')
+        # The alert that reaches the threshold still goes out on its own; later ones join the digest
+        self.assertEqual([alert.parent_id for alert in alerts], [None, None, None, digest.id, digest.id])
+
+        center = NotificationCenter(notifications_config())
+        deliver_sos(digest, center=center)
+        for alert in alerts:
+            deliver_sos(alert, center=center)
+        police_messages = [message for _, message in center.notifiers['local'].outbox]
+        # Three individual alerts, then one digest for the other two
+        self.assertEqual(len(police_messages), 4)
+        self.assertIn('2 users raised SOS', police_messages[0])
+        self.assertIn('walker4', police_messages[0])
+
+
+class FakeTelegramResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.text = str(body)
+
+    def json(self):
+        return self.body
+
+
+class TelegramSenderTests(TestCase):
+    """The Telegram queue paces sends, puts SOS first, merges chatter and honours retry_after"""
+
+    def test_sos_goes_first_and_informational_messages_are_merged(self):
+        posts = []
+
+        def post(chat_id, text):
+            posts.append((chat_id, text))
+            return FakeTelegramResponse(200, {'result': {'message_id': len(posts)}})
+
+        sender = TelegramSender(post=post, chat_rate_per_second=50, autostart=False)
+        info = [sender.send('police', f'info {i}') for i in range(3)]
+        sos = sender.send('police', 'SOS!', PRIORITY_SOS)
+        sender.start()
+        self.assertEqual(sos.result(timeout=5), '1')
+        self.assertEqual({future.result(timeout=5) for future in info}, {'2'})
+        sender.stop()
+
+        self.assertEqual(posts[0], ('police', 'SOS!'))
+        self.assertEqual([line for line in posts[1][1].split('\n') if line.startswith('info')],
+                         ['info 0', 'info 1', 'info 2'])
+        stats = sender.snapshot()
+        self.assertEqual((stats['sent'], stats['requests'], stats['merged']), (4, 2, 2))
+        self.assertEqual(stats['queue_latency']['count'], 4)
+
+    def test_rate_limits_and_retry_after(self):
+        responses = [FakeTelegramResponse(429, {'ok': False, 'parameters': {'retry_after': 0.3}})]
+        sent_at = []
+
+        def post(chat_id, text):
+            sent_at.append((chat_id, time.monotonic()))
+            return responses.pop(0) if responses and chat_id == 'busy' else FakeTelegramResponse(200, {})
+
+        sender = TelegramSender(post=post, global_rate_per_second=20, global_burst=1)
+        started = time.monotonic()
+        retried = sender.send('busy', 'SOS!', PRIORITY_SOS)
+        others = [sender.send(f'chat{i}', 'hello', PRIORITY_SOS) for i in range(6)]
+        retried.result(timeout=5)
+        for future in others:
+            future.result(timeout=5)
+        sender.stop()
+
+        # Seven messages plus one retry at 20/s with no burst take at least 0.35 s
+        self.assertGreaterEqual(sent_at[-1][1] - started, 0.3)
+        busy = [at for chat_id, at in sent_at if chat_id == 'busy']
+        self.assertEqual(len(busy), 2)
+        self.assertGreaterEqual(busy[1] - busy[0], 0.3)
+        self.assertEqual(sender.snapshot()['rate_limited'], 1)
+
+    def test_messages_not_sent_in_time_are_dropped(self):
+        sender = TelegramSender(post=lambda chat_id, text: FakeTelegramResponse(200, {}),
+                                chat_rate_per_second=0.1, chat_burst=1)
+        sender.send('police', 'first').result(timeout=5)
+        late = sender.send('police', 'second', max_wait=0.2)
+        with self.assertRaises(Exception):
+            late.result(timeout=5)
+        sender.stop()
+        self.assertEqual(sender.snapshot()['expired'], 1)
+
+
+@override_settings(LOCATION_WRITE_BEHIND={'ENABLED': False}, ACTIVITY_LOG={'ENABLED': False},
+                   SOS_QUEUE={'RUN_IN_PROCESS': False}, TRAJECTORY_FILTER={'ENABLED': False})
+class DispatchIndexTests(TestCase):
+    """Nearest-unit lookup over the in-memory officer grid"""
+
+    def test_nearest_orders_by_distance_and_skips_stale_and_unavailable_officers(self):
+        index = OfficerPositionIndex()
+        index._loaded = True
+        now = time.time()
+        index.update('a', 'near', 13.0830, 80.2710, updated_at=now)
+        index.update('b', 'far', 13.1500, 80.3000, updated_at=now)
+        index.update('c', 'busy', 13.0828, 80.2708, available=False, updated_at=now)
+        index.update('d', 'stale', 13.0827, 80.2707, updated_at=now - index.max_age_seconds - 1)
+        index.update('e', 'middle', 13.1000, 80.2800, updated_at=now)
+
+        self.assertEqual([p.username for _, p in index.nearest(13.0827, 80.2707, k=2)], ['near', 'middle'])
+        self.assertEqual([p.username for _, p in index.nearest(13.0827, 80.2707, k=10)], ['near', 'middle', 'far'])
+        self.assertEqual(index.nearest(13.0827, 80.2707, k=0), [])
+        # A late fix never moves an officer backwards
+        index.update('a', 'near', 14.0, 81.0, updated_at=now - 60)
+        self.assertEqual(index.nearest(13.0827, 80.2707, k=1)[0][1].lat, 13.0830)
+
+    def test_ensure_loaded_warms_the_index_from_recent_police_locations(self):
+        now = timezone.now()
+        for name, role, minutes_ago in (('officer', 'police', 1), ('old', 'police', 60), ('citizen', 'public', 1)):
+            profile = UserProfile.objects.create(user=User.objects.create(username=name), username=name, role=role)
+            UserLocation.objects.create(user_profile=profile, latitude=13.08, longitude=80.27,
+                                        timestamp=now - timedelta(minutes=minutes_ago))
+        index = OfficerPositionIndex()
+        self.assertEqual([p.username for _, p in index.nearest(13.08, 80.27, k=5)], ['officer'])
+
+    def test_sos_units_and_availability_are_validated(self):
+        def send(units):
+            return self.client.post('/api/send-sos/', {
+                'username': 'walker', 'phone': '+910000000002', 'location': '13.0827, 80.2707', 'units': units
+            }, content_type='application/json')
+
+        self.assertEqual(send(0).status_code, 200)
+        self.assertEqual(send(-5).status_code, 200)
+        self.assertEqual(send('many').status_code, 400)
+
+        profile = UserProfile.objects.create(user=User.objects.create(username='unit1'), username='unit1',
+                                             role='police')
+        self.addCleanup(officer_index.remove, profile.id)
+        for available, expected in (('false', False), (True, True), ('maybe', None)):
+            response = self.client.post('/api/update-location/', {
+                'username': 'unit1', 'latitude': 13.08, 'longitude': 80.27, 'available': available
+            }, content_type='application/json')
+            if expected is None:
+                self.assertEqual(response.status_code, 400)
+            else:
+                self.assertEqual(officer_index._positions[str(profile.id)].available, expected)
+
+
+    @override_settings(NOTIFICATIONS={'CONTACT_TRANSPORTS': ['local'], 'POLICE_TRANSPORT': 'local'})
+    def test_sos_is_accepted_without_waiting_for_road_routing(self):
+        officer_index.update('unit9', 'unit9', 13.0830, 80.2710)
+        self.addCleanup(officer_index.remove, 'unit9')
+        released = threading.Event()
+        self.addCleanup(released.set)
+
+        def hanging_travel_times(origin, destinations, max_timeout=3):
+            released.wait(5)
+            raise RuntimeError('routing down')
+
+        with mock.patch('cityapp.dispatch.get_travel_times', side_effect=hanging_travel_times) as travel:
+            started = time.monotonic()
+            body = self.client.post('/api/send-sos/', {
+                'username': 'walker', 'phone': '+910000000002', 'location': '13.0827, 80.2707'
+            }, content_type='application/json').json()
+
+            self.assertLess(time.monotonic() - started, 1.0)
+            travel.assert_not_called()
+            self.assertEqual([unit['eta_source'] for unit in body['nearest_units']], ['straight_line'])
+
+            # The worker asks for road ETAs before sending and keeps the straight-line units when that fails
+            released.set()
+            center = NotificationCenter(notifications_config())
+            dispatch = SOSDispatch.objects.get(id=body['sos_id'])
+            dispatch.attempts = 1
+            deliver_sos(dispatch, center=center)
+            travel.assert_called_once()
+        self.assertIn('unit9', center.notifiers['local'].outbox[0][1])
+
+
+class FakeRouteResolver(RouteBatchResolver):
+    """Resolver with canned geocodes and routes; ``slow`` places take longer to geocode"""
+
+    places = {'chennai': (13.08, 80.27), 'chennai india': (13.08, 80.27), 'madurai': (9.93, 78.12),
+              'nowhere road': (1.0, 1.0)}
+    slow = {'chennai india'}
+
+    def __init__(self, pairs):
+        super().__init__(pairs)
+        self.route_calls = []
+
+    def _geocode(self, place):
+        time.sleep(0.2 if place in self.slow else 0.01)
+        return self.places.get(place)
+
+    def _route(self, src, dest):
+        self.route_calls.append((src, dest))
+        if dest == (1.0, 1.0):
+            raise RuntimeError('no route')
+        return [[src[1], src[0]], [dest[1], dest[0]]]
+
+
+class RouteBatchResolverTests(TestCase):
+    """Batch routing shares lookups between pairs and reports every pair exactly once"""
+
+    def test_duplicate_pairs_share_geocode_and_route_lookups(self):
+        resolver = FakeRouteResolver([{'id': i, 'source': 'Chennai', 'destination': ' madurai '} for i in range(3)])
+        results = list(resolver.results())
+        self.assertEqual(sorted(result['id'] for result in results), [0, 1, 2])
+        self.assertEqual({result['status'] for result in results}, {'success'})
+        self.assertEqual((resolver.stats['geocode_lookups'], resolver.stats['route_lookups']), (2, 1))
+
+    def test_late_geocode_joins_a_finished_route(self):
+        resolver = FakeRouteResolver([
+            {'id': 'fast', 'source': 'Chennai', 'destination': 'Madurai'},
+            {'id': 'slow', 'source': 'chennai india', 'destination': 'Madurai'},
+        ])
+        results = list(resolver.results())
+        self.assertEqual(sorted(result['id'] for result in results), ['fast', 'slow'])
+        self.assertEqual({result['status'] for result in results}, {'success'})
+        self.assertEqual(len(resolver.route_calls), 1)
+
+    def test_errors_are_reported_per_pair(self):
+        resolver = FakeRouteResolver([
+            {'id': 'ok', 'source': [13.08, 80.27], 'destination': 'Madurai'},
+            {'id': 'bad', 'source': '', 'destination': 'Madurai'},
+            {'id': 'unknown', 'source': 'Atlantis', 'destination': 'Madurai'},
+            {'id': 'unroutable', 'source': 'Chennai', 'destination': 'nowhere road'},
+        ])
+        results = {result['id']: result for result in resolver.results()}
+        self.assertEqual({key: result['status'] for key, result in results.items()},
+                         {'ok': 'success', 'bad': 'error', 'unknown': 'error', 'unroutable': 'error'})
+        self.assertIn('no route', results['unroutable']['message'])
+
+
+class UpstreamGuardTests(TestCase):
+    """Circuit breakers, hedged requests and request deadlines around upstream calls"""
+
+    def test_breaker_opens_after_failures_and_recovers_through_one_probe(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        # Half-open: exactly one probe goes through
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        service = UpstreamService('test', timeout=1, failure_threshold=1, reset_timeout=60)
+
+        def fail(timeout):
+            raise RuntimeError('down')
+
+        self.assertEqual(service.call(fail, fallback=lambda: 'fallback'), 'fallback')
+        calls = []
+        self.assertEqual(service.call(lambda timeout: calls.append(timeout), fallback=lambda: 'open'), 'open')
+        self.assertEqual(calls, [])
+        with self.assertRaises(CircuitOpenError):
+            service.call(lambda timeout: 'ok')
+
+    def test_slow_request_is_hedged_after_the_p95(self):
+        service = UpstreamService('hedged', timeout=2, hedge=True)
+        service._latencies.extend([0.01] * 20)
+        attempts = []
+
+        def fetch(timeout):
+            attempts.append(timeout)
+            # The first attempt stalls; the hedge answers quickly
+            time.sleep(1.0 if len(attempts) == 1 else 0.01)
+            return len(attempts)
+
+        started = time.monotonic()
+        self.assertEqual(service.call(fetch), 2)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_deadline_bounds_timeouts_in_worker_threads_and_forces_fallback(self):
+        service = UpstreamService('deadline', timeout=5)
+        with deadline_scope(0.5):
+            self.assertLessEqual(service.call(lambda timeout: timeout), 0.5)
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                self.assertLessEqual(submit_with_context(executor, remaining_budget).result(), 0.5)
+            time.sleep(0.51)
+            self.assertEqual(service.call(lambda timeout: 'late', fallback=lambda: 'fallback'), 'fallback')
+            with self.assertRaises(DeadlineExceeded):
+                service.call(lambda timeout: 'late')
+
+    def test_client_budget_header_is_clamped(self):
+        from .middleware import MIN_CLIENT_BUDGET_SECONDS, UpstreamDeadlineMiddleware
+
+        seen = []
+        middleware = UpstreamDeadlineMiddleware(lambda request: seen.append(remaining_budget()))
+        for header in ('0', '5', 'junk'):
+            request = type('Request', (), {'headers': {'X-Request-Timeout-Ms': header}})()
+            middleware(request)
+        self.assertGreater(seen[0], MIN_CLIENT_BUDGET_SECONDS - 0.1)
+        self.assertGreater(seen[1], MIN_CLIENT_BUDGET_SECONDS - 0.1)
+        self.assertGreater(seen[2], 5)
+
+
+    def test_streamed_batch_routes_keep_the_request_deadline(self):
+        budgets = []
+
+        def route(*coords):
+            budgets.append(remaining_budget())
+            return [[coords[1], coords[0]], [coords[3], coords[2]]]
+
+        with mock.patch('cityapp.routing.get_route_coords', side_effect=route):
+            response = self.client.post('/api/route/batch/', {'pairs': [
+                {'id': 'a', 'source': [13.08, 80.27], 'destination': [13.00, 80.22]},
+                {'id': 'b', 'source': [12.97, 77.59], 'destination': [13.00, 80.22]},
+            ]}, content_type='application/json', headers={'X-Request-Timeout-Ms': '3000'})
+            self.assertIsNone(remaining_budget())
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([line['status'] for line in lines], ['success', 'success', 'complete'])
+        # The routes are looked up while the body streams, in worker threads, after the view returned
+        self.assertEqual(len(budgets), 2)
+        self.assertTrue(all(budget is not None and 0 < budget <= 3 for budget in budgets), budgets)
+        self.assertIsNone(remaining_budget())
+
+class HttpClientTests(TestCase):
+    """Per-thread sessions over connection pools shared by the whole process"""
+
+    def setUp(self):
+        for name, value in (('_adapters', {}), ('_local', threading.local()), ('_http2_checked', False)):
+            patcher = mock.patch.object(http_client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def sessions_from_threads(self, n):
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            barrier = threading.Barrier(n)
+
+            def session():
+                # Keep every worker alive until all have asked, so no thread is reused
+                first = http_client.get_session()
+                barrier.wait()
+                return first, http_client.get_session()
+            return list(pool.map(lambda _: session(), range(n)))
+
+    def test_each_thread_gets_its_own_session_on_shared_adapters(self):
+        pairs = self.sessions_from_threads(4)
+        sessions = [first for first, _ in pairs]
+        self.assertTrue(all(first is again for first, again in pairs))
+        self.assertEqual(len({id(session) for session in sessions}), 4)
+
+        osrm = {id(session.get_adapter('http://router.project-osrm.org/route/v1/driving/x')) for session in sessions}
+        other = {id(session.get_adapter('https://example.com/')) for session in sessions}
+        self.assertEqual((len(osrm), len(other)), (1, 1))
+        self.assertNotEqual(osrm, other)
+
+        adapter = sessions[0].get_adapter('http://router.project-osrm.org/route')
+        self.assertEqual(adapter._pool_maxsize, http_client.DEFAULT_HOST_POOLS['http://router.project-osrm.org/'])
+        self.assertEqual(adapter.max_retries.total, 0)
+        self.assertEqual(sessions[0].headers['User-Agent'], http_client.USER_AGENT)
+
+    @override_settings(OUTBOUND_HTTP_POOLS={'https://api.telegram.org/': 3}, OUTBOUND_HTTP_POOL_MAXSIZE=5)
+    def test_pool_sizes_follow_settings(self):
+        session = http_client.get_session()
+        self.assertEqual(session.get_adapter('https://api.telegram.org/bot/x')._pool_maxsize, 3)
+        self.assertEqual(session.get_adapter('https://example.com/')._pool_maxsize, 5)
+
+    @override_settings(OUTBOUND_HTTP2_ENABLED=True)
+    def test_http2_falls_back_to_http1_without_h2(self):
+        with mock.patch.dict('sys.modules', {'h2': None}), \
+                mock.patch('urllib3.http2.inject_into_urllib3') as inject, \
+                self.assertLogs('cityapp.http_client', level='WARNING'):
+            session = http_client.get_session()
+        inject.assert_not_called()
+        self.assertIsNotNone(session.get_adapter('https://example.com/'))
+
+    @override_settings(OUTBOUND_HTTP2_ENABLED=True)
+    def test_http2_is_injected_once_when_h2_is_available(self):
+        with mock.patch.dict('sys.modules', {'h2': mock.MagicMock()}), \
+                mock.patch('urllib3.http2.inject_into_urllib3') as inject:
+            self.sessions_from_threads(3)
+        inject.assert_called_once_with()
+
+
+@override_settings(TRAJECTORY_FILTER={'ENABLED': False}, ACTIVITY_LOG={'ENABLED': False},
+                   LOCATION_TRACK_STORE={'ENABLED': False})
+class BatchLocationIngestTests(TestCase):
+    """Bulk uploads keep the good fixes of a partly bad batch and resolve out-of-order fixes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('walker', 'runner'):
+            UserProfile.objects.create(user=User.objects.create(username=name), username=name, role='public')
+
+    def upload(self, fixes, **extra):
+        return self.client.post('/api/update-location/batch/', {'fixes': fixes, **extra},
+                                content_type='application/json').json()
+
+    def test_bad_fixes_are_rejected_individually(self):
+        base = timezone.now() - timedelta(hours=1)
+        body = self.upload([
+            {'latitude': 13.08, 'longitude': 80.27, 'timestamp': base.isoformat()},
+            {'latitude': 200, 'longitude': 80.27},
+            {'username': 'ghost', 'latitude': 13.08, 'longitude': 80.27},
+            {'latitude': 13.00, 'longitude': 80.20, 'timestamp': (base - timedelta(minutes=30)).isoformat()},
+            {'latitude': 13.08},
+            {'latitude': 13.08, 'longitude': 80.27, 'timestamp': 'yesterday'},
+            {'username': 'runner', 'latitude': 12.9, 'longitude': 80.1,
+             'timestamp': int((base + timedelta(minutes=5)).timestamp() * 1000)},
+        ], username='walker')
+
+        self.assertEqual((body['status'], body['accepted'], body['stored']), ('success', 3, 3))
+        self.assertEqual([item['index'] for item in body['rejected']], [1, 2, 4, 5])
+        self.assertEqual(UserLocation.objects.count(), 3)
+        # One activity row per user, not per fix
+        self.assertEqual(UserActivity.objects.filter(activity_type='location_updated').count(), 2)
+
+    def test_latest_position_follows_timestamps_not_upload_order(self):
+        base = timezone.now() - timedelta(hours=1)
+        fixes = [{'latitude': 13.0 + i / 100, 'longitude': 80.2, 'timestamp': (base + timedelta(minutes=i)).isoformat()}
+                 for i in (3, 1, 4, 2)]
+        # Clocks running far ahead are clamped to the time of upload
+        fixes.append({'latitude': 14.0, 'longitude': 80.2, 'timestamp': (timezone.now() + timedelta(days=1)).isoformat()})
+        body = self.upload(fixes, username='walker')
+        self.assertEqual(body['latest']['walker']['latitude'], 14.0)
+        self.assertLessEqual(parse_datetime(body['latest']['walker']['timestamp']), timezone.now())
+
+        body = self.upload(fixes[:4], username='walker')
+        self.assertEqual(body['latest']['walker']['latitude'], 13.04)
+        # An older upload never moves the current position backwards
+        self.assertEqual(float(CurrentPosition.objects.get(user_profile__username='walker').latitude), 14.0)
+
+        all_bad = self.upload([{'latitude': 'x', 'longitude': 1}], username='walker')
+        self.assertEqual((all_bad['accepted'], len(all_bad['rejected'])), (0, 1))
+
+    @override_settings(TRAJECTORY_FILTER={'ENABLED': True})
+    def test_activity_keeps_coordinates_of_fixes_that_are_not_stored(self):
+        base = timezone.now() - timedelta(hours=1)
+        fixes = [{'latitude': 13.0827, 'longitude': 80.2707, 'timestamp': (base + timedelta(seconds=i)).isoformat()}
+                 for i in range(5)]
+        body = self.upload(fixes, username='walker')
+        self.assertLess(body['stored'], body['accepted'])
+
+        activity = UserActivity.objects.get(activity_type='location_updated')
+        self.assertEqual((activity.metadata['latitude'], activity.metadata['longitude']), (13.0827, 80.2707))
+        self.assertNotIn('location_id', activity.metadata)
+
+
+class WriteBehindTests(TestCase):
+    """The write-behind buffer pushes back when full, flushes on shutdown and isolates bad rows"""
+
+    def test_full_queue_rejects_and_shutdown_flushes_everything(self):
+        flushed, release = [], threading.Event()
+
+        def flush(batch):
+            release.wait(5)
+            flushed.extend(batch)
+
+        buffer = WriteBehindBuffer('test_backpressure', flush, max_queue=2, flush_interval_ms=10, put_timeout_ms=10)
+        self.assertTrue(buffer.submit(1))
+        time.sleep(0.1)
+        # The flusher is stuck writing item 1; two more fill the queue and the next is refused
+        self.assertTrue(buffer.submit(2))
+        self.assertTrue(buffer.submit(3))
+        self.assertFalse(buffer.submit(4))
+        self.assertEqual(buffer.snapshot()['rejected'], 1)
+
+        release.set()
+        buffer.stop()
+        self.assertEqual(sorted(flushed), [1, 2, 3])
+        self.assertEqual(buffer.snapshot()['queue_depth'], 0)
+
+    def test_failed_batch_is_retried_row_by_row(self):
+        flushed = []
+
+        def flush(batch):
+            if 'bad' in batch:
+                raise ValueError('bad row')
+            flushed.extend(batch)
+
+        buffer = WriteBehindBuffer('test_fallback', flush)
+        for item in ('a', 'bad', 'b'):
+            buffer._queue.put(item)
+        with self.assertLogs('cityapp.write_behind', level='WARNING') as logs:
+            buffer.flush()
+        self.assertEqual(flushed, ['a', 'b'])
+        self.assertEqual([record.levelname for record in logs.records], ['WARNING', 'ERROR'])
+        self.assertEqual((buffer.stats['flushed'], buffer.stats['failed']), (2, 1))
+
+    @override_settings(LOCATION_WRITE_BEHIND={'ENABLED': False}, TRAJECTORY_FILTER={'ENABLED': False},
+                       ACTIVITY_LOG={'ENABLED': False})
+    def test_synchronous_fallback_writes_the_location_and_its_activity(self):
+        UserProfile.objects.create(user=User.objects.create(username='walker'), username='walker', role='public')
+        body = self.client.post('/api/update-location/', {
+            'username': 'walker', 'latitude': 13.0827, 'longitude': 80.2707, 'address': 'Chennai'
+        }, content_type='application/json').json()
+        self.assertEqual((body['queued'], body['location']['provisional']), (False, False))
+
+        activity = UserActivity.objects.get(activity_type='location_updated')
+        self.assertEqual(activity.metadata, {'latitude': 13.0827, 'longitude': 80.2707})
+        self.assertTrue(UserLocation.objects.filter(id=body['location']['id']).exists())
+        # Rollups place the activity in its cell from the coordinates in its metadata
+        self.assertTrue(ActivityRollup.objects.filter(activity_type='location_updated',
+                                                      cell=geohash_encode(13.0827, 80.2707, 5)).exists())
+
+
+@override_settings(LOCATION_WRITE_BEHIND={'ENABLED': False}, ACTIVITY_LOG={'ENABLED': False})
+class CompactLocationsTests(TestCase):
+    def setUp(self):
+        self.profile = UserProfile.objects.create(
+            user=User.objects.create(username='walker'), username='walker', role='public'
+        )
+        # Three fixes a minute apart in each of two ten-minute windows, well past the minute tier
+        start = timezone.now() - timedelta(days=60)
+        start -= timedelta(seconds=int(start.timestamp()) % 600)
+        self.times = [start + timedelta(minutes=offset) for offset in (0, 1, 2, 10, 11, 12)]
+        UserLocation.objects.bulk_create([
+            UserLocation(user_profile=self.profile, latitude=13 + i / 1000, longitude=80, timestamp=timestamp)
+            for i, timestamp in enumerate(self.times)
+        ])
+
+    def compact(self, *args):
+        out = io.StringIO()
+        call_command('compact_locations', '--pause-ms', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def remaining(self):
+        return list(UserLocation.objects.filter(user_profile=self.profile)
+                    .order_by('timestamp').values_list('timestamp', flat=True))
+
+    def test_dry_run_leaves_data_intact(self):
+        output = self.compact('--dry-run')
+
+        self.assertIn('3 of 6 fixes', output)
+        self.assertEqual(self.remaining(), self.times)
+
+    def test_downsample_keeps_first_of_each_bucket_and_last_of_window(self):
+        self.compact()
+
+        self.assertEqual(self.remaining(), [self.times[0], self.times[3], self.times[5]])
+
+
+def offset(lat, lng, north_m=0, east_m=0):
+    """Move a point by metres; plenty accurate at city scale"""
+    return lat + north_m / 111195, lng + east_m / (111195 * math.cos(math.radians(lat)))
+
+
+class TrajectoryFilterTests(TestCase):
+    origin = (13.0827, 80.2707)
+
+    def setUp(self):
+        self.filter = TrajectoryFilter()
+
+    def store(self, north_m, east_m, t, role='public', accuracy=None):
+        lat, lng = offset(*self.origin, north_m=north_m, east_m=east_m)
+        return self.filter.should_store('walker', role, lat, lng, t, accuracy=accuracy)
+
+    def test_first_fix_is_stored(self):
+        self.assertTrue(self.store(0, 0, 0))
+        self.assertFalse(self.store(5, 0, 5))
+
+    def test_fix_after_max_interval_is_stored(self):
+        self.store(0, 0, 0)
+
+        self.assertFalse(self.store(1, 0, 60))
+        self.assertTrue(self.store(1, 0, 120))
+
+    def test_accuracy_raises_the_noise_floor(self):
+        self.store(0, 0, 0)
+
+        self.assertFalse(self.store(50, 0, 10, accuracy=80))
+        self.assertTrue(self.store(50, 0, 20, accuracy=10))
+
+    def test_straight_walk_is_dead_reckoned_and_turns_are_kept(self):
+        for second in range(0, 45, 5):
+            self.store(1.5 * second, 0, second)
+        stored = self.filter.stats['stored']
+
+        self.assertFalse(self.store(1.5 * 60, 0, 60))
+        self.assertEqual(self.filter.stats['stored'], stored)
+        # Heading east from the last point instead of carrying on north
+        self.assertTrue(self.store(1.5 * 45, 40, 70))
+
+    def test_synthetic_track_stores_a_fraction_of_the_fixes(self):
+        """Backs the storage reduction quoted for the filter: 10 min each of standing, walking, turning, standing"""
+        track = []
+        for second in range(0, 600, 5):
+            track.append((3 if second % 10 else -3, 0, second))
+        for second in range(0, 600, 5):
+            track.append((1.5 * second, 0, 600 + second))
+        for second in range(0, 600, 5):
+            track.append((900, 1.5 * second, 1200 + second))
+        for second in range(0, 600, 5):
+            track.append((900, 900, 1800 + second))
+
+        stored = [t for north, east, t in track if self.store(north, east, t)]
+
+        self.assertEqual(self.filter.stats['received'], len(track))
+        self.assertLessEqual(len(stored) * 9, len(track))
+        # The turn at 20 minutes and the stop at 30 minutes both survive
+        self.assertTrue(any(1200 <= t <= 1240 for t in stored), stored)
+        self.assertTrue(any(1800 <= t <= 1840 for t in stored), stored)
+
+
+@override_settings(LOCATION_WRITE_BEHIND={'ENABLED': False}, ACTIVITY_LOG={'ENABLED': False})
+class TrackStoreTests(TestCase):
+    day = timezone.now().date() - timedelta(days=2)
+
+    def setUp(self):
+        self.profile = UserProfile.objects.create(
+            user=User.objects.create(username='walker'), username='walker', role='public'
+        )
+        start = datetime.combine(self.day, dt_time.min, tzinfo=dt_timezone.utc)
+        self.fixes = [
+            (start + timedelta(hours=1), 13.0827, 80.2707, 5.0),
+            (start + timedelta(hours=1, seconds=7), 13.082812, 80.270655, None),
+            (start + timedelta(hours=23, minutes=59), -12.5, -0.000001, 1234.5),
+        ]
+
+    def test_round_trip_through_both_decoders(self):
+        track = TrackDay(user_profile=self.profile, day=self.day, data=encode_points(self.day, self.fixes))
+        expected_times = [int(timestamp.timestamp()) for timestamp, _, _, _ in self.fixes]
+
+        points = decode_points(track)
+        self.assertEqual([point['timestamp'] for point in points], expected_times)
+        self.assertEqual([(point['latitude'], point['longitude'], point['accuracy']) for point in points],
+                         [(lat, lng, accuracy) for _, lat, lng, accuracy in self.fixes])
+
+        arrays = decode_day(track)
+        self.assertEqual(arrays['timestamp'].tolist(), expected_times)
+        self.assertEqual(arrays['latitude'].tolist(), [lat for _, lat, _, _ in self.fixes])
+        self.assertEqual(arrays['longitude'].tolist(), [lng for _, _, lng, _ in self.fixes])
+        self.assertEqual(arrays['accuracy'][[0, 2]].tolist(), [5.0, 1234.5])
+        self.assertTrue(math.isnan(arrays['accuracy'][1]))
+
+    def test_pack_day_writes_each_track_once_in_time_order(self):
+        UserLocation.objects.bulk_create([
+            UserLocation(user_profile=self.profile, latitude=lat, longitude=lng, accuracy=accuracy, timestamp=timestamp)
+            for timestamp, lat, lng, accuracy in reversed(self.fixes)
+        ])
+        # Fixes from the neighbouring days stay out of the track
+        UserLocation.objects.create(user_profile=self.profile, latitude=13, longitude=80,
+                                    timestamp=self.fixes[0][0] - timedelta(days=1))
+
+        self.assertEqual(pack_day(self.day), 3)
+        self.assertEqual(pack_day(self.day), 3)
+
+        track = TrackDay.objects.get(user_profile=self.profile, day=self.day)
+        self.assertEqual(track.point_count, 3)
+        self.assertEqual([point['latitude'] for point in decode_points(track)], [13.0827, 13.082812, -12.5])
+
+    def test_unpacked_day_falls_back_to_raw_fixes(self):
+        timestamp, lat, lng, accuracy = self.fixes[0]
+        UserLocation.objects.create(user_profile=self.profile, latitude=lat, longitude=lng, accuracy=accuracy,
+                                    timestamp=timestamp)
+
+        self.assertEqual(day_points('walker', self.day), [
+            {'timestamp': int(timestamp.timestamp()), 'latitude': lat, 'longitude': lng, 'accuracy': accuracy}
+        ])
+
+
+class LivePositionFeedTests(TestCase):
+    def setUp(self):
+        self.feed = LivePositionFeed(history_frames=3, max_age_seconds=600, max_streams=1, autostart=False)
+
+    def officer(self, profile_id, lat=13.08, updated_at=None):
+        return OfficerPosition(profile_id, f'officer{profile_id}', f'TN{profile_id}', 'Inspector', lat, 80.27,
+                               time.time() if updated_at is None else updated_at)
+
+    def payload(self, since):
+        version, payload = self.feed.payload_since(since)
+        return version, json.loads(payload) if payload is not None else None
+
+    def test_diff_carries_only_changes_and_drops_static_fields_for_known_officers(self):
+        self.feed.publish(self.officer('1'))
+        self.feed.publish(self.officer('2'))
+        first = self.feed.advance()
+        self.feed.publish(self.officer('1', lat=13.09))
+        self.feed.retract('2')
+        self.feed.publish(self.officer('3'))
+        self.feed.advance()
+
+        _, diff = self.payload(first)
+
+        self.assertEqual(diff['type'], 'diff')
+        upserts = {record['id']: record for record in diff['upserts']}
+        self.assertEqual(set(upserts), {'1', '3'})
+        self.assertNotIn('username', upserts['1'])
+        self.assertEqual(upserts['1']['lat'], 13.09)
+        self.assertEqual(upserts['3']['username'], 'officer3')
+        self.assertEqual(diff['removed'], ['2'])
+        self.assertEqual(self.payload(self.feed.version), (self.feed.version, None))
+
+    def test_snapshot_for_new_stale_or_foreign_subscribers(self):
+        self.feed.publish(self.officer('1'))
+        self.feed.advance()
+        for lat in (13.1, 13.2, 13.3, 13.4):
+            self.feed.publish(self.officer('2', lat=lat))
+            self.feed.advance()
+
+        # -1 is a new viewer; version 1 has fallen out of the three-frame history
+        for since in (-1, 1):
+            _, payload = self.payload(since)
+            self.assertEqual(payload['type'], 'snapshot')
+            self.assertEqual({record['id'] for record in payload['officers']}, {'1', '2'})
+
+        cursor = self.feed.cursor(self.feed.version)
+        self.assertEqual(self.feed.parse_cursor(cursor), self.feed.version)
+        other = LivePositionFeed(autostart=False)
+        self.assertEqual(other.parse_cursor(cursor), -1)
+        self.assertEqual(self.feed.parse_cursor(str(self.feed.version)), -1)
+
+    def test_stale_officers_expire_into_a_removal(self):
+        self.feed.publish(self.officer('1', updated_at=time.time() - 601))
+        self.feed.publish(self.officer('2'))
+        first = self.feed.advance()
+
+        second = self.feed.advance()
+
+        self.assertEqual(second, first + 1)
+        _, diff = self.payload(first)
+        self.assertEqual((diff['upserts'], diff['removed']), ([], ['1']))
+
+    def test_streams_past_the_limit_are_turned_away(self):
+        self.feed.publish(self.officer('1'))
+        self.feed.advance()
+        held = self.feed.stream(-1, keepalive_seconds=1, max_seconds=60)
+        next(held)
+        frame = next(held)
+        self.assertIn(f'id: {self.feed.cursor(self.feed.version)}\n', frame)
+
+        self.assertFalse(self.feed.has_stream_capacity())
+        self.assertEqual(list(self.feed.stream(-1, keepalive_seconds=1, max_seconds=60)), ['retry: 1000\n\n'])
+
+        held.close()
+        self.assertTrue(self.feed.has_stream_capacity())
+
+
+@override_settings(LOCATION_WRITE_BEHIND={'ENABLED': False}, ACTIVITY_LOG={'ENABLED': False})
+class ActivityRollupTests(TestCase):
+    def setUp(self):
+        self.profile = UserProfile.objects.create(
+            user=User.objects.create(username='walker'), username='walker', role='public'
+        )
+        start = timezone.now() - timedelta(days=3)
+        places = [(13.0827, 80.2707), (13.0067, 80.2206), (12.9716, 77.5946)]
+        activities = []
+        for i in range(60):
+            timestamp = start + timedelta(minutes=47 * i)
+            lat, lng = places[i % len(places)]
+            if i % 3 == 0:
+                UserLocation.objects.create(user_profile=self.profile, latitude=lat, longitude=lng,
+                                            timestamp=timestamp)
+                activity = UserActivity(user_profile=self.profile, activity_type='location_updated',
+                                        metadata={'latitude': lat, 'longitude': lng}, timestamp=timestamp)
+            elif i % 3 == 1:
+                activity = UserActivity(user_profile=self.profile, activity_type='sos_sent',
+                                        metadata={'location': f'{lat}, {lng}'}, timestamp=timestamp)
+            else:
+                activity = UserActivity(user_profile=self.profile, activity_type='login', timestamp=timestamp)
+            activities.append(activity)
+        # Live increments arrive in several flushes, as they would from the activity writer
+        for offset in range(0, len(activities), 7):
+            save_activities(activities[offset:offset + 7])
+
+    def rollup_rows(self):
+        return dict(((row.granularity, row.bucket_start, row.activity_type, row.cell), row.count)
+                    for row in ActivityRollup.objects.all())
+
+    def raw_counts(self):
+        """The same keys counted straight from UserActivity, with the cells taken from the metadata"""
+        expected = Counter()
+        for granularity, trunc in (('hour', TruncHour), ('day', TruncDay)):
+            rows = (UserActivity.objects
+                    .annotate(bucket=trunc('timestamp', tzinfo=dt_timezone.utc))
+                    .values('bucket', 'activity_type')
+                    .annotate(total=Count('id')))
+            for row in rows:
+                expected[(granularity, row['bucket'], row['activity_type'], '')] = row['total']
+
+        for activity in UserActivity.objects.all():
+            metadata = activity.metadata or {}
+            if 'latitude' in metadata:
+                point = (metadata['latitude'], metadata['longitude'])
+            else:
+                point = parse_lat_lng(metadata.get('location'))
+            if point:
+                cell = geohash_encode(point[0], point[1], ROLLUP_CELL_PRECISION)
+                for granularity in ('hour', 'day'):
+                    expected[(granularity, bucket_start(activity.timestamp, granularity), activity.activity_type,
+                              cell)] += 1
+        return dict(expected)
+
+    def test_live_increments_and_backfill_match_raw_counts(self):
+        live = self.rollup_rows()
+        self.assertTrue(any(cell for _, _, _, cell in live))
+        self.assertEqual(live, self.raw_counts())
+
+        call_command('backfill_activity_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollup_rows(), live)
+
+        call_command('backfill_activity_rollups', '--days', '1', stdout=io.StringIO())
+        self.assertEqual(self.rollup_rows(), live)
+
+    def test_backfill_does_not_depend_on_stored_fixes(self):
+        live = self.rollup_rows()
+        # Compaction and the trajectory filter leave activities without a matching fix
+        UserLocation.objects.all().delete()
+        call_command('backfill_activity_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollup_rows(), live)
+
+    def test_backfill_keeps_rows_committed_during_the_scan(self):
+        from cityapp.management.commands import backfill_activity_rollups
+        count = backfill_activity_rollups.rollup_counts
+
+        def commit_late_row(activities):
+            # A write-behind row timestamped before the scan started but committed while it runs
+            if not UserActivity.objects.filter(activity_type='report_submitted').exists():
+                save_activities([UserActivity(user_profile=self.profile, activity_type='report_submitted',
+                                              metadata={'latitude': 13.0827, 'longitude': 80.2707},
+                                              timestamp=timezone.now() - timedelta(seconds=5))])
+            return count(activities)
+
+        with mock.patch.object(backfill_activity_rollups, 'rollup_counts', side_effect=commit_late_row):
+            call_command('backfill_activity_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollup_rows(), self.raw_counts())
+        self.assertTrue(any(key[2] == 'report_submitted' for key in self.rollup_rows()))
+
+
+@override_settings(ACTIVITY_LOG={'ENABLED': False})
+class ActivityCounterTests(TestCase):
+    """Counter upserts and profile stats add up to the raw UserActivity rows, however batches arrive"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profiles = [UserProfile.objects.create(user=User.objects.create(username=name), username=name,
+                                                   role='public')
+                        for name in ('walker', 'runner')]
+
+    def batch(self, profile, *types, at=None):
+        at = at or timezone.now()
+        return [UserActivity(user_profile=profile, activity_type=activity_type, timestamp=at - timedelta(seconds=i))
+                for i, activity_type in enumerate(types)]
+
+    def assert_counters_match_activities(self):
+        raw = {(row['user_profile_id'], row['activity_type']): (row['total'], row['last'])
+               for row in (UserActivity.objects.order_by().values('user_profile_id', 'activity_type')
+                           .annotate(total=Count('id'), last=models.Max('timestamp')))}
+        counters = {(row.user_profile_id, row.activity_type): (row.count, row.last_at)
+                    for row in ActivityCounter.objects.all()}
+        self.assertEqual(counters, raw)
+        for profile in UserProfile.objects.all():
+            self.assertEqual(profile.reports_submitted, raw.get((profile.id, 'report_submitted'), (0,))[0])
+            self.assertEqual(profile.alerts_received, raw.get((profile.id, 'alert_received'), (0,))[0])
+
+    def test_batches_accumulate_into_one_counter_row_per_user_and_type(self):
+        walker, runner = self.profiles
+        now = timezone.now()
+        save_activities(self.batch(walker, 'login', 'report_submitted', 'report_submitted', at=now))
+        save_activities(self.batch(runner, 'alert_received', 'login', at=now) +
+                        self.batch(walker, 'alert_received', 'report_submitted', at=now))
+        # A batch flushed late carries older timestamps; last_at must not move backwards
+        save_activities(self.batch(walker, 'report_submitted', 'login', at=now - timedelta(hours=2)))
+
+        self.assertEqual(ActivityCounter.objects.filter(user_profile=walker).count(), 3)
+        self.assert_counters_match_activities()
+        walker.refresh_from_db()
+        self.assertEqual((walker.reports_submitted, walker.alerts_received), (4, 1))
+
+    def test_interleaved_flushes_of_the_same_keys_lose_no_updates(self):
+        walker, runner = self.profiles
+        # The background flusher and synchronous fallbacks upsert the same rows in any order
+        batches = []
+        for i in range(12):
+            profile = self.profiles[i % 2]
+            batches.append(self.batch(profile, *['report_submitted'] * (i % 3 + 1), 'alert_received',
+                                      at=timezone.now() - timedelta(minutes=i * 7 % 5)))
+        for batch in batches[::2] + batches[1::2]:
+            save_activities(batch)
+        # The profile instance is stale by now; the stats are bumped with F() expressions, not from it
+        save_activities(self.batch(walker, 'report_submitted'))
+
+        self.assertEqual(ActivityCounter.objects.count(), 4)
+        self.assert_counters_match_activities()
+        self.assertEqual(UserProfile.objects.get(id=runner.id).reports_submitted,
+                         UserActivity.objects.filter(user_profile=runner, activity_type='report_submitted').count())
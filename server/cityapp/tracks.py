@@ -0,0 +1,149 @@
+import itertools
+import struct
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from operator import itemgetter
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import TrackDay, UserLocation
+
+# Fixed-point scales: microdegrees (~0.1 m) and decimetres of accuracy
+COORD_SCALE = 1_000_000
+ACCURACY_SCALE = 10
+NO_ACCURACY = -1
+
+# One point = four little-endian int32 deltas (lat, lng, seconds offset, accuracy)
+POINT = struct.Struct('<4i')
+POINT_FIELDS = 4
+
+# Tracks written per transaction while packing, so the SQLite write lock is held briefly
+PACK_BATCH_USERS = 200
+
+
+def is_enabled():
+    return getattr(settings, 'LOCATION_TRACK_STORE', {}).get('ENABLED', True)
+
+
+def _day_start(day):
+    return datetime.combine(day, dt_time.min, tzinfo=dt_timezone.utc)
+
+
+def _encode_accuracy(accuracy):
+    return NO_ACCURACY if accuracy is None else max(int(round(float(accuracy) * ACCURACY_SCALE)), 0)
+
+
+def encode_points(day, fixes: Iterable) -> bytes:
+    """Pack (timestamp, latitude, longitude, accuracy) tuples for one UTC day into a track blob"""
+    start = _day_start(day)
+    lat = lng = offset = accuracy = 0
+    data = bytearray()
+    for timestamp, latitude, longitude, accuracy_m in fixes:
+        new_lat = int(round(float(latitude) * COORD_SCALE))
+        new_lng = int(round(float(longitude) * COORD_SCALE))
+        new_offset = int((timestamp - start).total_seconds())
+        new_accuracy = _encode_accuracy(accuracy_m)
+        data += POINT.pack(new_lat - lat, new_lng - lng, new_offset - offset, new_accuracy - accuracy)
+        lat, lng, offset, accuracy = new_lat, new_lng, new_offset, new_accuracy
+    return bytes(data)
+
+
+def pack_day(day) -> int:
+    """(Re)build every user's track for one finished UTC day from its UserLocation rows
+
+    Each track is encoded once from the day's fixes, so ingest never touches the blobs.
+    Run it while the day's history is still at full resolution (compact_locations packs
+    before it downsamples). Returns the number of points packed.
+    """
+    start = _day_start(day)
+    rows = (UserLocation.objects
+            .filter(timestamp__gte=start, timestamp__lt=start + timedelta(days=1))
+            .order_by('user_profile_id', 'timestamp')
+            .values_list('user_profile_id', 'timestamp', 'latitude', 'longitude', 'accuracy')
+            .iterator(chunk_size=2000))
+
+    def tracks():
+        for user_profile_id, group in itertools.groupby(rows, itemgetter(0)):
+            fixes = [row[1:] for row in group]
+            yield TrackDay(user_profile_id=user_profile_id, day=day, data=encode_points(day, fixes),
+                           point_count=len(fixes))
+
+    pending = tracks()
+    packed = 0
+    while True:
+        batch = list(itertools.islice(pending, PACK_BATCH_USERS))
+        if not batch:
+            return packed
+        with transaction.atomic():
+            TrackDay.objects.filter(day=day, user_profile_id__in=[track.user_profile_id for track in batch]).delete()
+            TrackDay.objects.bulk_create(batch)
+        packed += sum(track.point_count for track in batch)
+
+
+def decode_day(track: TrackDay):
+    """Decode a whole day into NumPy arrays in one pass
+
+    Returns a dict of equal-length arrays sorted by time: ``timestamp`` (epoch
+    seconds, int64), ``latitude``/``longitude`` (float64 degrees) and ``accuracy``
+    (float32 metres, NaN when unknown).
+    """
+    import numpy as np
+
+    raw = np.frombuffer(bytes(track.data), dtype='<i4').reshape(-1, POINT_FIELDS)
+    absolute = np.cumsum(raw, axis=0, dtype=np.int64)
+    order = np.argsort(absolute[:, 2], kind='stable')
+    absolute = absolute[order]
+
+    accuracy = absolute[:, 3].astype(np.float32) / ACCURACY_SCALE
+    accuracy[absolute[:, 3] == NO_ACCURACY] = np.nan
+    return {
+        'timestamp': absolute[:, 2] + int(_day_start(track.day).timestamp()),
+        'latitude': absolute[:, 0] / COORD_SCALE,
+        'longitude': absolute[:, 1] / COORD_SCALE,
+        'accuracy': accuracy,
+    }
+
+
+def decode_points(track: TrackDay) -> List[dict]:
+    """Pure-Python decode for callers that want plain dicts (e.g. JSON responses)"""
+    day_start = int(_day_start(track.day).timestamp())
+    lat = lng = offset = accuracy = 0
+    points = []
+    for d_lat, d_lng, d_offset, d_accuracy in POINT.iter_unpack(bytes(track.data)):
+        lat, lng, offset, accuracy = lat + d_lat, lng + d_lng, offset + d_offset, accuracy + d_accuracy
+        points.append({
+            'timestamp': day_start + offset,
+            'latitude': lat / COORD_SCALE,
+            'longitude': lng / COORD_SCALE,
+            'accuracy': None if accuracy == NO_ACCURACY else accuracy / ACCURACY_SCALE,
+        })
+    points.sort(key=lambda point: point['timestamp'])
+    return points
+
+
+def day_points(username, day) -> List[dict]:
+    """Playback points for one user-day: the packed track, or the raw fixes until it is packed"""
+    track = TrackDay.objects.filter(user_profile__username=username, day=day).first()
+    if track is not None:
+        return decode_points(track)
+    start = _day_start(day)
+    rows = (UserLocation.objects
+            .filter(user_profile__username=username, timestamp__gte=start, timestamp__lt=start + timedelta(days=1))
+            .order_by('timestamp')
+            .values_list('timestamp', 'latitude', 'longitude', 'accuracy'))
+    return [
+        {
+            'timestamp': int(timestamp.timestamp()),
+            'latitude': float(latitude),
+            'longitude': float(longitude),
+            'accuracy': accuracy,
+        }
+        for timestamp, latitude, longitude, accuracy in rows
+    ]
+
+
+def load_day(user_profile, day) -> Optional[dict]:
+    """NumPy arrays for one user-day, or None when nothing was recorded"""
+    track = TrackDay.objects.filter(user_profile=user_profile, day=day).first()
+    return decode_day(track) if track else None
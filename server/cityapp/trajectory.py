@@ -0,0 +1,144 @@
+import math
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+from . import metrics
+from .geo import calculate_distance
+from .services import HOTSPOT_RADIUS_KM, cached_hotspots
+
+# Per-role thresholds, overridable through settings.TRAJECTORY_FILTER
+DEFAULT_THRESHOLDS = {
+    'police': {
+        # Fixes closer than this to the last stored point are dropped (raised to the fix accuracy)
+        'min_distance_m': 15,
+        # A fix is always stored when the last stored one is older than this
+        'max_interval_s': 30,
+        # Allowed error between the dead-reckoned and the actual position
+        'dead_reckoning_tolerance_m': 20,
+        # Heading changes sharper than this are kept as turns
+        'turn_angle_deg': 30,
+    },
+    'public': {
+        'min_distance_m': 30,
+        'max_interval_s': 120,
+        'dead_reckoning_tolerance_m': 40,
+        'turn_angle_deg': 45,
+    },
+}
+
+# Fixes within this distance of a hotspot's edge are always stored
+HOTSPOT_BOUNDARY_BAND_M = 100
+
+
+@dataclass
+class TrackPoint:
+    lat: float
+    lng: float
+    t: float
+
+
+def _distance_m(a_lat, a_lng, b_lat, b_lng):
+    return calculate_distance(a_lat, a_lng, b_lat, b_lng) * 1000
+
+
+def _heading(a: TrackPoint, b_lat, b_lng):
+    """Approximate bearing in degrees from a to b (equirectangular, fine at these distances)"""
+    dx = (b_lng - a.lng) * math.cos(math.radians(a.lat))
+    dy = b_lat - a.lat
+    return math.degrees(math.atan2(dx, dy))
+
+
+def _near_hotspot_boundary(lat, lng):
+    radius_m = HOTSPOT_RADIUS_KM * 1000
+    for hotspot in cached_hotspots():
+        if abs(_distance_m(lat, lng, hotspot['lat'], hotspot['lng']) - radius_m) <= HOTSPOT_BOUNDARY_BAND_M:
+            return True
+    return False
+
+
+def thresholds_for(role):
+    configured = getattr(settings, 'TRAJECTORY_FILTER', {})
+    base = DEFAULT_THRESHOLDS.get(role, DEFAULT_THRESHOLDS['public'])
+    return {**base, **configured.get(role, {})}
+
+
+class TrajectoryFilter:
+    """Decides which incoming fixes are worth a UserLocation row
+
+    A fix is dropped when it is within the movement/accuracy threshold of the last
+    stored point, or when dead-reckoning from the last two stored points predicts it.
+    Turns, stops (which break the dead-reckoned prediction), heartbeats after
+    max_interval_s and fixes near a hotspot boundary are always stored.
+    """
+
+    def __init__(self):
+        self._tracks: Dict[str, Tuple[Optional[TrackPoint], TrackPoint]] = {}
+        self._lock = threading.Lock()
+        self.stats = {'received': 0, 'stored': 0}
+
+    def last_stored_time(self, user_key) -> Optional[float]:
+        track = self._tracks.get(str(user_key))
+        return track[1].t if track else None
+
+    def should_store(self, user_key, role, lat, lng, t, accuracy=None) -> bool:
+        """Return True if the fix should be stored, remembering it as the newest stored point"""
+        user_key = str(user_key)
+        lat, lng = float(lat), float(lng)
+        with self._lock:
+            self.stats['received'] += 1
+            track = self._tracks.get(user_key)
+            keep = track is None or self._is_significant(track, thresholds_for(role), lat, lng, t, accuracy)
+            if keep:
+                previous = track[1] if track else None
+                self._tracks[user_key] = (previous, TrackPoint(lat, lng, t))
+                self.stats['stored'] += 1
+            return keep
+
+    def _is_significant(self, track, limits, lat, lng, t, accuracy):
+        before, last = track
+        if t <= last.t or t - last.t >= limits['max_interval_s']:
+            return True
+
+        moved = _distance_m(last.lat, last.lng, lat, lng)
+        noise_floor = max(limits['min_distance_m'], accuracy or 0)
+
+        if _near_hotspot_boundary(lat, lng):
+            return True
+
+        if before is not None and last.t > before.t:
+            # Dead-reckon from the last stored segment; a stop or turn breaks the prediction
+            ratio = (t - last.t) / (last.t - before.t)
+            predicted_lat = last.lat + (last.lat - before.lat) * ratio
+            predicted_lng = last.lng + (last.lng - before.lng) * ratio
+            error = _distance_m(predicted_lat, predicted_lng, lat, lng)
+            if error > max(limits['dead_reckoning_tolerance_m'], accuracy or 0):
+                return True
+            if moved >= noise_floor:
+                segment = _distance_m(before.lat, before.lng, last.lat, last.lng)
+                if segment >= noise_floor:
+                    turn = abs(_heading(last, lat, lng) - _heading(before, last.lat, last.lng)) % 360
+                    if min(turn, 360 - turn) > limits['turn_angle_deg']:
+                        return True
+            return False
+
+        return moved >= noise_floor
+
+    def snapshot(self):
+        with self._lock:
+            received, stored = self.stats['received'], self.stats['stored']
+        return {
+            'received': received,
+            'stored': stored,
+            'compression_ratio': round(received / stored, 2) if stored else None,
+        }
+
+
+trajectory_filter = TrajectoryFilter()
+metrics.register('trajectory_filter', trajectory_filter.snapshot)
+
+
+def is_enabled():
+    return getattr(settings, 'TRAJECTORY_FILTER', {}).get('ENABLED', True)
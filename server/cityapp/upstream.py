@@ -0,0 +1,249 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Per-service defaults, overridable through settings.UPSTREAM_SERVICES
+DEFAULT_SERVICE_CONFIG = {
+    'osrm': {'timeout': 5.0, 'hedge': True},
+    'nominatim': {'timeout': 4.0, 'hedge': True},
+    'telegram': {'timeout': 5.0, 'hedge': False},
+    # Notification transports are never hedged: a duplicate request is a duplicate message
+    'sms': {'timeout': 5.0, 'hedge': False},
+    'webhook': {'timeout': 5.0, 'hedge': False},
+    'gemini': {'timeout': 15.0, 'hedge': False},
+}
+
+# Consecutive failures that trip a breaker, and how long it stays open
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+# Hedging only starts once enough latency samples exist to estimate a p95
+MIN_HEDGE_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+_deadline = contextvars.ContextVar('upstream_deadline', default=None)
+
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='upstream')
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream call fails and no fallback is available"""
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class DeadlineExceeded(UpstreamError):
+    pass
+
+
+@contextmanager
+def deadline_at(deadline):
+    """Bound every upstream call made inside the block by an absolute ``time.monotonic()`` deadline"""
+    current = _deadline.get()
+    if deadline is None or (current is not None and current < deadline):
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def deadline_scope(seconds):
+    """Bound every upstream call made inside the block to a shared time budget"""
+    return deadline_at(time.monotonic() + seconds)
+
+
+def current_deadline() -> Optional[float]:
+    """The deadline in force, for code that continues the request's work later (see deadline_at)"""
+    return _deadline.get()
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left before the current request deadline, or None if unbounded"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """Submit to an executor while carrying the caller's deadline into the worker thread"""
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, fn, *args, **kwargs)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class UpstreamService:
+    """Guarded access to one upstream dependency: breaker, hedging and deadlines"""
+
+    def __init__(self, name, timeout, hedge=False, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.hedge = hedge
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def _timeout(self) -> float:
+        remaining = remaining_budget()
+        if remaining is None:
+            return self.timeout
+        if remaining <= 0:
+            raise DeadlineExceeded(f'{self.name}: request deadline exceeded')
+        return min(self.timeout, remaining)
+
+    def _attempt(self, fn, timeout):
+        started = time.monotonic()
+        result = fn(timeout)
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+        return result
+
+    def _run(self, fn, timeout, hedge):
+        hedge_delay = self.p95() if hedge else None
+        if hedge_delay is None or hedge_delay >= timeout:
+            return self._attempt(fn, timeout)
+
+        started = time.monotonic()
+        pending = {submit_with_context(_hedge_executor, self._attempt, fn, timeout)}
+        done, pending = wait(pending, timeout=hedge_delay)
+        if not done:
+            # Primary is slower than usual: race a second request against it
+            remaining = max(timeout - (time.monotonic() - started), 0.001)
+            pending.add(submit_with_context(_hedge_executor, self._attempt, fn, remaining))
+
+        error = None
+        deadline = started + timeout
+        while True:
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+            if not pending:
+                raise error
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise DeadlineExceeded(f'{self.name}: timed out after {timeout:.1f}s')
+            done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+
+    def call(self, fn: Callable[[float], object], fallback: Optional[Callable[[], object]] = None, hedge=None):
+        """Call fn(timeout) under this service's breaker; use fallback() when it is open or fn fails"""
+        if not self.breaker.allow():
+            if fallback is not None:
+                return fallback()
+            raise CircuitOpenError(f'{self.name}: circuit open')
+
+        try:
+            timeout = self._timeout()
+        except DeadlineExceeded:
+            if fallback is not None:
+                return fallback()
+            raise
+
+        try:
+            result = self._run(fn, timeout, self.hedge if hedge is None else hedge)
+        except Exception as e:
+            self.breaker.record_failure()
+            logger.warning('Upstream %s error: %s', self.name, e)
+            if fallback is not None:
+                return fallback()
+            if isinstance(e, UpstreamError):
+                raise
+            raise UpstreamError(f'{self.name}: {e}') from e
+
+        self.breaker.record_success()
+        return result
+
+    def snapshot(self) -> Dict:
+        p95 = self.p95()
+        return {
+            'state': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+            'timeout_s': self.timeout,
+        }
+
+
+_services: Dict[str, UpstreamService] = {}
+_services_lock = threading.Lock()
+
+
+def get_service(name: str) -> UpstreamService:
+    """Return the process-wide guard for an upstream service"""
+    service = _services.get(name)
+    if service is not None:
+        return service
+    with _services_lock:
+        if name not in _services:
+            config = dict(DEFAULT_SERVICE_CONFIG.get(name, {'timeout': 10.0}))
+            config.update(getattr(settings, 'UPSTREAM_SERVICES', {}).get(name, {}))
+            _services[name] = UpstreamService(name, **config)
+        return _services[name]
+
+
+metrics.register('upstream', lambda: {name: service.snapshot() for name, service in list(_services.items())})
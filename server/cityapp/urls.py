@@ -5,20 +5,33 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('api/crime-predictions/', views.get_crime_predictions, name='crime_predictions'),
     path('api/register/', views.register_user, name='register_user'),
+    path('api/onboard/', views.onboard_user_view, name='onboard_user'),
     path('api/login/', views.login_user, name='login_user'),
     path('api/send-alert/', views.send_alert, name='send_alert'),
     path('api/validate-police-id/', views.validate_police_id, name='validate_police_id'),
     path('api/send-sos/', views.send_sos_alert, name='send_sos_alert'),
+    path('api/sos-status/', views.sos_status, name='sos_status'),
     path('api/check-hotspot/', views.check_hotspot_status, name='check_hotspot_status'),
     
     # New user management endpoints
     path('api/user-profile/', views.user_profile, name='user_profile'),
+    path('api/user-profiles/bulk/', views.bulk_user_profiles, name='bulk_user_profiles'),
     path('api/emergency-contacts/', views.emergency_contacts, name='emergency_contacts'),
     path('api/update-location/', views.update_location, name='update_location'),
+    path('api/update-location/batch/', views.update_location_batch, name='update_location_batch'),
     path('api/user-activities/', views.user_activities, name='user_activities'),
+    path('api/location-history/', views.location_history, name='location_history'),
+    path('api/track-day/', views.user_track_day, name='user_track_day'),
+    path('api/nearby-users/', views.nearby_users, name='nearby_users'),
+    path('api/officers/live/', views.officer_positions_stream, name='officer_positions_stream'),
+    path('api/officers/changes/', views.officer_position_changes, name='officer_position_changes'),
+    path('api/latest-positions/', views.latest_user_positions, name='latest_user_positions'),
+    path('api/analytics/activity/', views.activity_analytics, name='activity_analytics'),
+    path('api/metrics/', views.metrics_view, name='metrics'),
 
     path('route/', views.route_page, name='route_page'),
     path('api/route/', views.get_route_coordinates, name='get_route_coordinates'),
+    path('api/route/batch/', views.get_batch_route_coordinates, name='get_batch_route_coordinates'),
     path('api/patrol-route-coordinates/', views.get_patrol_route_coordinates, name='get_patrol_route_coordinates'),
 
     path('api/register/', views.register_user, name='register_user'),
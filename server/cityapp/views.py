@@ -1,32 +1,74 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from .models import UserProfile, EmergencyContact, UserLocation, UserActivity
-from .services import CrimePredictionService
-from .telegram_service import TelegramService
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db import transaction
+from django.core.exceptions import ValidationError
+from .models import UserProfile, EmergencyContact, UserLocation, UserActivity, SOSDispatch
+from .services import CrimePredictionService, HOTSPOT_RADIUS_KM
+from .dispatch import officer_index, find_nearest_units
+from .geo import calculate_distance, parse_lat_lng
+from .write_behind import write_location
+from .activity_log import log_activity, save_activities
+from .profiles import profile_cache, parse_fields, serialize_contact
+from .roster import officer_roster
+from .sos_queue import enqueue_sos, serialize_dispatch, submit_sos
+from .onboarding import onboard_user, parse_contacts, registration_conflict, upsert_contacts
+from .tracks import day_points
+from .live_positions import live_feed, live_config as live_positions_config
+from .rollups import BUCKET_SIZES, activity_by_cell, activity_series
+from .pagination import InvalidCursor, keyset_page, parse_page_size
+from .trajectory import trajectory_filter, TrajectoryFilter, is_enabled as trajectory_filter_enabled
+from .positions import upsert_current_positions, latest_positions, nearby_positions, serialize_position, DEFAULT_ACTIVE_MINUTES
+from . import metrics
+from .routing import geocode_place, get_route_coords, RouteBatchResolver, MAX_BATCH_PAIRS
 import json
 import time
-from datetime import datetime, timedelta
-from geopy.geocoders import Nominatim
-
-# Mock Police ID Database
-VALID_POLICE_IDS = {
-    'TN001': {'name': 'Inspector Rajesh Kumar', 'rank': 'Inspector'},
-    'TN002': {'name': 'Sub-Inspector Priya Sharma', 'rank': 'Sub-Inspector'},
-    'TN003': {'name': 'Constable Murugan S', 'rank': 'Constable'},
-    'TN004': {'name': 'Inspector Kavitha R', 'rank': 'Inspector'},
-    'TN005': {'name': 'Head Constable Ravi Kumar', 'rank': 'Head Constable'},
-    'TN006': {'name': 'Sub-Inspector Arun M', 'rank': 'Sub-Inspector'},
-    'TN007': {'name': 'Constable Lakshmi P', 'rank': 'Constable'},
-    'TN008': {'name': 'Inspector Senthil Kumar', 'rank': 'Inspector'},
-    'TN009': {'name': 'Sub-Inspector Meera J', 'rank': 'Sub-Inspector'},
-    'TN010': {'name': 'Constable Karthik V', 'rank': 'Constable'}
-}
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+# Largest number of fixes accepted by one batch location upload
+MAX_LOCATION_BATCH = 1000
+
+# Client clocks may run slightly ahead; anything further in the future is clamped to now
+MAX_CLIENT_CLOCK_SKEW = timedelta(minutes=5)
+
+# Bounds for the "who is near here" query
+MAX_NEARBY_RADIUS_KM = 50
+MAX_NEARBY_PAGE_SIZE = 200
+MAX_NEARBY_ACTIVE_MINUTES = 7 * 24 * 60
+
+# Largest time-series served by the activity analytics endpoint (a month of hours)
+MAX_ANALYTICS_BUCKETS = 31 * 24
+
+# Most users resolved by one bulk profile request
+MAX_BULK_PROFILES = 200
+
+# Upper bound on how long a long-poll for officer position changes may block
+MAX_LONG_POLL_SECONDS = 25
+
+# Most nearest units suggested for one SOS
+MAX_SOS_UNITS = 10
+
+TRUE_STRINGS = ('true', '1', 'yes', 'on')
+FALSE_STRINGS = ('false', '0', 'no', 'off')
+
+def parse_bool(value, default=False):
+    """Parse a JSON boolean or a "true"/"false" style string; raises ValueError otherwise"""
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return value != 0
+    if isinstance(value, str) and value.strip().lower() in TRUE_STRINGS + FALSE_STRINGS:
+        return value.strip().lower() in TRUE_STRINGS
+    raise ValueError(f'Expected a boolean, got {value!r}')
 
 def home(request):
     return render(request, 'cityapp/home.html')
@@ -109,20 +151,6 @@ def register_user(request):
                 'message': 'Username and password are required'
             }, status=400)
         
-        # Check if username already exists in UserProfile
-        if UserProfile.objects.filter(username=username).exists():
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Username already exists'
-            }, status=400)
-        
-        # Check if username already exists in Django User model
-        if User.objects.filter(username=username).exists():
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Username already exists'
-            }, status=400)
-        
         # Validate police ID for police role
         if role == 'police':
             if not police_id:
@@ -131,17 +159,20 @@ def register_user(request):
                     'message': 'Police ID is required for police registration'
                 }, status=400)
             
-            if police_id not in VALID_POLICE_IDS:
+            officer = officer_roster.lookup(police_id)
+            if officer is None:
                 return JsonResponse({
                     'status': 'error',
                     'message': 'Invalid Police ID. Contact your department.'
                 }, status=400)
-            
-            if UserProfile.objects.filter(police_id=police_id).exists():
-                return JsonResponse({
-                    'status': 'error',
-                    'message': 'Police ID already registered'
-                }, status=400)
+        
+        # Username (User and UserProfile) and police ID clashes in one query
+        conflict = registration_conflict(username, police_id if role == 'police' else None)
+        if conflict:
+            return JsonResponse({
+                'status': 'error',
+                'message': conflict
+            }, status=400)
         
         # Create Django User
         user = User.objects.create_user(
@@ -158,14 +189,13 @@ def register_user(request):
             phone=phone,
             role=role,
             police_id=police_id if role == 'police' else None,
-            police_rank=VALID_POLICE_IDS.get(police_id, {}).get('rank') if role == 'police' else None
+            police_rank=officer['rank'] if role == 'police' else None
         )
         
         # Log user registration activity
-        UserActivity.objects.create(
-            user_profile=user_profile,
-            activity_type='login',
-            description=f'User registered successfully',
+        log_activity(
+            user_profile, 'login',
+            description='User registered successfully',
             metadata={'role': role, 'police_id': police_id if role == 'police' else None}
         )
         
@@ -206,15 +236,15 @@ def login_user(request):
             # Get user profile
             try:
                 user_profile = UserProfile.objects.get(user=user)
-                # Update last active timestamp
+                # Only bump last_active; a full save rewrites every column and holds the write lock longer
                 user_profile.last_active = timezone.now()
-                user_profile.save()
+                user_profile.save(update_fields=['last_active'])
+                profile_cache.invalidate([user_profile.id])
                 
                 # Log login activity
-                UserActivity.objects.create(
-                    user_profile=user_profile,
-                    activity_type='login',
-                    description=f'User logged in successfully',
+                log_activity(
+                    user_profile, 'login',
+                    description='User logged in successfully',
                     metadata={'ip_address': request.META.get('REMOTE_ADDR', 'Unknown')}
                 )
                 
@@ -261,22 +291,111 @@ def login_user(request):
 @csrf_exempt
 @require_http_methods(["POST"])
 def send_alert(request):
-    """API endpoint to send SMS alerts"""
+    """API endpoint to queue a high-crime-area alert for the user's emergency contacts
+
+    Delivery happens on the SOS workers; /api/sos-status/?sos_id=<alert_id> reports each outcome.
+    """
     try:
         data = json.loads(request.body)
         username = data.get('username')
         location = data.get('location')
-        contacts = data.get('contacts', [])
+        # Plain numbers or {'phone': ...} objects, as the client keeps them
+        contacts = data.get('contacts') or []
+        numbers = [contact.get('phone') if isinstance(contact, dict) else contact for contact in contacts]
+        
+        if not username:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Username is required'
+            }, status=400)
+        
+        user_profile = UserProfile.objects.filter(username=username).first()
+        
+        # Persisted before responding and delivered with retries, like an SOS. Stored contacts are
+        # messaged; numbers sent by the client are only used for users without stored contacts.
+        dispatch = enqueue_sos(
+            username, (user_profile.phone or '') if user_profile else '', str(location or ''),
+            user_profile=user_profile,
+            kind='safety',
+            contact_numbers=[str(number) for number in numbers if number],
+        )
+        
+        if user_profile:
+            log_activity(
+                user_profile, 'alert_received',
+                description='High-crime area alert queued for emergency contacts',
+                metadata={'location': location, 'alert_id': str(dispatch.id)}
+            )
+        
+        return JsonResponse({
+            'status': 'success',
+            'message': 'Alert queued for delivery',
+            'alert_id': str(dispatch.id),
+            'delivery_status': dispatch.status
+        })
+        
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def onboard_user_view(request):
+    """API endpoint to register a user with their emergency contacts and initial location in one request"""
+    try:
+        data = json.loads(request.body)
+        username = data.get('username')
+        password = data.get('password')
         
-        alert_message = f"SAFETY ALERT: {username} has been in a high-crime area for over 5 minutes. Location: {location}"
+        if not username or not password:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Username and password are required'
+            }, status=400)
+        
+        contacts = parse_contacts(data.get('emergency_contacts') or [])
+        location = data.get('location')
+        if location:
+            location = {
+                'latitude': float(location['latitude']),
+                'longitude': float(location['longitude']),
+                'address': location.get('address') or '',
+                'accuracy': float(location['accuracy']) if location.get('accuracy') is not None else None,
+            }
         
-        print(f"SMS Alert sent to {len(contacts)} contacts: {alert_message}")
+        user_profile, saved_contacts, initial_location = onboard_user(
+            username, password,
+            email=data.get('email', ''),
+            phone=data.get('phone', ''),
+            role=data.get('role', 'public'),
+            police_id=data.get('police_id', ''),
+            contacts=contacts,
+            location=location,
+        )
         
         return JsonResponse({
             'status': 'success',
-            'message': f'Alert sent to {len(contacts)} contacts'
+            'message': 'User registered successfully',
+            'user_id': str(user_profile.id),
+            'username': user_profile.username,
+            'role': user_profile.role,
+            'emergency_contacts': [serialize_contact(contact) for contact in saved_contacts],
+            'location': {
+                'id': str(initial_location.id),
+                'latitude': float(initial_location.latitude),
+                'longitude': float(initial_location.longitude),
+                'address': initial_location.address,
+                'timestamp': initial_location.timestamp.isoformat()
+            } if initial_location else None
         })
         
+    except (ValueError, KeyError, TypeError, json.JSONDecodeError) as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e) if not isinstance(e, KeyError) else f'location.{e.args[0]} is required'
+        }, status=400)
     except Exception as e:
         return JsonResponse({
             'status': 'error',
@@ -291,11 +410,13 @@ def validate_police_id(request):
         data = json.loads(request.body)
         police_id = data.get('police_id', '')
         
-        if police_id in VALID_POLICE_IDS:
+        # In-process roster copy; no query unless the roster version is due for a check
+        officer = officer_roster.lookup(police_id)
+        if officer is not None:
             return JsonResponse({
                 'status': 'success',
                 'valid': True,
-                'officer': VALID_POLICE_IDS[police_id]
+                'officer': officer
             })
         else:
             return JsonResponse({
@@ -326,10 +447,54 @@ def send_sos_alert(request):
                 'message': 'Username, phone, and location are required'
             }, status=400)
         
-        telegram_service = TelegramService()
-        result = telegram_service.send_sos_alert(username, phone, location, duration_minutes)
+        try:
+            units_requested = max(1, min(int(data.get('units', 3)), MAX_SOS_UNITS))
+        except (TypeError, ValueError):
+            return JsonResponse({
+                'status': 'error',
+                'message': 'units must be an integer'
+            }, status=400)
+        
+        idempotency_key = str(request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '')[:100]
+        
+        def locate_units():
+            # Straight-line from the in-memory index only; the SOS worker adds road ETAs before
+            # sending, so a slow routing service never holds up accepting the SOS
+            coords = parse_lat_lng(location)
+            return find_nearest_units(coords[0], coords[1], k=units_requested, refine=False) if coords else []
+        
+        user_profile = UserProfile.objects.filter(username=username).first()
         
-        response = JsonResponse(result)
+        # Persisted before responding; delivery (with retries) happens on the SOS workers.
+        # Retries and repeats of an active SOS are folded into it instead of alerting again.
+        dispatch, outcome = submit_sos(
+            username, phone, location,
+            duration_minutes=duration_minutes,
+            locate_units=locate_units,
+            user_profile=user_profile,
+            idempotency_key=idempotency_key
+        )
+        
+        if user_profile and outcome == 'queued':
+            log_activity(
+                user_profile, 'sos_sent',
+                description='SOS alert sent',
+                metadata={'location': location, 'units_notified': len(dispatch.nearest_units), 'sos_id': str(dispatch.id)}
+            )
+        
+        messages = {
+            'queued': 'SOS alert queued for delivery',
+            'coalesced': 'SOS already active; responders will get an update',
+            'duplicate': 'SOS already received',
+        }
+        response = JsonResponse({
+            'status': 'success',
+            'message': messages[outcome],
+            'sos_id': str(dispatch.id),
+            'outcome': outcome,
+            'delivery_status': dispatch.status,
+            'nearest_units': dispatch.nearest_units
+        })
         response['Access-Control-Allow-Origin'] = '*'
         return response
         
@@ -341,6 +506,54 @@ def send_sos_alert(request):
         error_response['Access-Control-Allow-Origin'] = '*'
         return error_response
 
+@csrf_exempt
+@require_http_methods(["GET"])
+def sos_status(request):
+    """API endpoint to poll the delivery status of a queued SOS"""
+    try:
+        sos_id = request.GET.get('sos_id')
+        if not sos_id:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'sos_id is required'
+            }, status=400)
+        
+        dispatch = SOSDispatch.objects.filter(id=sos_id).first()
+        if dispatch is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'SOS not found'
+            }, status=404)
+        
+        response = JsonResponse({
+            'status': 'success',
+            'sos': serialize_dispatch(dispatch),
+            'deliveries': [
+                {
+                    'transport': transport,
+                    'recipient': recipient,
+                    'status': status,
+                    'error': error or None,
+                    'at': created_at.isoformat()
+                }
+                for transport, recipient, status, error, created_at in dispatch.deliveries
+                .order_by('created_at').values_list('transport', 'recipient', 'status', 'error', 'created_at')
+            ]
+        })
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+        
+    except ValidationError:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Invalid sos_id'
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def check_hotspot_status(request):
@@ -364,7 +577,7 @@ def check_hotspot_status(request):
         for coord in coordinates:
             if coord.get('risk_level') == 'high':
                 distance = calculate_distance(user_lat, user_lng, coord['lat'], coord['lng'])
-                if distance <= 0.5:  # Within 500 meters
+                if distance <= HOTSPOT_RADIUS_KM:  # Within 500 meters
                     in_hotspot = True
                     hotspot_info = coord
                     break
@@ -387,21 +600,6 @@ def check_hotspot_status(request):
         error_response['Access-Control-Allow-Origin'] = '*'
         return error_response
 
-def calculate_distance(lat1, lng1, lat2, lng2):
-    """Calculate distance between two coordinates in kilometers"""
-    import math
-    
-    R = 6371  # Earth's radius in km
-    dlat = math.radians(lat2 - lat1)
-    dlng = math.radians(lng2 - lng1)
-    
-    a = (math.sin(dlat/2) * math.sin(dlat/2) + 
-         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * 
-         math.sin(dlng/2) * math.sin(dlng/2))
-    
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
-
 
 # New API endpoints for user management
 
@@ -421,69 +619,18 @@ def user_profile(request):
                     'message': 'Username or user_id is required'
                 }, status=400)
             
-            try:
-                if user_id:
-                    user_profile = UserProfile.objects.get(id=user_id)
-                else:
-                    user_profile = UserProfile.objects.get(username=username)
-                
-                # Get emergency contacts
-                emergency_contacts = []
-                for contact in user_profile.emergency_contacts.filter(is_active=True):
-                    emergency_contacts.append({
-                        'id': str(contact.id),
-                        'name': contact.name,
-                        'phone': contact.phone,
-                        'relationship': contact.relationship,
-                        'added_date': contact.created_at.isoformat()
-                    })
-                
-                # Get latest location
-                latest_location = None
-                try:
-                    location = user_profile.locations.first()
-                    if location:
-                        latest_location = {
-                            'latitude': float(location.latitude),
-                            'longitude': float(location.longitude),
-                            'address': location.address,
-                            'accuracy': location.accuracy,
-                            'timestamp': location.timestamp.isoformat()
-                        }
-                except:
-                    pass
-                
-                return JsonResponse({
-                    'status': 'success',
-                    'user': {
-                        'id': str(user_profile.id),
-                        'username': user_profile.username,
-                        'email': user_profile.email,
-                        'phone': user_profile.phone,
-                        'role': user_profile.role,
-                        'police_id': user_profile.police_id,
-                        'police_rank': user_profile.police_rank,
-                        'avatar': user_profile.avatar,
-                        'bio': user_profile.bio,
-                        'created_at': user_profile.created_at.isoformat(),
-                        'last_active': user_profile.last_active.isoformat(),
-                        'reports_submitted': user_profile.reports_submitted,
-                        'alerts_received': user_profile.alerts_received,
-                        'safety_score': user_profile.safety_score,
-                        'preferences': {
-                            'notifications_enabled': user_profile.notifications_enabled,
-                            'location_tracking_enabled': user_profile.location_tracking_enabled,
-                            'emergency_alerts_enabled': user_profile.emergency_alerts_enabled
-                        },
-                        'emergency_contacts': emergency_contacts,
-                        'latest_location': latest_location
-                    }
-                })
-            except UserProfile.DoesNotExist:
+            # Served from the per-user cache; a miss loads everything in one joined query plus prefetches
+            payload = profile_cache.get(username=username, user_id=user_id)
+            if payload is None:
                 return JsonResponse({
                     'status': 'error',
                     'message': 'User not found'
                 }, status=404)
+            
+            return JsonResponse({
+                'status': 'success',
+                'user': payload
+            })
         
         elif request.method == 'POST':
             # Update user profile
@@ -518,12 +665,12 @@ def user_profile(request):
                         user_profile.emergency_alerts_enabled = prefs['emergency_alerts_enabled']
                 
                 user_profile.save()
+                profile_cache.invalidate([user_profile.id])
                 
                 # Log profile update activity
-                UserActivity.objects.create(
-                    user_profile=user_profile,
-                    activity_type='profile_updated',
-                    description=f'Profile updated successfully',
+                log_activity(
+                    user_profile, 'profile_updated',
+                    description='Profile updated successfully',
                     metadata={'updated_fields': list(data.keys())}
                 )
                 
@@ -543,6 +690,49 @@ def user_profile(request):
             'message': str(e)
         }, status=500)
 
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def bulk_user_profiles(request):
+    """API endpoint to fetch many user profiles at once, optionally limited to selected fields"""
+    try:
+        if request.method == 'GET':
+            user_ids = [value for value in request.GET.get('ids', '').split(',') if value]
+            usernames = [value for value in request.GET.get('usernames', '').split(',') if value]
+            fields = request.GET.get('fields')
+        else:
+            data = json.loads(request.body)
+            user_ids = data.get('ids') or []
+            usernames = data.get('usernames') or []
+            fields = data.get('fields')
+        
+        if not isinstance(user_ids, list) or not isinstance(usernames, list):
+            raise ValueError('ids and usernames must be lists')
+        if not user_ids and not usernames:
+            raise ValueError('ids or usernames are required')
+        if len(user_ids) + len(usernames) > MAX_BULK_PROFILES:
+            raise ValueError(f'At most {MAX_BULK_PROFILES} users per request')
+        fields = parse_fields(fields)
+        
+        # Cache hits cost no queries; all misses together cost one joined query plus a prefetch per selected section
+        payloads, not_found = profile_cache.get_many(user_ids=user_ids, usernames=usernames, fields=fields)
+        
+        return JsonResponse({
+            'status': 'success',
+            'users': payloads,
+            'not_found': not_found
+        })
+        
+    except (ValueError, json.JSONDecodeError) as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
 @csrf_exempt
 @require_http_methods(["GET", "POST", "DELETE"])
 def emergency_contacts(request):
@@ -579,9 +769,57 @@ def emergency_contacts(request):
                 }, status=404)
         
         elif request.method == 'POST':
-            # Add emergency contact
             data = json.loads(request.body)
             username = data.get('username')
+            
+            if 'contacts' in data:
+                # Bulk upsert: contacts are matched by phone; replace=true also removes the ones not listed
+                if not username:
+                    return JsonResponse({
+                        'status': 'error',
+                        'message': 'Username is required'
+                    }, status=400)
+                
+                try:
+                    contacts = parse_contacts(data['contacts'])
+                except ValueError as e:
+                    return JsonResponse({
+                        'status': 'error',
+                        'message': str(e)
+                    }, status=400)
+                
+                try:
+                    user_profile = UserProfile.objects.get(username=username)
+                except UserProfile.DoesNotExist:
+                    return JsonResponse({
+                        'status': 'error',
+                        'message': 'User not found'
+                    }, status=404)
+                
+                saved, created, updated, removed = upsert_contacts(user_profile, contacts, replace=bool(data.get('replace')))
+                if created:
+                    log_activity(
+                        user_profile, 'contact_added',
+                        description=f'{len(created)} emergency contacts added',
+                        metadata={'contact_ids': [str(contact.id) for contact in created]}
+                    )
+                if removed:
+                    log_activity(
+                        user_profile, 'contact_removed',
+                        description=f'{removed} emergency contacts removed',
+                        metadata={'count': removed}
+                    )
+                
+                return JsonResponse({
+                    'status': 'success',
+                    'message': 'Emergency contacts saved successfully',
+                    'created': len(created),
+                    'updated': len(updated),
+                    'removed': removed,
+                    'contacts': [serialize_contact(contact) for contact in saved]
+                })
+            
+            # Add emergency contact
             name = data.get('name')
             phone = data.get('phone')
             relationship = data.get('relationship')
@@ -601,11 +839,11 @@ def emergency_contacts(request):
                     phone=phone,
                     relationship=relationship
                 )
+                profile_cache.invalidate([user_profile.id])
                 
                 # Log contact addition activity
-                UserActivity.objects.create(
-                    user_profile=user_profile,
-                    activity_type='contact_added',
+                log_activity(
+                    user_profile, 'contact_added',
                     description=f'Emergency contact {name} added',
                     metadata={'contact_id': str(contact.id), 'phone': phone}
                 )
@@ -642,11 +880,11 @@ def emergency_contacts(request):
                 contact = EmergencyContact.objects.get(id=contact_id)
                 contact.is_active = False
                 contact.save()
+                profile_cache.invalidate([contact.user_profile_id])
                 
                 # Log contact removal activity
-                UserActivity.objects.create(
-                    user_profile=contact.user_profile,
-                    activity_type='contact_added',
+                log_activity(
+                    contact.user_profile, 'contact_removed',
                     description=f'Emergency contact {contact.name} removed',
                     metadata={'contact_id': str(contact.id)}
                 )
@@ -685,30 +923,56 @@ def update_location(request):
                 'message': 'Username, latitude, and longitude are required'
             }, status=400)
         
+        try:
+            available = parse_bool(data.get('available'), default=True)
+        except ValueError as e:
+            return JsonResponse({
+                'status': 'error',
+                'message': f'available: {e}'
+            }, status=400)
+        
         try:
             user_profile = UserProfile.objects.get(username=username)
             
-            location = UserLocation.objects.create(
+            location = UserLocation(
                 user_profile=user_profile,
                 latitude=latitude,
                 longitude=longitude,
                 address=address,
                 accuracy=accuracy
             )
-            
-            # Log location update activity
-            UserActivity.objects.create(
+            # Coordinates only: the fix itself may be filtered out or compacted away later
+            activity = UserActivity(
                 user_profile=user_profile,
                 activity_type='location_updated',
-                description=f'Location updated to {latitude}, {longitude}',
-                metadata={'latitude': latitude, 'longitude': longitude, 'address': address}
+                description='Location updated',
+                metadata={'latitude': float(latitude), 'longitude': float(longitude)}
+            )
+            
+            # Redundant fixes only move the current position; no history row is kept
+            stored = not trajectory_filter_enabled() or trajectory_filter.should_store(
+                user_profile.id, user_profile.role, latitude, longitude,
+                location.timestamp.timestamp(), accuracy
+            )
+            
+            # Rows are written in batches by the background flusher
+            queued = write_location(location, activity, history=stored)
+            
+            # Keep the live officer index in sync for SOS dispatch
+            officer_index.update_from_profile(
+                user_profile, latitude, longitude,
+                available=available
             )
             
             return JsonResponse({
                 'status': 'success',
                 'message': 'Location updated successfully',
+                'queued': queued,
+                'stored': stored,
                 'location': {
-                    'id': str(location.id),
+                    # No row is kept for filtered fixes; queued rows exist once the next flush commits
+                    'id': str(location.id) if stored else None,
+                    'provisional': queued,
                     'latitude': float(location.latitude),
                     'longitude': float(location.longitude),
                     'address': location.address,
@@ -728,13 +992,381 @@ def update_location(request):
             'message': str(e)
         }, status=500)
 
+@csrf_exempt
+@require_http_methods(["GET"])
+def latest_user_positions(request):
+    """API endpoint returning the current position of every recently active user"""
+    try:
+        role = request.GET.get('role')
+        active_minutes = min(int(request.GET.get('active_minutes', DEFAULT_ACTIVE_MINUTES)), 24 * 60)
+        
+        positions = []
+        for position in latest_positions(role=role, active_minutes=active_minutes):
+            positions.append({
+                'user_id': str(position.user_profile_id),
+                'username': position.user_profile.username,
+                'role': position.user_profile.role,
+                **serialize_position(position)
+            })
+        
+        return JsonResponse({
+            'status': 'success',
+            'count': len(positions),
+            'positions': positions
+        })
+        
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def nearby_users(request):
+    """API endpoint listing users currently within a radius (or bounding box) of a point"""
+    try:
+        role = request.GET.get('role')
+        active_minutes = min(int(request.GET.get('active_minutes', DEFAULT_ACTIVE_MINUTES)), MAX_NEARBY_ACTIVE_MINUTES)
+        page = max(int(request.GET.get('page', 1)), 1)
+        page_size = min(max(int(request.GET.get('page_size', 50)), 1), MAX_NEARBY_PAGE_SIZE)
+        
+        lat = request.GET.get('lat')
+        lng = request.GET.get('lng')
+        bbox = request.GET.get('bbox')
+        if bbox:
+            min_lat, min_lng, max_lat, max_lng = (float(value) for value in bbox.split(','))
+            if min_lat > max_lat or min_lng > max_lng:
+                raise ValueError('bbox must be min_lat,min_lng,max_lat,max_lng')
+            bbox = (min_lat, min_lng, max_lat, max_lng)
+            lat = float(lat) if lat else None
+            lng = float(lng) if lng else None
+            radius_km = None
+        elif lat and lng:
+            lat, lng = float(lat), float(lng)
+            radius_km = min(float(request.GET.get('radius_km', 1)), MAX_NEARBY_RADIUS_KM)
+        else:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Either lat and lng (with radius_km) or bbox is required'
+            }, status=400)
+        
+        matches = nearby_positions(lat, lng, radius_km, bbox=bbox, role=role, active_minutes=active_minutes)
+        start = (page - 1) * page_size
+        
+        return JsonResponse({
+            'status': 'success',
+            'count': len(matches),
+            'page': page,
+            'page_size': page_size,
+            'has_more': start + page_size < len(matches),
+            'users': matches[start:start + page_size]
+        })
+        
+    except ValueError as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def user_track_day(request):
+    """API endpoint returning one user's track for a UTC day, for playback"""
+    try:
+        username = request.GET.get('username')
+        day = parse_date(request.GET.get('date', ''))
+        
+        if not username or day is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Username and date (YYYY-MM-DD) are required'
+            }, status=400)
+        
+        points = day_points(username, day)
+        
+        return JsonResponse({
+            'status': 'success',
+            'date': day.isoformat(),
+            'count': len(points),
+            'points': points
+        })
+        
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
+def parse_since_version(request):
+    """Last acknowledged feed version from the Last-Event-ID or ?since cursor, -1 when absent or stale"""
+    return live_feed.parse_cursor(request.headers.get('Last-Event-ID') or request.GET.get('since'))
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def officer_positions_stream(request):
+    """API endpoint streaming officer position diffs as server-sent events"""
+    config = live_positions_config()
+    if not live_feed.has_stream_capacity():
+        response = JsonResponse({
+            'status': 'error',
+            'message': 'Too many live streams open; poll /api/officers/changes/ instead'
+        }, status=503)
+        response['Retry-After'] = str(config['KEEPALIVE_SECONDS'])
+        return response
+    response = StreamingHttpResponse(
+        live_feed.stream(parse_since_version(request), config['KEEPALIVE_SECONDS'], config['MAX_STREAM_SECONDS']),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def officer_position_changes(request):
+    """API endpoint returning officer position changes since an acknowledged version (long-poll)"""
+    try:
+        since = parse_since_version(request)
+        wait_seconds = min(float(request.GET.get('wait', 0)), MAX_LONG_POLL_SECONDS)
+        
+        version, payload = live_feed.payload_since(since)
+        if payload is None and wait_seconds > 0 and live_feed.wait(since, wait_seconds):
+            version, payload = live_feed.payload_since(since)
+        if payload is None:
+            return JsonResponse({'type': 'diff', 'version': version, 'cursor': live_feed.cursor(version), 'since': since,
+                                 'upserts': [], 'removed': []})
+        
+        return HttpResponse(payload, content_type='application/json')
+        
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def activity_analytics(request):
+    """API endpoint serving activity time-series (or per-cell totals) from the rollup tables"""
+    try:
+        activity_type = request.GET.get('activity_type')
+        granularity = request.GET.get('granularity', 'hour')
+        cell = request.GET.get('cell', '')
+        group_by = request.GET.get('group_by')
+        
+        if activity_type not in dict(UserActivity.ACTIVITY_TYPES):
+            return JsonResponse({
+                'status': 'error',
+                'message': 'A valid activity_type is required'
+            }, status=400)
+        if granularity not in BUCKET_SIZES:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'granularity must be hour or day'
+            }, status=400)
+        
+        now = timezone.now()
+        end = parse_client_timestamp(request.GET.get('end'), now)
+        default_span = timedelta(hours=48) if granularity == 'hour' else timedelta(days=30)
+        start = parse_client_timestamp(request.GET.get('start'), end - default_span)
+        if start >= end:
+            raise ValueError('start must be before end')
+        if (end - start) / BUCKET_SIZES[granularity] > MAX_ANALYTICS_BUCKETS:
+            raise ValueError(f'At most {MAX_ANALYTICS_BUCKETS} buckets per request')
+        
+        result = {
+            'status': 'success',
+            'activity_type': activity_type,
+            'granularity': granularity,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+        }
+        if group_by == 'cell':
+            totals = activity_by_cell(activity_type, granularity, start, end, cell_prefix=cell)
+            result['cells'] = [
+                {'cell': key, 'count': count}
+                for key, count in sorted(totals.items(), key=lambda item: -item[1])
+            ]
+        else:
+            series = activity_series(activity_type, granularity, start, end, cell=cell)
+            result['cell'] = cell or None
+            result['total'] = sum(count for _, count in series)
+            result['series'] = [{'bucket': bucket.isoformat(), 'count': count} for bucket, count in series]
+        
+        return JsonResponse(result)
+        
+    except ValueError as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """API endpoint exposing in-process metrics (queues, flushes, upstream services)"""
+    return JsonResponse({
+        'status': 'success',
+        'metrics': metrics.snapshot()
+    })
+
+def parse_client_timestamp(value, now):
+    """Parse an ISO 8601 string or epoch milliseconds sent by a client into an aware datetime"""
+    if value in (None, ''):
+        return now
+    if isinstance(value, (int, float)):
+        parsed = datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+    else:
+        parsed = parse_datetime(str(value))
+        if parsed is None:
+            raise ValueError(f'Invalid timestamp: {value}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    if parsed > now + MAX_CLIENT_CLOCK_SKEW:
+        return now
+    return parsed
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def update_location_batch(request):
+    """API endpoint to ingest many location fixes, for one or many users, in one transaction"""
+    try:
+        data = json.loads(request.body)
+        default_username = data.get('username')
+        fixes = data.get('fixes', [])
+        
+        if not isinstance(fixes, list) or not fixes:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'A non-empty list of fixes is required'
+            }, status=400)
+        
+        if len(fixes) > MAX_LOCATION_BATCH:
+            return JsonResponse({
+                'status': 'error',
+                'message': f'At most {MAX_LOCATION_BATCH} fixes are allowed per batch'
+            }, status=400)
+        
+        now = timezone.now()
+        rejected = []
+        valid = []
+        for index, fix in enumerate(fixes):
+            try:
+                username = fix.get('username') or default_username
+                latitude = float(fix['latitude'])
+                longitude = float(fix['longitude'])
+                if not username:
+                    raise ValueError('Username is required')
+                if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                    raise ValueError('Coordinates out of range')
+                accuracy = fix.get('accuracy')
+                valid.append((index, username, {
+                    'latitude': round(latitude, 7),
+                    'longitude': round(longitude, 7),
+                    'address': fix.get('address', ''),
+                    'accuracy': float(accuracy) if accuracy is not None else None,
+                    'timestamp': parse_client_timestamp(fix.get('timestamp'), now),
+                }))
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                rejected.append({'index': index, 'message': str(e) or 'Invalid fix'})
+        
+        # Resolve every referenced profile in a single query
+        usernames = {username for _, username, _ in valid}
+        profiles = {p.username: p for p in UserProfile.objects.filter(username__in=usernames)}
+        
+        accepted = []
+        latest = {}
+        for index, username, values in valid:
+            user_profile = profiles.get(username)
+            if user_profile is None:
+                rejected.append({'index': index, 'message': 'User not found'})
+                continue
+            location = UserLocation(user_profile=user_profile, **values)
+            accepted.append(location)
+            if username not in latest or location.timestamp >= latest[username].timestamp:
+                latest[username] = location
+        
+        # Run each user's fixes through the trajectory filter in time order. Fixes newer than
+        # the live track extend it; older (offline-buffered) ones get a filter of their own.
+        locations = accepted
+        if trajectory_filter_enabled():
+            backfill_filter = TrajectoryFilter()
+            locations = []
+            for location in sorted(accepted, key=lambda loc: loc.timestamp):
+                user_profile = location.user_profile
+                t = location.timestamp.timestamp()
+                last_stored = trajectory_filter.last_stored_time(user_profile.id)
+                track = trajectory_filter if last_stored is None or t > last_stored else backfill_filter
+                if track.should_store(user_profile.id, user_profile.role, location.latitude,
+                                      location.longitude, t, location.accuracy):
+                    locations.append(location)
+        
+        # One activity row per user per batch rather than one per fix
+        counts = Counter(location.user_profile.username for location in accepted)
+        activities = []
+        for username, location in latest.items():
+            activity = UserActivity(
+                user_profile=profiles[username],
+                activity_type='location_updated',
+                description=f'{counts[username]} locations uploaded',
+                metadata={'batch': True, 'count': counts[username],
+                          'latitude': float(location.latitude), 'longitude': float(location.longitude)}
+            )
+            activities.append(activity)
+        
+        with transaction.atomic():
+            UserLocation.objects.bulk_create(locations, batch_size=500)
+            save_activities(activities)
+            upsert_current_positions(latest.values())
+        
+        for username, location in latest.items():
+            officer_index.update_from_profile(
+                profiles[username], location.latitude, location.longitude,
+                updated_at=location.timestamp.timestamp()
+            )
+        
+        rejected.sort(key=lambda item: item['index'])
+        return JsonResponse({
+            'status': 'success',
+            'accepted': len(accepted),
+            'stored': len(locations),
+            'rejected': rejected,
+            'latest': {
+                username: {
+                    'latitude': float(location.latitude),
+                    'longitude': float(location.longitude),
+                    'timestamp': location.timestamp.isoformat()
+                }
+                for username, location in latest.items()
+            }
+        })
+        
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def user_activities(request):
-    """API endpoint to get user activities"""
+    """API endpoint to get user activities, newest first, one cursor page at a time"""
     try:
         username = request.GET.get('username')
-        limit = int(request.GET.get('limit', 50))
+        activity_type = request.GET.get('activity_type')
+        # 'limit' is the older name for page_size
+        page_size = parse_page_size(request.GET.get('page_size') or request.GET.get('limit'))
         
         if not username:
             return JsonResponse({
@@ -744,9 +1376,13 @@ def user_activities(request):
         
         try:
             user_profile = UserProfile.objects.get(username=username)
-            activities = []
+            queryset = user_profile.activities.all()
+            if activity_type:
+                queryset = queryset.filter(activity_type=activity_type)
+            page, next_cursor = keyset_page(queryset, request.GET.get('cursor'), page_size)
             
-            for activity in user_profile.activities.all()[:limit]:
+            activities = []
+            for activity in page:
                 activities.append({
                     'id': str(activity.id),
                     'activity_type': activity.activity_type,
@@ -757,7 +1393,9 @@ def user_activities(request):
             
             return JsonResponse({
                 'status': 'success',
-                'activities': activities
+                'activities': activities,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
             })
         except UserProfile.DoesNotExist:
             return JsonResponse({
@@ -765,30 +1403,68 @@ def user_activities(request):
                 'message': 'User not found'
             }, status=404)
         
+    except (InvalidCursor, ValueError) as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
     except Exception as e:
         return JsonResponse({
             'status': 'error',
             'message': str(e)
         }, status=500)
 
-# Initialize geocoder
-geolocator = Nominatim(user_agent="citysafe_route_app")
-
-def get_route_coords(start_lat, start_lon, end_lat, end_lon):
-    """Get route coordinates from OSRM"""
+@csrf_exempt
+@require_http_methods(["GET"])
+def location_history(request):
+    """API endpoint to get a user's stored location fixes, newest first, one cursor page at a time"""
     try:
-        url = f"http://router.project-osrm.org/route/v1/driving/{start_lon},{start_lat};{end_lon},{end_lat}?overview=full&geometries=geojson"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        username = request.GET.get('username')
+        page_size = parse_page_size(request.GET.get('page_size'))
         
-        if data.get('routes') and len(data['routes']) > 0:
-            return data['routes'][0]['geometry']['coordinates']
-        else:
-            return None
+        if not username:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Username is required'
+            }, status=400)
+        
+        try:
+            user_profile = UserProfile.objects.get(username=username)
+            page, next_cursor = keyset_page(user_profile.locations.all(), request.GET.get('cursor'), page_size)
+            
+            locations = []
+            for location in page:
+                locations.append({
+                    'id': str(location.id),
+                    'latitude': float(location.latitude),
+                    'longitude': float(location.longitude),
+                    'address': location.address,
+                    'accuracy': location.accuracy,
+                    'timestamp': location.timestamp.isoformat()
+                })
+            
+            return JsonResponse({
+                'status': 'success',
+                'locations': locations,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
+            })
+        except UserProfile.DoesNotExist:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'User not found'
+            }, status=404)
+        
+    except (InvalidCursor, ValueError) as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
     except Exception as e:
-        print(f"OSRM routing error: {e}")
-        return None
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
 
 @csrf_exempt
 @require_http_methods(["GET"])
@@ -805,8 +1481,8 @@ def get_route_coordinates(request):
             })
 
         # Get lat/lon of source and destination
-        src_location = geolocator.geocode(source)
-        dest_location = geolocator.geocode(destination)
+        src_location = geocode_place(source)
+        dest_location = geocode_place(destination)
 
         if not src_location or not dest_location:
             return JsonResponse({
@@ -814,8 +1490,8 @@ def get_route_coordinates(request):
                 "message": "Could not find one of the locations."
             })
 
-        src_coords = {"lat": src_location.latitude, "lon": src_location.longitude}
-        dest_coords = {"lat": dest_location.latitude, "lon": dest_location.longitude}
+        src_coords = {"lat": src_location[0], "lon": src_location[1]}
+        dest_coords = {"lat": dest_location[0], "lon": dest_location[1]}
 
         # Get full route coordinates
         route_coords = get_route_coords(
@@ -844,6 +1520,38 @@ def get_route_coordinates(request):
             "message": f"An error occurred: {str(e)}"
         })
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def get_batch_route_coordinates(request):
+    """Resolve routes for many source/destination pairs, streamed back as NDJSON"""
+    try:
+        data = json.loads(request.body)
+        pairs = data.get("pairs", [])
+
+        if not isinstance(pairs, list) or not pairs:
+            return JsonResponse({
+                "status": "error",
+                "message": "Please provide a non-empty list of pairs."
+            }, status=400)
+
+        if len(pairs) > MAX_BATCH_PAIRS:
+            return JsonResponse({
+                "status": "error",
+                "message": f"At most {MAX_BATCH_PAIRS} pairs are allowed per batch."
+            }, status=400)
+
+        resolver = RouteBatchResolver(pairs)
+        response = StreamingHttpResponse(resolver.ndjson(), content_type="application/x-ndjson")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    except Exception as e:
+        return JsonResponse({
+            "status": "error",
+            "message": f"An error occurred: {str(e)}"
+        })
+
 def route_page(request):
     """Render an HTML form to collect source and destination and, if provided, display the route on a map."""
     context = {
@@ -864,17 +1572,17 @@ def route_page(request):
             destination = request.GET.get("destination", "").strip()
 
         if source and destination:
-            src_location = geolocator.geocode(source)
-            dest_location = geolocator.geocode(destination)
+            src_location = geocode_place(source)
+            dest_location = geocode_place(destination)
 
             if not src_location or not dest_location:
                 context["error"] = "Could not find one of the locations."
             else:
                 route_coords = get_route_coords(
-                    src_location.latitude,
-                    src_location.longitude,
-                    dest_location.latitude,
-                    dest_location.longitude,
+                    src_location[0],
+                    src_location[1],
+                    dest_location[0],
+                    dest_location[1],
                 )
 
                 if not route_coords:
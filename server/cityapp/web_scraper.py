@@ -9,6 +9,7 @@ import random
 
 class CrimeForecastScraper:
     def __init__(self):
+        # Run as a standalone script without Django settings, so not through cityapp.http_client
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
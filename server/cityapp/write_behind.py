@@ -0,0 +1,200 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'MAX_BATCH': 200,
+    'FLUSH_INTERVAL_MS': 250,
+    'MAX_QUEUE': 10000,
+    # How long a request waits for queue space before writing synchronously instead
+    'PUT_TIMEOUT_MS': 50,
+}
+
+
+class WriteBehindBuffer:
+    """Bounded in-process queue drained in batches by a background flusher thread
+
+    Producers call ``submit``; when the queue stays full for ``put_timeout`` the
+    item is rejected and the caller is expected to write it synchronously, which
+    slows producers down to the rate the database can absorb.
+    """
+
+    def __init__(self, name: str, flush_fn: Callable[[List], None], max_batch=200,
+                 flush_interval_ms=250, max_queue=10000, put_timeout_ms=50):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval_ms / 1000
+        self.put_timeout = put_timeout_ms / 1000
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._flush_latency = metrics.LatencyRecorder()
+        self._stats_lock = threading.Lock()
+        self.stats = {'submitted': 0, 'flushed': 0, 'flushes': 0, 'rejected': 0, 'failed': 0}
+        metrics.register(name, self.snapshot)
+
+    def submit(self, item) -> bool:
+        """Queue an item for the next flush; False means the caller must write it itself"""
+        self._ensure_started()
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            self._count('rejected')
+            return False
+        self._count('submitted')
+        return True
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'{self.name}-flusher', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _drain(self) -> List:
+        batch = []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _write(self, batch):
+        if not batch:
+            return
+        started = time.monotonic()
+        try:
+            self.flush_fn(batch)
+            self._count('flushed', len(batch))
+        except Exception as e:
+            logger.warning('%s: batch of %s failed (%s), retrying row by row', self.name, len(batch), e)
+            # Isolate the bad rows so one invalid item cannot discard the whole batch
+            for item in batch:
+                try:
+                    self.flush_fn([item])
+                    self._count('flushed')
+                except Exception as row_error:
+                    self._count('failed')
+                    logger.error('%s: dropped row: %s', self.name, row_error)
+        finally:
+            self._count('flushes')
+            self._flush_latency.record(time.monotonic() - started)
+
+    def flush(self):
+        """Write everything currently queued, in the calling thread"""
+        with self._flush_lock:
+            while True:
+                batch = self._drain()
+                if not batch:
+                    return
+                self._write(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Give producers until the end of the interval to fill the batch
+            deadline = time.monotonic() + self.flush_interval
+            batch = [first]
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            close_old_connections()
+            with self._flush_lock:
+                self._write(batch)
+        connection.close()
+
+    def stop(self):
+        """Stop the flusher and write whatever is still queued"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval * 4)
+        self.flush()
+
+    def snapshot(self) -> dict:
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_queue': self.max_queue,
+            **dict(self.stats),
+            'flush_latency': self._flush_latency.snapshot(),
+        }
+
+
+def _flush_locations(batch):
+    from .activity_log import save_activities
+    from .models import UserLocation
+    from .positions import upsert_current_positions
+
+    # Fixes dropped by the trajectory filter only move the current position
+    locations = [location for location, _, _ in batch]
+    history = [location for location, _, keep in batch if keep]
+    with transaction.atomic():
+        UserLocation.objects.bulk_create(history)
+        save_activities([activity for _, activity, keep in batch if keep and activity is not None])
+        upsert_current_positions(locations)
+
+
+def buffer_from_settings(name, flush_fn, setting_name):
+    """Build a WriteBehindBuffer configured by DEFAULT_CONFIG overridden with a settings dict"""
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, setting_name, {}))
+    return WriteBehindBuffer(
+        name,
+        flush_fn,
+        max_batch=config['MAX_BATCH'],
+        flush_interval_ms=config['FLUSH_INTERVAL_MS'],
+        max_queue=config['MAX_QUEUE'],
+        put_timeout_ms=config['PUT_TIMEOUT_MS'],
+    )
+
+
+def is_enabled(setting_name) -> bool:
+    return getattr(settings, setting_name, {}).get('ENABLED', DEFAULT_CONFIG['ENABLED'])
+
+
+location_writer = buffer_from_settings('location_writes', _flush_locations, 'LOCATION_WRITE_BEHIND')
+
+
+def write_location(location, activity=None, history=True) -> bool:
+    """Persist a location fix (and its activity row) via the write-behind queue
+
+    With ``history=False`` only the user's current position is updated and no
+    UserLocation/UserActivity rows are written.
+
+    Returns True when the write was queued, False when it was written synchronously
+    because write-behind is disabled or the queue is full.
+    """
+    item = (location, activity, history)
+    if is_enabled('LOCATION_WRITE_BEHIND') and location_writer.submit(item):
+        return True
+    _flush_locations([item])
+    return False
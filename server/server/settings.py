@@ -50,6 +50,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'cityapp.middleware.UpstreamDeadlineMiddleware',
 ]
 
 ROOT_URLCONF = 'server.urls'
@@ -103,6 +104,30 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache (profile payloads, see cityapp/profiles.py). LocMemCache is per process;
+# point this at Redis/Memcached when running several workers so invalidation is shared.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'citysafe',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+}
+
+PROFILE_CACHE_TIMEOUT = 300
+# Seconds an invalidated profile stays uncacheable, covering reads that raced the write
+PROFILE_CACHE_TOMBSTONE_TIMEOUT = 30
+
+# How often each process checks whether the officer roster changed (cityapp/roster.py)
+OFFICER_ROSTER_VERSION_CHECK_SECONDS = 30
+
+# Sessions are read from the cache and written through to the DB (cached_db), so a
+# login costs one session insert and later requests skip the session table. The DB
+# copy keeps sessions valid across restarts and across workers whose per-process
+# LocMemCache has not seen them yet. See cityapp/sessions.py.
+SESSION_ENGINE = 'cityapp.sessions'
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -132,3 +157,110 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+
+# Upstream services (OSRM, Nominatim, Telegram, Gemini)
+# Time budget shared by all upstream calls made while serving one request
+UPSTREAM_REQUEST_BUDGET_SECONDS = 8.0
+
+# Per-service overrides, e.g. {'osrm': {'timeout': 3.0, 'hedge': False}}
+UPSTREAM_SERVICES = {}
+
+# Outbound HTTP connection pools (see cityapp/http_client.py)
+# Connections kept alive per host, with per-host overrides keyed by URL prefix
+OUTBOUND_HTTP_POOL_MAXSIZE = 10
+OUTBOUND_HTTP_POOLS = {}
+
+# Experimental: negotiate HTTP/2 via urllib3 when the h2 package is installed
+OUTBOUND_HTTP2_ENABLED = False
+
+# Write-behind queue for location fixes (see cityapp/write_behind.py)
+LOCATION_WRITE_BEHIND = {
+    'ENABLED': True,
+    'MAX_BATCH': 200,
+    'FLUSH_INTERVAL_MS': 250,
+    'MAX_QUEUE': 10000,
+    'PUT_TIMEOUT_MS': 50,
+}
+
+# Ingest-time trajectory filter for location fixes (see cityapp/trajectory.py);
+# per-role entries override DEFAULT_THRESHOLDS, e.g. {'police': {'min_distance_m': 10}}
+TRAJECTORY_FILTER = {
+    'ENABLED': True,
+}
+
+# Packed per-user-day track blobs, built by compact_locations from finished days (see cityapp/tracks.py)
+LOCATION_TRACK_STORE = {
+    'ENABLED': True,
+}
+
+# Officer position stream for dashboards (see cityapp/live_positions.py)
+LIVE_POSITIONS = {
+    'TICK_MS': 1000,
+    'HISTORY_FRAMES': 120,
+    'KEEPALIVE_SECONDS': 15,
+    'MAX_STREAM_SECONDS': 300,
+    # Open SSE streams per process; each holds a worker thread, so keep it below the server's thread count
+    'MAX_STREAMS': 20,
+}
+
+# Write-behind queue for UserActivity rows and their counters (see cityapp/activity_log.py)
+ACTIVITY_LOG = {
+    'ENABLED': True,
+    'MAX_BATCH': 200,
+    'FLUSH_INTERVAL_MS': 250,
+    'MAX_QUEUE': 10000,
+    'PUT_TIMEOUT_MS': 50,
+}
+
+# Durable SOS delivery queue (see cityapp/sos_queue.py). With RUN_IN_PROCESS the web
+# process delivers; otherwise run `manage.py run_sos_workers` alongside it.
+SOS_QUEUE = {
+    'RUN_IN_PROCESS': True,
+    'WORKERS': 4,
+    'MAX_ATTEMPTS': 8,
+    'BACKOFF_BASE_SECONDS': 2,
+    'BACKOFF_MAX_SECONDS': 300,
+    'LEASE_SECONDS': 60,
+    'POLL_INTERVAL_MS': 1000,
+    # Repeats and storms: see DEFAULT_CONFIG in cityapp/sos_queue.py
+    'DEDUPE_WINDOW_SECONDS': 300,
+    'UPDATE_INTERVAL_SECONDS': 60,
+    'DIGEST_THRESHOLD': 5,
+    'DIGEST_WINDOW_SECONDS': 120,
+    'DIGEST_DELAY_SECONDS': 30,
+    'DIGEST_PRECISION': 5,
+}
+
+# Rate-limited, prioritised Telegram queue (see cityapp/telegram_sender.py)
+TELEGRAM_SENDER = {
+    'GLOBAL_RATE_PER_SECOND': 25,
+    'GLOBAL_BURST': 5,
+    'CHAT_RATE_PER_SECOND': 1,
+    'CHAT_BURST': 3,
+    'SEND_WORKERS': 4,
+    'MAX_RETRIES': 5,
+    'MERGE_MAX_CHARS': 4000,
+}
+
+# Alert fan-out to the police channel and emergency contacts (see cityapp/notifications.py).
+# Contacts are texted through the SMS gateway; until it is configured, e.g.
+# 'TRANSPORTS': {'sms': {'URL': ..., 'API_KEY': ...}}, their deliveries are recorded as 'unconfigured'.
+NOTIFICATIONS = {
+    'CONTACT_TRANSPORTS': ['sms'],
+    'POLICE_TRANSPORT': 'telegram',
+    'FANOUT_WORKERS': 32,
+    'FANOUT_TIMEOUT_SECONDS': 15,
+}
+
+# Background workers (SOS queue, write-behind flushers, upstream guards) report through
+# the 'cityapp' loggers; warnings and errors go to the console
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'cityapp': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}